@@ -26,29 +26,29 @@
 
 
 
+# Home Assistant runs this a lot, mostly to read or set things on the inverter, so startup time matters.
+# Only what the inverter commands need is imported up here.  pandas, requests, the Influx writer and everything
+# that pulls them in are imported in the functions that use them.  See the startup benchmarks in benchmark.py.
 import sys
-import requests
-import pandas as pd
 import datetime
-import pytz
 from argparse import ArgumentParser
-from influxdb_client import InfluxDBClient
-from influxdb_client.client.write_api import SYNCHRONOUS
 import math
+import atexit
 
-try:
-    from pymodbus.client import ModbusTcpClient
-    MODBUS = True
-except:
-    print("If you want to control your inverter with this script you need to install pymodbus")
-    MODBUS = False
-
-import api_key # Create a file called "api_key.py" and put your API key in it.  See api_key.py.example for an example.
+import price_cache
+from inverter import Inverter, MODBUS
+import registers
+import spans
 
 __version__ = "0.1"
 
 max_ac_charge_rate = 2.7 # kW
+max_charge_slots = registers.MAX_CHARGE_SLOTS # Battery first time slots on the inverter
+SLOT_NS = 30 * 60 * 10**9
 inverter_addr = 'ew11-1'
+inverter = None # The shared Inverter connection.  Use get_inverter()
+fleet_members = [] # Every inverter from -i, see fleet.py.  With more than one, programming goes to all of them.
+influx_writer = None # Use get_influx_writer()
 battery_size = None # 13 # kWh
 # cheap = 15 # p/kWh anything below this is cheap.
 # Get gas price from Octopus API.  If electricity is cheaper than gas then use electricity to heat water.
@@ -57,37 +57,82 @@ start_time = None
 end_time = None
 idle_batt_usage = 5 # percent battery used per hour while house is idle
 gas_price = 10.31 # p/kWh TODO: Look this up from the API
+CLOCK_DRIFT_SECONDS = 30 # Only reset the inverter clock when it has drifted further than this
 
 
 class Prices:
-    def __init__(self, start_time = datetime.datetime.utcnow().isoformat(timespec='seconds')+"Z", end_time = None, cheap=15, dummy=False):
-        # TODO: move the product code etc to either a config file or a command line argument, or pull it from the API
-        base_url = "https://api.octopus.energy/v1/"
-        product_code = "AGILE-FLEX-22-11-25"
-        tariff_code = "E-1R-AGILE-FLEX-22-11-25-A" # https://api.octopus.energy/v1/products/AGILE-FLEX-22-11-25
-        agile_price_url = base_url + "products/" + product_code + "/electricity-tariffs/" + tariff_code + "/standard-unit-rates/"
-        agile_price_url += "?period_from=" + start_time
+    @spans.timed('Prices')
+    def __init__(self, start_time = None, end_time = None, cheap=15, dummy=False, use_cache=True, prices_dict=None, tariff=None, rates=None, archive=False):
+        # prices_dict lets you hand in Octopus style results instead of fetching them, e.g. for backtesting.  rates
+        # does the same with a price_parser.UnitRates.
+        # start_time defaults to now.  Worked out here rather than in the signature, where it would be stuck at
+        # whenever the module was imported.
+        # tariff is a region letter or a whole tariff code, see octopus_api.parse_tariff().  Default is region A.
+        # archive reads the prices from the local archive instead of Octopus, see archive.py.  Prices that are
+        # fetched from Octopus are added to it, so if it has nothing for these times we fetch them instead.
+        import octopus_api
+        if start_time is None:
+            start_time = datetime.datetime.utcnow().isoformat(timespec='seconds')+"Z"
+        product_code, tariff_code = octopus_api.parse_tariff(tariff or octopus_api.TARIFF_CODE)
+        if archive and rates is None and prices_dict is None:
+            import archive as price_archive
+            rates = price_archive.unit_rates(price_archive.prices_archive(tariff_code), start_time, end_time)
+            if len(rates.start) == 0:
+                print(f"No archived prices for {tariff_code} from {start_time}, fetching them from Octopus")
+                rates = None
+        if rates is None:
+            print("URL: " + octopus_api.unit_rates_url(product_code, tariff_code))
         if end_time is not None:
-            agile_price_url += "&period_to=" + end_time.isoformat() + "Z"
-        print("URL: " + agile_price_url)
-        r = requests.get(agile_price_url)
-        self.prices_dict = r.json()
+            end_time = end_time.isoformat() + "Z"
+        # This follows the "next" links, so ranges longer than one page of results aren't truncated
+        fetch_fn = lambda period_from, period_to: octopus_api.fetch_unit_rates(period_from, period_to, product_code, tariff_code)
+        fetched = prices_dict is None and rates is None
+        if rates is not None:
+            self.prices_dict = None
+        elif prices_dict is not None:
+            self.prices_dict = prices_dict
+        elif use_cache:
+            # Published prices never change, so only ask Octopus for the half hours we haven't seen before
+            self.prices_dict = price_cache.get_unit_rates(tariff_code, start_time, end_time, lambda period_from, period_to: fetch_fn(period_from, period_to)['results'])
+        else:
+            self.prices_dict = fetch_fn(start_time, end_time)
         #self.two_hour_windows = None
         #self.four_hour_windows = None
         #self.cheapest_30min_slots = None
         #self.economy_slots = None
         self.cheap = cheap
         self.dummy = dummy
-        self.build_dataframe()
-    
-    def build_dataframe(self):
+        self.build_dataframe(rates)
+        if fetched:
+            self.add_to_archive(tariff_code)
+
+    def add_to_archive(self, tariff_code):
+        import archive as price_archive
+        try:
+            added = price_archive.add_rates(price_archive.prices_archive(tariff_code), self.rates)
+        except (OSError, ValueError) as e:
+            # It's only history, don't let it stop us programming the inverter
+            print(f"Couldn't archive the prices: {e}")
+            return 0
+        if added:
+            print(f"{added} new prices archived")
+        return added
+
+    @spans.timed()
+    def build_dataframe(self, rates=None):
         # TODO: Consider rounding prices to an integer number of pence. It should make contiguous blocks easier to find and cost basically nothing extra.
-        start_time    = pd.DatetimeIndex(x['valid_from'] for x in self.prices_dict['results'])
-        end_time      = pd.DatetimeIndex(x['valid_to'] for x in self.prices_dict['results'])
-        value_inc_vat = [x['value_inc_vat'] for x in self.prices_dict['results']]
-        self.prices = pd.DataFrame({'start_time':start_time, 'end_time': end_time, 'value_inc_vat': value_inc_vat})
-        self.prices['duration'] = self.prices.end_time - self.prices.start_time
-        self.prices.sort_values(by="start_time", inplace=True)
+        # Already sorted by start time, see price_parser.py
+        # The slot pickers work on self.series, a PriceSeries of the same prices, see price_series.py
+        import price_parser
+        from price_series import PriceSeries
+        if rates is None:
+            rates = price_parser.parse_results(self.prices_dict['results'])
+        self.rates = rates
+        if len(rates.gaps):
+            print(f"Warning: {len(rates.gaps)} gaps in the prices")
+        self.prices = price_parser.to_frame(rates)
+        self.series = PriceSeries.from_rates(rates)
+        self.windows = {} # Cheapest windows keyed by number of slots.  See get_windows()
         self.min_price = self.prices[self.prices.value_inc_vat == self.prices.value_inc_vat.min()] # Keep it as a frame to keep the start and end times
         self.max_price = self.prices[self.prices.value_inc_vat == self.prices.value_inc_vat.max()]
         self.avg_price = self.prices.mean(numeric_only=True).values[0]
@@ -99,10 +144,18 @@ class Prices:
         #self.get_two_hour_windows()
         #self.get_four_hour_windows()
         #self.get_cheapest_30min_slots()
-        print(f"Cheapest 2 hour window: {self.get_two_hour_windows().head(1).value_inc_vat.values[0]:.2f}p/kWh \t{self.get_two_hour_windows().head(1).start_time.values[0]} to {self.get_two_hour_windows().head(1).end_time.values[0]}")
-        print(f"Cheapest 4 hour window: {self.get_four_hour_windows().head(1).value_inc_vat.values[0]:.2f}p/kWh \t{self.get_four_hour_windows().head(1).start_time.values[0]} to {self.get_four_hour_windows().head(1).end_time.values[0]}")
+        two_hour_window = self.get_two_hour_windows().head(1)
+        four_hour_window = self.get_four_hour_windows().head(1)
+        print(f"Cheapest 2 hour window: {two_hour_window.value_inc_vat.values[0]:.2f}p/kWh \t{two_hour_window.start_time.values[0]} to {two_hour_window.end_time.values[0]}")
+        print(f"Cheapest 4 hour window: {four_hour_window.value_inc_vat.values[0]:.2f}p/kWh \t{four_hour_window.start_time.values[0]} to {four_hour_window.end_time.values[0]}")
         print("\n")
 
+    def slots(self, which):
+        # Rows of self.prices for an index or mask from self.series, as a frame of their own that's safe to change
+        if which.dtype == bool:
+            which = which.nonzero()[0]
+        return self.prices.take(which)
+
     def get_min_price(self):
         return self.min_price.iloc[0]['value_inc_vat']
     def get_max_price(self):
@@ -110,59 +163,92 @@ class Prices:
     def get_avg_price(self):
         return self.avg_price
     
+    @spans.timed()
+    def get_windows(self, duration, count=None):
+        # This finds the cheapest contiguous windows of any length (a pandas Timedelta, in multiples of 30 minutes), cheapest first.
+        # Only windows cheaper than the average price are kept, and they don't overlap each other.
+        # Each duration is only worked out once.  You get a copy back so it's safe to mess with it.
+        import numpy as np
+        import pandas as pd
+        from windows import non_overlapping_windows, window_means
+        duration = pd.Timedelta(duration)
+        slots_per_window = duration / pd.Timedelta('30m')
+        if slots_per_window < 1 or slots_per_window != int(slots_per_window):
+            raise ValueError(f"Window duration must be a multiple of 30 minutes, not {duration}")
+        slots_per_window = int(slots_per_window)
+        if slots_per_window not in self.windows:
+            last_slot, means = window_means(self.prices.start_time.values.view('i8'), self.prices.value_inc_vat.to_numpy(dtype=float), slots_per_window)
+            # The windows no dearer than average, cheapest first, sorted as arrays before there's a frame to sort
+            order = np.flatnonzero(means <= self.avg_price)
+            order = order[np.argsort(means[order], kind='stable')]
+            windows = self.prices.iloc[last_slot[order]][['start_time']].copy()
+            windows['value_inc_vat'] = means[order]
+            self.windows[slots_per_window] = non_overlapping_windows(windows, duration - pd.Timedelta('30m'))
+        windows = self.windows[slots_per_window].copy()
+        if count is not None:
+            windows = windows.head(count)
+        return windows
+
+    @spans.timed()
     def get_two_hour_windows(self):
         # This finds a contiguous 2 hour window that is the cheapest.
-        two_hour_windows = self.prices.rolling('2h', min_periods=4, on='start_time').mean(numeric_only=True)
-        two_hour_windows.dropna(inplace=True)
-        two_hour_windows.sort_values(by='value_inc_vat', inplace=True)
-        two_hour_windows.drop(two_hour_windows[two_hour_windows.value_inc_vat > self.avg_price].index, inplace=True)
-        two_hour_windows = remove_overlap(two_hour_windows, pd.Timedelta('1h30m'))
-        two_hour_windows = add_window_bounds(two_hour_windows, pd.Timedelta('1h30m'))
-        #self.two_hour_windows = two_hour_windows
-        return two_hour_windows
+        return self.get_windows(datetime.timedelta(hours=2))
     
+    @spans.timed()
     def get_four_hour_windows(self):
         # This finds a contiguous 4 hour window that is the cheapest.
-        four_hour_windows = self.prices.rolling('4h', min_periods=8, on='start_time').mean(numeric_only=True)
-        four_hour_windows.dropna(inplace=True)
-        four_hour_windows.sort_values(by='value_inc_vat', inplace=True)
-        four_hour_windows.drop(four_hour_windows[four_hour_windows.value_inc_vat > self.avg_price].index, inplace=True)
-        four_hour_windows = remove_overlap(four_hour_windows, pd.Timedelta('3h30m'))
-        four_hour_windows = add_window_bounds(four_hour_windows, pd.Timedelta('3h30m'))
+        four_hour_windows = self.get_windows(datetime.timedelta(hours=4))
         self.four_hour_windows = four_hour_windows
         # If the average 4 hour unit price is lower than "cheap" then reset cheap to be the average 4 hour unit price.
         #if four_hour_windows.value_inc_vat.mean() < self.cheap:
         self.cheap = four_hour_windows.value_inc_vat.mean()
         return four_hour_windows
     
+    @spans.timed()
     def get_cheapest_30min_slots(self):
         # This finds 30 min slots that are cheaper than the average 4 hour unit price.
-        cheapest_30min_slots = self.prices.sort_values(by="value_inc_vat").drop(self.prices[self.prices.value_inc_vat > self.cheap].index)
+        cheapest_30min_slots = self.slots(self.series.sorted_by_price(self.series.at_most(self.cheap)))
         # This self-adjusting cheap price is a bit risky I think. e.g. what if we have two negative slots in a row, it could throw the average. 
         #  We'll have to see how it goes.  See the four hour window section for how it's calculated.
         #self.cheapest_30min_slots = cheapest_30min_slots
         return cheapest_30min_slots
     
+    @spans.timed()
     def get_cheapest_n_slots(self, num_slots, start_time=None, end_time=None):
         # TODO: This is badly named.  It's not the "cheapest" it's actually slots which are lower price than the average 4 hour price
         # TODO: it also ignores the start and end time.  Perhaps that's ok. 
-        slots = self.get_cheapest_30min_slots()
-        slots.sort_values(by="value_inc_vat", inplace=True)
-        slots = slots.head(num_slots)
-        slots = slots.reset_index(drop=True)
-        return slots
+        return self.slots(self.series.cheapest(num_slots, self.series.at_most(self.cheap))).reset_index(drop=True)
     
+    @spans.timed()
     def get_all_slots_between(self, start_time, end_time):
         # This returns all slots between two times.
-        slots = self.prices[self.prices.start_time >= start_time]
-        slots = slots[slots.end_time <= end_time]
+        slots = self.slots(self.series.between(start_time, end_time - datetime.timedelta(minutes=30)))
         # print(f"In get_all_slots_between, start_time: {start_time}, end_time: {end_time}")
         # print(f"Slots: {slots}")
         return slots
+
+    @spans.timed()
+    def get_charge_slots(self, energy_kwh=0, start_time=None, end_time=None, max_runs=None, charge_rate=None, slots_needed=None):
+        # The cheapest half hours between start_time and end_time that add energy_kwh to the battery (or exactly
+        # slots_needed of them), chosen so that they fit in max_runs inverter time slots.  See optimiser.py
+        # max_runs and charge_rate default to max_charge_slots and max_ac_charge_rate as they are now, not as they
+        # were when this module was imported.
+        import optimiser
+        if max_runs is None:
+            max_runs = max_charge_slots
+        if charge_rate is None:
+            charge_rate = max_ac_charge_rate
+        slots = optimiser.cheapest_charge_slots(self.prices, energy_kwh, charge_rate, max_runs, start_time, end_time, slots_needed=slots_needed)
+        return slots.reset_index(drop=True)
     
-    def get_economy_slots(self, start_time=datetime.datetime.utcnow().replace(tzinfo=pytz.utc), end_time=None, max_slots=48):
+    @spans.timed()
+    def get_economy_slots(self, start_time=None, end_time=None, max_slots=48):
         # The goal of this function is to return a dataframe of the cheapest slots between 19:00 and 07:00
         # i.e. how can we charge the battery before tomorrow morning?
+        # start_time defaults to now
+        import numpy as np
+        if start_time is None:
+            start_time = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
         max_slots = int(max_slots)
         print(f"Max slots: {max_slots}")
         print(f"Start time: {start_time}")
@@ -170,19 +256,16 @@ class Prices:
             end_time = start_time + datetime.timedelta(days=1)
         end_time = end_time - datetime.timedelta(minutes=30) # So we don't overrun the end time.
         print(f"End time: {end_time}")
-        cheap_30min_slots = self.prices.sort_values(by="value_inc_vat").drop(self.prices[self.prices.value_inc_vat > self.cheap].index)
-        self.cheap_30min_slots = cheap_30min_slots
-        if cheap_30min_slots.empty:
+        cheap = self.series.at_most(self.cheap)
+        if not cheap.any():
             print("Error: No cheap slots found.\nThis means that the cheapest four hour slot found was the cheapest overall slot.")
-            return cheap_30min_slots# Maybe return the 4 hour slot here?  Perhaps better to catch an empty list in the calling function.
-        index = pd.DatetimeIndex(cheap_30min_slots.start_time)
+            return self.slots(cheap)# Maybe return the 4 hour slot here?  Perhaps better to catch an empty list in the calling function.
         #economy_slots = cheap_30min_slots.iloc[index.indexer_between_time(between_start_time, between_end_time)].sort_values(by="start_time").head(max_slots)
         # Sort by cost so that we actually get the cheapest slots first
         #economy_slots = cheap_30min_slots.iloc[index.indexer_between_time(between_start_time, between_end_time)].sort_values(by="value_inc_vat").head(max_slots)
-        mask = (cheap_30min_slots['start_time'] >= start_time) & (cheap_30min_slots['start_time'] <= end_time)
-        economy_slots = cheap_30min_slots.loc[mask].sort_values(by="value_inc_vat").head(max_slots)
-        economy_slots.sort_values(by="start_time", inplace=True)
-        economy_slots.reset_index(drop=True, inplace=True)
+        # The cheapest max_slots of them, back in time order
+        chosen = self.series.cheapest(max_slots, cheap & self.series.between(start_time, end_time))
+        economy_slots = self.slots(np.sort(chosen)).reset_index(drop=True)
         #economy_slots['grp_time'] = economy_slots.end_time.diff().dt.seconds.gt(1800).cumsum()
         #economy_slots = economy_slots.groupby('grp_time').agg({'start_time': 'min', 'end_time': 'max', 'value_inc_vat': 'mean'})
         #print(f"Economy slots: {economy_slots}")
@@ -193,30 +276,30 @@ class Prices:
         #self.economy_slots = economy_slots
         return economy_slots
     
+    @spans.timed()
     def get_free_slots(self):
-        free_slots = self.prices.sort_values(by="value_inc_vat").drop(self.prices[self.prices.value_inc_vat > 0].index)
-        free_slots.sort_values(by="start_time", inplace=True)
-        free_slots.reset_index(drop=True, inplace=True)
+        free_slots = self.slots(self.series.at_most(0)).reset_index(drop=True)
         return free_slots
 
+    @spans.timed()
     def get_super_cheap_slots(self):
         # The purpose of this function is to find those times where electricity is really cheap.
         # Specifically, cheaper than gas.  We will then use this to switch the inverter to batt first mode
         # charging the battery from the grid and switching the house to consume from the grid during this time as well.
         # Then you can heat your hot water etc from electricity.  Perhaps even getting paid to do so.
         super_cheap = 10.31 # TODO: Pull this from the API instead of hard coding it.
-        super_cheap_slots = self.prices.sort_values(by="value_inc_vat").drop(self.prices[self.prices.value_inc_vat > super_cheap].index)
+        super_cheap_slots = self.slots(self.series.sorted_by_price(self.series.at_most(super_cheap)))
         return super_cheap_slots
     
+    @spans.timed()
     def write_to_influxdb(self, dummy=False):
         if dummy: return False
-        # You need the index to be a time column otherwise InfluxDB will not accept it. (e.g. index "0" = epoch zero = 1970-01-01 00:00:00 = a long time ago = outside the RP of the bucket)
-        influx_df = self.prices.set_index('start_time')
-        influx_df.drop(columns=['duration'], inplace=True)
-        with InfluxDBClient(url=api_key.influxdb_url, token=api_key.influxdb_token, org=api_key.influxdb_org) as client:
-            write_api = client.write_api(write_options=SYNCHRONOUS)
-            write_api.write(bucket=api_key.influxdb_bucket, record=influx_df, data_frame_measurement_name='agile_prices')
-        print("Prices written to InfluxDB")
+        # This only queues the prices.  They are written in the background, leaving out any that Influx already
+        # has, and the writer is flushed when we exit.  See influx_writer.py
+        from influx_writer import price_lines
+        queued = get_influx_writer().write(price_lines(self.prices))
+        print(f"{queued} new prices queued for InfluxDB")
+        return queued
 
 def merge_slots(slots):
     # This merges slots that are contiguous. It means that we use fewer programming slots on the inverter.
@@ -235,26 +318,116 @@ def merge_slots(slots):
     print(f"Merged slots:\n {slots}")
     return slots
 
-def write_to_inverter(register, values_list, dummy=True):
+def economy_charge_slots(prices, now=None):
+    # The --economy schedule: the cheap slots over the next 24 hours, merged.  now defaults to now.
+    if now is None:
+        now = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
+    eco = prices.get_economy_slots(start_time=now)
+    if not eco.empty:
+        # Same amount of charging, but in no more runs than the inverter can hold
+        eco = prices.get_charge_slots(start_time=now, end_time=now + datetime.timedelta(days=1), slots_needed=len(eco))
+    return merge_slots(eco)
+
+def get_influx_writer():
+    # One background writer for the whole run, flushed on the way out
+    global influx_writer
+    if influx_writer is None:
+        import api_key # Create a file called "api_key.py" and put your API key in it.  See api_key.py.example for an example.
+        from influx_writer import InfluxWriter
+        influx_writer = InfluxWriter(api_key.influxdb_url, api_key.influxdb_token, api_key.influxdb_org, api_key.influxdb_bucket)
+        atexit.register(influx_writer.close)
+    return influx_writer
+
+def get_inverter():
+    # Everything shares one connection to the inverter for the whole run rather than connecting for every register
+    global inverter
+    if inverter is None:
+        inverter = Inverter(inverter_addr)
+        atexit.register(inverter.close)
+    return inverter
+
+def write_to_inverter(register, values_list, dummy=True, inv=None):
+    # inv is the Inverter to use, by default the shared one
     if MODBUS is True and dummy is False:
-        client = ModbusTcpClient(inverter_addr)
-        client.connect()
-        client.write_registers(register, values_list, slave=1)
-        client.close()
+        (inv or get_inverter()).write_registers(register, values_list)
         return True
     else:
         print("Not actually writing to inverter")
     return False
 
-def sync_inverter_time(dummy=True):
+def sync_inverter_time(dummy=True, inv=None):
     system_now = datetime.datetime.utcnow() # Keep the inverter in UTC.  The Agile prices are all in UTC
     time_list = [system_now.year-2000, system_now.month, system_now.day, system_now.hour, system_now.minute, system_now.second]
-    write_to_inverter(45, time_list, dummy=dummy)
-
-def zero_charging_slots(dummy=True):
-    write_to_inverter(1100, [0]*9, dummy)
-    write_to_inverter(1018, [0]*9, dummy)
-    write_to_inverter(1080, [0]*3, dummy)
+    write_to_inverter(45, time_list, dummy=dummy, inv=inv)
+
+def zero_charging_slots(dummy=True, cache=None):
+    program_all(lambda slots_available: charge_slot_registers([], slots_available), dummy, cache=cache)
+
+def charge_slot_registers(charging_slots_list, slots_available=None):
+    # {holding register: value} for the battery first slots and the grid first slot.  charging_slots_list is
+    # [encoded start, encoded end, enabled] for each slot.  Only the first slots_available (by default
+    # max_charge_slots) battery first slots are ours: unused ones are zeroed and the rest are left alone, e.g. for
+    # Home Assistant.
+    if slots_available is None:
+        slots_available = max_charge_slots
+    if len(charging_slots_list) > slots_available:
+        print(f"Warning: {len(charging_slots_list)} charge slots but the inverter only has {slots_available}.  Dropping the last {len(charging_slots_list) - slots_available}")
+    desired = {}
+    for i in range(slots_available):
+        slot = charging_slots_list[i] if i < len(charging_slots_list) else [0, 0, 0]
+        first_register = registers.charge_slot_address(i)
+        for offset, value in enumerate(slot):
+            desired[first_register + offset] = value
+    for i in range(3):
+        desired[1080 + i] = 0
+    return desired
+
+def program_all(desired_fn, dummy=True, sync_clock=False, cache=None):
+    # desired_fn(slots_available) gives the {holding register: value} to program.  With a fleet every inverter is
+    # programmed at the same time, see fleet.py.  cache is the plan_cache.PlanCache that remembers which plan is on
+    # the real inverter, None when it isn't the real inverter (e.g. backtest.py's fake).
+    if cache is not None and not dummy:
+        # Whatever was there isn't a cached plan any more, see program_plan()
+        cache.forget_programmed()
+    if len(fleet_members) > 1:
+        import fleet
+        results = fleet.program(fleet_members, desired_fn, dummy, sync_clock)
+        fleet.report(results, "programmed")
+        return results
+    slots_available = fleet_members[0].charge_slots if fleet_members else max_charge_slots
+    return program_inverter(desired_fn(slots_available), dummy, sync_clock)
+
+def program_inverter(desired, dummy=True, sync_clock=False, inv=None):
+    # desired is {holding register: value}.  Read back what's already on the inverter (along with the clock if
+    # we're syncing it) and only write the registers that are different.  Re-running with the same schedule then
+    # costs a couple of reads and no writes, which is kinder to the inverter's flash.  inv is the Inverter to
+    # program, by default the shared one.
+    current = {}
+    inverter_now = None
+    if MODBUS:
+        ranges = [(registers.HOLDING, register, 1) for register in desired]
+        if sync_clock:
+            ranges.append((registers.HOLDING, 45, 7))
+        values = registers.read_ranges(inv or get_inverter(), ranges)
+        for register in desired:
+            current[register] = values[(registers.HOLDING, register)]
+        if sync_clock:
+            inverter_now = registers.decode_clock([values[(registers.HOLDING, 45 + i)] for i in range(7)])
+    writes = registers.diff_writes(current, desired)
+    if not writes:
+        print("Inverter already has these settings, nothing to write")
+    for register, values_list in writes:
+        print(f"Writing {values_list} to register {register}")
+        write_to_inverter(register, values_list, dummy, inv)
+    if sync_clock:
+        if inverter_now is None:
+            sync_inverter_time(dummy, inv)
+        else:
+            drift = abs((datetime.datetime.utcnow() - inverter_now).total_seconds())
+            print(f"Inverter clock is {drift:.0f} seconds out")
+            if drift > CLOCK_DRIFT_SECONDS:
+                sync_inverter_time(dummy, inv)
+    return writes
 
 
 def get_battery_size():
@@ -262,11 +435,8 @@ def get_battery_size():
     #print("Reading battery count")
     if not MODBUS:
         return False
-    client = ModbusTcpClient(inverter_addr)
-    client.connect()
-    results = client.read_input_registers(1110, 1, slave=1) # 1110 is the register for the number of battery modules
-    client.close()
-    return results.registers[0] * 6.5 # 6.5kWh per battery module
+    results = get_inverter().read_input_registers(1110, 1) # 1110 is the register for the number of battery modules
+    return results[0] * 6.5 # 6.5kWh per battery module
 
 def get_battery_soc():
     # TODO:  Move all inverter functions to a class. This function should be a method of that class.
@@ -274,49 +444,22 @@ def get_battery_soc():
     if not MODBUS:
         return False
     # Battery state of charge s held in register 1014
-    client = ModbusTcpClient(inverter_addr)
-    client.connect()
-    results = client.read_input_registers(1014, 1, slave=1)
-    client.close()
-    return results.registers[0]
+    results = get_inverter().read_input_registers(1014, 1)
+    return results[0]
 
 def get_current_charging_slots():
     if not MODBUS:
         return False
-    client = ModbusTcpClient(inverter_addr)
-    client.connect()
-    charging_slots = []
-    discharging_slots = []
-    charging_slots.extend(client.read_holding_registers(1100, 9, slave=1).registers)
-    discharging_slots.extend(client.read_holding_registers(1080, 3, slave=1).registers)
-    t = client.read_holding_registers(1018, 9, slave=1)
-    print(t.registers)
-    #charging_slots.extend(t.registers)
-    charging_slots.extend(client.read_holding_registers(1018, 9, slave=1).registers) # Looks like the docs are wrong here. 1018 is the start of the charging slots not 1017 
-    #charging_slots.extend(client.read_holding_registers(1018, 9, slave=1).registers) # Looks like the docs are wrong here. 1018 is the start of the charging slots not 1017 
-    charge_limit = client.read_holding_registers(1091, 1, slave=1).registers[0]
-    discharge_limit = client.read_holding_registers(1071, 1, slave=1).registers[0]
-    discharge_power = client.read_holding_registers(1070, 1, slave=1).registers[0]
-    
-    ac_charge_enabled = client.read_holding_registers(1092, 1, slave=1).registers[0]
-    results = client.read_holding_registers(45, 7, slave=1)
-    year, month, day, hour, minute, second, dow = results.registers
-    inverter_now = datetime.datetime(year, month, day, hour, minute, second)
-    client.close()
-
-    charge_slots_list = []
-    for i in range(0, len(charging_slots), 3):
-        start_time = datetime.time(charging_slots[i] >> 8, charging_slots[i] & 255)
-        end_time = datetime.time(charging_slots[i+1] >> 8, charging_slots[i+1] & 255)
-        enabled = charging_slots[i+2]
-        charge_slots_list.append([start_time, end_time, enabled])
-
-    discharge_slots_list = []
-    for i in range(0, len(discharging_slots), 3):
-        start_time = datetime.time(discharging_slots[i] >> 8, discharging_slots[i] & 255)
-        end_time = datetime.time(discharging_slots[i+1] >> 8, discharging_slots[i+1] & 255)
-        enabled = discharging_slots[i+2]
-        discharge_slots_list.append([start_time, end_time, enabled])
+    # All of this comes back in two block reads rather than one request per register.  See registers.py
+    current = registers.read_registers(get_inverter(), ['charge_slots_1_3', 'charge_slots_4_6', 'discharge_slot', 'charge_stop_soc',
+                                                        'discharge_stop_soc', 'discharge_power', 'ac_charge_enabled', 'inverter_time'])
+    charge_slots_list = current['charge_slots_1_3'] + current['charge_slots_4_6']
+    discharge_slots_list = current['discharge_slot']
+    charge_limit = current['charge_stop_soc']
+    discharge_limit = current['discharge_stop_soc']
+    discharge_power = current['discharge_power']
+    ac_charge_enabled = current['ac_charge_enabled']
+    inverter_now = current['inverter_time']
 
     print("\nCharge slots:")
     for each in charge_slots_list:
@@ -332,52 +475,42 @@ def get_current_charging_slots():
     print(f"Discharge min: {discharge_limit}")
     print(f"Discharge power: {discharge_power}")
 
-def set_charging(slots, dummy=True):
+def set_charging(slots, dummy=True, cache=None):
+    # Returns False, having written nothing, if the slots can't be programmed at all.  Slots past the number the
+    # inverter has are dropped from the end by charge_slot_registers().
     print("Setting charging")
-    charging_slots_list = []
-    slots.sort_values(by="start_time", inplace=True)
-    slots.reset_index(drop=True, inplace=True)
-    for r in slots.itertuples():
-        start_hour = int(r.start_time.strftime('%H'))
-        start_minute = int(r.start_time.strftime('%M'))
-        end_hour = int(r.end_time.strftime('%H'))
-        end_minute = int(r.end_time.strftime('%M'))
-        print(f"Charging from {start_hour}:{start_minute} to {end_hour}:{end_minute}")
-        encoded_start_time = start_hour << 8 | start_minute
-        encoded_end_time = end_hour << 8 | end_minute
-        print(f"Encoded start time: {encoded_start_time}")
-        print(f"Encoded end time: {encoded_end_time}")
-        charging_slots_list.append([encoded_start_time, encoded_end_time, 1])
-    sync_inverter_time(dummy)
-    zero_charging_slots(dummy)
-    a,b = [],[]
-    for slot in charging_slots_list[0:3]:
-        a.extend(slot)
-    for slot in charging_slots_list[3:6]:
-        b.extend(slot)
-    print(a)
-    print(b)
-    write_to_inverter(1100, a, dummy)
-    write_to_inverter(1018, b, dummy)
-
-def set_max_soc(soc, dummy):
+    slots = slots.sort_values(by="start_time").reset_index(drop=True)
+    # Half hours since the epoch.  The inverter's clock is UTC, same as the prices.
+    starts, start_offset = divmod(slots.start_time.values.view('i8'), SLOT_NS)
+    ends, end_offset = divmod(slots.end_time.values.view('i8'), SLOT_NS)
+    if start_offset.any() or end_offset.any():
+        # Whatever's on the inverter now is a better bet than times nobody asked for
+        print(f"Charge slots have to start and end on the half hour, leaving the inverter's charge slots as they are\n{slots}")
+        return False
+    usable, unusable = registers.usable_slots(starts, ends)
+    for start, end in unusable:
+        print(f"Warning: dropping charge slot {registers.format_slot(start, end)}, the inverter can't hold it alongside the earlier ones")
+    charging_slots_list = registers.compile_slots([start for start, end in usable], [end for start, end in usable], len(usable))
+    for start, end, enabled in charging_slots_list:
+        print(f"Charging from {registers.decode_time(start):%H:%M} to {registers.decode_time(end):%H:%M}")
+    print(charging_slots_list)
+    # Unused slots and the grid first slot are zeroed, same as zero_charging_slots() used to do before every program
+    program_all(lambda slots_available: charge_slot_registers(charging_slots_list, slots_available), dummy, sync_clock=True, cache=cache)
+
+def set_max_soc(soc, dummy, cache=None):
     if soc < 1:
         print(f"Invalid SOC: {soc}")
         return False
     if soc > 100:
         soc = 100
     print(f"Setting max SOC to {soc}%")
-    write_to_inverter(1091, [soc], dummy)
+    program_all(lambda slots_available: {1091: soc}, dummy, cache=cache)
 
 def get_local_load_today():
     if not MODBUS:
         return False
-    client = ModbusTcpClient(inverter_addr)
-    client.connect()
-    results = client.read_input_registers(1060, 2, slave=1).registers
-    #batt_charge = client.read_input_registers(1056, 2, slave=1).registers
-    client.close()
-    inv1 = results[0] << 16 | results[1]
+    inv1 = get_inverter().read_input_u32(1060)
+    #batt_charge = get_inverter().read_input_u32(1056)
     # int is close enough precision for my purposes
     print(f"Local load today: {int(inv1/10)}")
     return int(inv1/10)
@@ -388,29 +521,38 @@ def get_lifetime_average_load():
     # This suggests that 3/4 of the power usage is during the day, which makes sense.
     if not MODBUS:
         return False
-    client = ModbusTcpClient(inverter_addr)
-    client.connect()
-    runtime    = client.read_input_registers(57, 2, slave=1).registers
-    total_load = client.read_input_registers(1062, 2, slave=1).registers
-    client.close()
-    runtime = ((runtime[0] << 16 | runtime[1]) / 2) / 60 / 60 # Reading is in 0.5 second increments.  Convert to hours.
-    total_load = (total_load[0] << 16 | total_load[1]) / 10 # Reading is in 0.1kWh increments.  Convert to kWh.
+    current = registers.read_registers(get_inverter(), ['runtime', 'load_total'])
+    runtime    = current['runtime']
+    total_load = current['load_total']
+    runtime = (runtime / 2) / 60 / 60 # Reading is in 0.5 second increments.  Convert to hours.
+    total_load = total_load / 10 # Reading is in 0.1kWh increments.  Convert to kWh.
     print(f"Total inverter running time: {runtime} hours\nTotal load: {total_load} kWh")
     average_load = total_load / runtime
     print(f"Average load: {average_load} kWh")
     return average_load
 
+def get_load_forecast(now=None):
+    # Expected kWh for each of the next 48 half hours from the telemetry poller's history, see load_profile.py.
+    # None until there's enough of it, in which case we fall back to the old guesses.
+    import load_profile
+    return load_profile.load_forecast(now)
+
 def convert_to_local_timezone(slots):
+    import pytz
     local_tz = pytz.timezone("Europe/London")
     slots["start_time"] = slots["start_time"].dt.tz_convert(local_tz)
     slots["end_time"]   = slots["end_time"].dt.tz_convert(local_tz)
     return slots
 
+def parse_inverter(spec):
+    import fleet
+    return fleet.parse_member(spec)
+
 def parse_args():
     parser = ArgumentParser(description="Control Growatt SPH inverters and batteries to charge the battery at the cheapest time possible using Agile Octopus.")
     programming_group = parser.add_argument_group("Charge Programming")
     programming_group.add_argument("-z", "--zero", dest="zero", help="Zero out the battery charging schedule", action="store_true")
-    programming_group.add_argument("-d", "--duration", dest="duration", help="Set the duration of the charge in minutes.  Default is 240 (4 hours)", default=240, type=int)
+    programming_group.add_argument("-d", "--duration", dest="duration", help="Set the duration of the charge in minutes for --window.  Any multiple of 30.  Default is 240 (4 hours)", default=240, type=int)
     programming_group.add_argument("-st", "--start-time", dest="start_time", help="Set the earliest time to search for a slot for the charge.", type=datetime.datetime.fromisoformat)
     programming_group.add_argument("-et", "--end-time", dest="end_time", help="Set the latest time to search for a slot for the charge.  Default is now + 4 hours. YYYY-MM-DDTHH:MM:SS", type=datetime.datetime.fromisoformat)
     
@@ -418,16 +560,21 @@ def parse_args():
     mode_group.add_argument("-e", "--economy", dest="economy", help="Program the cheapest over-night charging schedule possible", action="store_true")
     mode_group.add_argument("-4", "--4hour", dest="fourhour", help="Program the cheapest 4 hour charging schedule possible", action="store_true")
     mode_group.add_argument("-2", "--2hour", dest="twohour", help="Program the cheapest 2 hour charging schedule possible", action="store_true")
+    mode_group.add_argument("-w", "--window", dest="window", help="Program the cheapest charging window of --duration minutes", action="store_true")
     mode_group.add_argument("-a", "--auto", dest="auto", help="Program the cheapest charging schedule possible taking in to account solar conditions and current soc", action="store_true")
     mode_group.add_argument("-f", "--free", dest="free", help="Program slots where the electricity is free!", action="store_true")
 
     config_group = parser.add_argument_group("Configuration")
     config_group.add_argument("-c", "--cheap", dest="cheap", help="Set the threshold for cheap electricity in p/kWh.  Default is 15.0", type=float)
-    config_group.add_argument("-i", "--inverter", dest="inverter", help="Set the inverter address.  Default is ew11-1", default='ew11-1')
+    config_group.add_argument("-i", "--inverter", dest="inverter", help="Set the inverter address, address:battery kWh or address:battery kWh:charge slots to use.  Give more than one to program them all at once.  Default is ew11-1", default=None, nargs="+", type=parse_inverter)
     config_group.add_argument("-b", "--battery", dest="battery", help="Forcibly set the battery size in kWh.", default=None, type=int)
     config_group.add_argument("-r", "--rate", dest="rate", help="Set the maximum AC charge rate in kW.  Default is 100%%", default=100, type=int)
     #config_group.add_argument("-D", "--debug", dest="debug", help="Enable debug output", action="store_true")
     config_group.add_argument("--dummy", dest="dummy", help="Dummy  run. Don't actually program the inverter", action="store_true")
+    config_group.add_argument("--tariff", dest="tariff", help="Region letter (A-P) or whole tariff code to get prices for.  Default is region A", default=None)
+    config_group.add_argument("--no-cache", dest="no_cache", help="Ignore the local price cache and fetch everything from Octopus", action="store_true")
+    config_group.add_argument("--profile", dest="profile", help="Time each phase of the run and print them as JSON lines on stderr when done, or append them to PROFILE", nargs="?", const="-", default=None)
+    config_group.add_argument("--profile-influx", dest="profile_influx", help="Also write the --profile timings to InfluxDB", action="store_true")
     config_group.add_argument("-t", "--time", dest="time", help="Set the time on the inverter", action="store_true")
 
     info_group = parser.add_argument_group("Information")
@@ -447,63 +594,30 @@ def start_of_next_period():
     # Todo: deal with clock changes
     return datetime.datetime.now().replace(hour=23, minute=0, second=0, microsecond=0)
 
-def remove_overlap(window, window_length):
-    # Window is a DataFrame of start times
-    # Window length is how long the windows are
-    # Window end is always 30m later that the start tine in the window because Agile slots are 30mins long and the timestamp is the start of the last 30m period.
-    # window_length needs to be a pandas Timedelta object
-    # Iterate through the windows and drop any overlapping windows.  We are sorted by price
-    # so the earlier window should be cheapest and so kept.
-    # From the docs: You should never modify something you are iterating over.
-    if type(window) != pd.core.frame.DataFrame:
-        print("ERROR: Window is not a DataFrame")
-        raise TypeError
-    temp_frame = window.copy()
-    for i1 in window.itertuples():
-        window_interval = pd.Interval(i1.start_time - window_length, i1.start_time + pd.Timedelta('30m'))
-        for i2 in window.itertuples():
-            if i1.Index == i2.Index:
-                continue
-            wi2 = pd.Interval(i2.start_time - window_length, i2.start_time + pd.Timedelta('30m'))
-            if window_interval.overlaps(wi2):
-                if i2.value_inc_vat > i1.value_inc_vat:
-                    temp_frame.drop(i2.Index, inplace=True, errors='ignore')
-    return temp_frame
-
-def add_window_bounds(window, window_length):
-    # This creates a whole new frame, we could probably just update the existing one
-    # but I found this tricky to do.  This is easier to understand and really doesn't
-    # need optimising as it's a small amount of data.
-    start_time_list = []
-    end_time_list   = []
-    values_list     = []
-    
-    for each in window.itertuples():
-        start_time = each.start_time - window_length
-        end_time = each.start_time + pd.Timedelta('30m') 
-        start_time_list.append(start_time)
-        end_time_list.append(end_time)
-        values_list.append(each.value_inc_vat)
-    df = pd.DataFrame({'start_time':start_time_list, 'end_time': end_time_list, 'value_inc_vat': values_list})
-    return df
-
 def get_solar_production_tomorrow(dummy=True):
-    url = "https://api.forecast.solar/estimate/watthours/day/52.1322466021396/-0.21998598515728754/27/-80/6.720"
-    # Might change this to use the per-hour data.  Then we can see how much solar is left for the day.
-    # That might mean signing up for an account, then we can hit the API once a minute if we really want to
-    headers = {"Accept": "application/json"}
-    r = requests.get(url, headers=headers)
-    wh = r.json()['result'][(datetime.datetime.now() + datetime.timedelta(days=1)).strftime('%Y-%m-%d')]
-    return wh / 1000
+    # kWh.  Cached, so that running this a few times doesn't get us throttled by forecast.solar, see solar_forecast.py
+    import solar_forecast
+    return solar_forecast.tomorrow_kwh()
+
 
+def get_solar_half_hours(now=None):
+    # Expected kWh of sun for each of the next 48 half hours, or None if we've never had a forecast
+    import solar_forecast
+    try:
+        return solar_forecast.half_hourly_kwh(now)
+    except solar_forecast.SolarForecastError as e:
+        print(f"No solar forecast ({e}), assuming no sun")
+        return None
 
-def get_soc_required_tomorrow(dummy=True):
+
+def get_soc_required_tomorrow(dummy=True, get_forecast_fn=get_solar_production_tomorrow, daily_kwh_required=None):
     # How much power in kwh do we need tomorrow?
-    # Look at current usage over today to get an indication of average usage
-    daily_kwh_required = get_local_load_today()
+    # Without a load forecast, look at current usage over today to get an indication of average usage
+    if daily_kwh_required is None:
+        daily_kwh_required = get_local_load_today()
     print(f"Daily kWh required: {daily_kwh_required}")
     # How much of that is solar?
-    solar_production_tomorrow = get_solar_production_tomorrow()
+    solar_production_tomorrow = get_forecast_fn()
     print(f"kWh from solar tomorrow: {solar_production_tomorrow}")
     # How much battery do we need to fill in?
     power_shortfall = daily_kwh_required - solar_production_tomorrow
@@ -522,31 +636,96 @@ def get_soc_required_tomorrow(dummy=True):
 
 
 
-def new_auto_charge(prices, dummy):
+def new_auto_charge(prices, dummy, now=None, get_forecast_fn=get_solar_production_tomorrow, get_load_fn=get_load_forecast, get_solar_fn=get_solar_half_hours, use_cache=True, cache=None):
     # This will work better if it is run later in the day.  Running it in the morning will
     # produce strange results.
-
+    # now and the get_*_fn can be handed in to replay a past day, see backtest.py
+    # Run again in the same half hour with the same prices, a similar SOC and the same forecasts and the plan comes
+    # from the cache instead, and the inverter is left alone if that plan is already on it.  See plan_cache.py
+    # The SOC and the forecasts are still read first, it's only the planning and the writes that are saved.
+    if now is None:
+        now = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
+
+    import plan_cache
+    expected_load = get_load_fn(now) # kWh for each of the next 48 half hours, or None
+    daily_kwh_required = get_local_load_today() if expected_load is None else expected_load.sum()
+    solar_tomorrow = get_forecast_fn()
+    batt_size = get_battery_size()
+    batt_soc = get_battery_soc()
+    solar = None if expected_load is None else get_solar_fn(now)
+
+    plan = None
+    if use_cache:
+        cache = cache or plan_cache.get_plan_cache()
+        hashes = plan_cache.series_hashes(prices.prices.start_time.values.view('i8'), prices.prices.value_inc_vat.to_numpy(dtype=float))
+        key = plan_cache.inputs_key(planner='new_auto_charge', half_hour=plan_cache.half_hour(now), soc=plan_cache.bucket(batt_soc, plan_cache.SOC_BUCKET), battery_size=batt_size,
+                                    daily_kwh=plan_cache.bucket(daily_kwh_required, plan_cache.KWH_BUCKET),
+                                    solar_tomorrow=plan_cache.bucket(solar_tomorrow, plan_cache.KWH_BUCKET),
+                                    solar=None if solar is None else plan_cache.bucket(solar.sum(), plan_cache.KWH_BUCKET),
+                                    charge_slots=max_charge_slots, charge_rate=max_ac_charge_rate)
+        if hashes:
+            plan = cache.get(hashes[0], key)
+    if plan is None:
+        plan = plan_auto_charge(prices, now, expected_load, daily_kwh_required, solar_tomorrow, batt_size, batt_soc, solar)
+        if use_cache and hashes:
+            cache.put(hashes, key, plan)
+    else:
+        print("Same prices, SOC and forecasts as last time, using the plan from then")
+    program_plan(plan, dummy, cache if use_cache else None)
+
+
+def program_plan(plan, dummy, cache=None):
+    # plan is {'max_soc': %, 'slots': [[start, end], ...] as ISO strings, or None to leave the charge slots alone}.
+    # With a cache, a plan that's already on the inverter isn't even read back.
+    if cache is not None and not dummy and cache.is_programmed(plan, inverter_addr):
+        print("That plan is already on the inverter, leaving it alone")
+        return
+    set_max_soc(plan['max_soc'], dummy, cache)
+    if plan['slots'] is not None:
+        import pandas as pd
+        slots = pd.DataFrame({'start_time': pd.to_datetime([start for start, end in plan['slots']], utc=True),
+                              'end_time': pd.to_datetime([end for start, end in plan['slots']], utc=True)})
+        if set_charging(slots, dummy, cache) is False:
+            return
+    if cache is not None and not dummy:
+        cache.mark_programmed(plan, inverter_addr)
+
+
+@spans.timed()
+def plan_auto_charge(prices, now, expected_load, daily_kwh_required, solar_tomorrow, batt_size, batt_soc, solar):
+    # The thinking behind new_auto_charge().  Returns the plan for program_plan() rather than programming anything.
+    import pandas as pd
+    import soc_simulator
     final_slots = pd.DataFrame()
 
-    batt_percent_soc_needed_for_tomorrow = get_soc_required_tomorrow()
-    set_max_soc(batt_percent_soc_needed_for_tomorrow, dummy)
-    batt_size = get_battery_size()
+    batt_percent_soc_needed_for_tomorrow = get_soc_required_tomorrow(get_forecast_fn=lambda: solar_tomorrow, daily_kwh_required=daily_kwh_required)
+    max_soc = batt_percent_soc_needed_for_tomorrow
     print(f"Battery size: {batt_size}")
-    
     # How long until the current battery charge is depleted? Therefore what time to we need to start charging by?
     
     #avg_kw_per_hour = get_local_load_today() / datetime.datetime.utcnow().hour
-    avg_kw_per_hour = get_lifetime_average_load()
-    print(f"Current average kW per hour usage: {avg_kw_per_hour}")
-    print("But we are assuming that we're charging over night, so halve that for typical night time usage")
-    avg_kw_per_hour = avg_kw_per_hour / 2
-    batt_soc = get_battery_soc() - 10# - 10 # 10% unusable 10% buffer
+    if expected_load is None:
+        avg_kw_per_hour = get_lifetime_average_load()
+        print(f"Current average kW per hour usage: {avg_kw_per_hour}")
+        print("But we are assuming that we're charging over night, so halve that for typical night time usage")
+        avg_kw_per_hour = avg_kw_per_hour / 2
+    else:
+        avg_kw_per_hour = expected_load.mean() * 2
+        print(f"Expected average kW per hour usage over the next day: {avg_kw_per_hour}")
+    batt_soc = batt_soc - 10# - 10 # 10% unusable 10% buffer
     print(f"Battery SOC: {batt_soc}")
     battery_kwh_remaining = batt_size * (batt_soc / 100)
     print(f"Current battery kWh remaining: {battery_kwh_remaining}")
-    battery_runtime = battery_kwh_remaining / avg_kw_per_hour
+    if expected_load is None:
+        battery_runtime = battery_kwh_remaining / avg_kw_per_hour
+    else:
+        # Evenings use a lot more than the middle of the night and the sun comes up in the morning, so run the
+        # battery down half hour by half hour
+        if solar is None:
+            solar = expected_load * 0
+        battery_runtime = soc_simulator.runtime_hours(expected_load, solar, batt_size, batt_soc + 10)
     print(f"Current battery runtime: {battery_runtime} hours")
-    must_charge_before = (datetime.datetime.utcnow().replace(tzinfo=pytz.utc) + datetime.timedelta(hours=battery_runtime))- datetime.timedelta(hours=1)
+    must_charge_before = (now + datetime.timedelta(hours=battery_runtime))- datetime.timedelta(hours=1)
 
     # What will the battery SOC be at that time?
     # future_battery_soc = (battery_runtime * avg_kw_per_hour) / batt_size * 100
@@ -577,7 +756,7 @@ def new_auto_charge(prices, dummy):
             # But can we do it in time?
             if super_cheap_slots.head(1).start_time < must_charge_before:
                 print("We can charge the battery for free in time!  Overriding max SOC setting to 100%")
-                set_max_soc(100, dummy)
+                max_soc = 100
             else:
                 print("We can't charge the battery on super cheap in time.")
                 # TODO: find how much extra we need to add to get there, then find a slot to provide it
@@ -586,7 +765,6 @@ def new_auto_charge(prices, dummy):
             # TODO: Deal with this
     else:
         print("There is no super-cheap power available")
-        now = datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
         print(f"Now is {now}")
         if now.hour <= 23:
             tomorrow_8am = now + datetime.timedelta(days=1) # TODO: Use solar forecast to work out when we can start generating instead of "8am"
@@ -634,7 +812,7 @@ def new_auto_charge(prices, dummy):
                 if avg_of_all_gap_fill_slots <= (avg_gap_fill_price * 1.1):
                     print("The average of all the slots is less than the average of the slots we are using to fill the gap.")
                     print("We should wait until tomorrow to charge the battery from the cheaper slots during the day.")
-                    return
+                    return {'max_soc': max_soc, 'slots': None}
 
                 final_slots = pd.concat([gap_fill_slots, final_slots])
                 # TODO: if the average price of these slots is close to the average cost for the entire period,
@@ -659,17 +837,20 @@ def new_auto_charge(prices, dummy):
                     final_slots = pd.concat([extra_slots, final_slots])
                 else:
                     # If we get here then there were no super-cheap slots but we have enough normal-cheap slots to charge the battery
+                    # The cheapest half hours can be spread over more runs than the inverter has slots for, so pick the
+                    # same amount of charging in runs that will fit.
+                    main_batt_charge_slots = prices.get_charge_slots(start_time=must_charge_before, end_time=tomorrow_8am, slots_needed=len(main_batt_charge_slots))
                     final_slots = pd.concat([main_batt_charge_slots, final_slots])
 
     # We should have a final_slot list
     final_slots = merge_slots(final_slots)
     print(f"Final slots after merge:\n{final_slots}")
-    
-    set_charging(final_slots, dummy)
+    slots = [[start.isoformat(), end.isoformat()] for start, end in zip(final_slots.start_time, final_slots.end_time)] if not final_slots.empty else []
+    return {'max_soc': max_soc, 'slots': slots}
 
 
 
-def auto_charge(prices, dummy):
+def auto_charge(prices, dummy, now=None, get_forecast_fn=None, get_load_fn=get_load_forecast, get_solar_fn=get_solar_half_hours):
     global battery_size
     # We are going to switch the inverter in to battery first mode in order to charge the battery.
     # We could switch *out* of battery first mode as soon as the battery is charge, but that we are charging means that
@@ -686,20 +867,32 @@ def auto_charge(prices, dummy):
     # TODO:  Deal with import being cheaper than export.  i.e. charge the battery to 100% regardless, and keep in batt first mode for the duration of the slots.
 
     
+    if now is None:
+        now = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc)
     current_soc = get_battery_soc() # test
-    tomorrow_solar = 13 # get_solar_production_tomorrow() # Need to mock this out for testing
+    tomorrow_solar = 13 if get_forecast_fn is None else get_forecast_fn() # get_solar_production_tomorrow()
+    expected_load = get_load_fn(now) # kWh for each of the next 48 half hours, or None
     #typical_usage = 14.0 # kWh 
-    typical_usage = get_local_load_today() # This bases tomorrow on today.  That's probably not realistic. Inverter knows grand total power usage. If we can find uptime then we can work out the average.
+    if expected_load is None:
+        typical_usage = get_local_load_today() # This bases tomorrow on today.  That's probably not realistic.
+    else:
+        typical_usage = expected_load.sum()
     if battery_size is None:
         battery_size = get_battery_size()
     # We need 25% of the battery to get through the night. 00:00 to 08:00
     print(f"Tomorrow's solar production is {tomorrow_solar} kWh")
     print(f"Typical usage is {typical_usage} kWh")
 
-    battery_run_time_remaining = (current_soc - 10) / 5 # 5% per hour.  Might minus a higher number to add a safety margin
+    if expected_load is None:
+        battery_run_time_remaining = (current_soc - 10) / idle_batt_usage # Might minus a higher number to add a safety margin
+    else:
+        import soc_simulator
+        solar = get_solar_fn(now)
+        if solar is None:
+            solar = expected_load * 0
+        battery_run_time_remaining = soc_simulator.runtime_hours(expected_load, solar, battery_size, current_soc)
     print(f"Battery run time remaining: {battery_run_time_remaining} hours")
     
-    now = datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
     print(f"Now is {now}")
     if now.hour <= 23:
         tomorrow_8am = now + datetime.timedelta(days=1) # TODO: Use solar forecast to work out when we can start generating instead of "8am"
@@ -709,7 +902,11 @@ def auto_charge(prices, dummy):
     print(f"Tomorrow 8am is {tomorrow_8am}")
     hours_to_useable_solar = round((((tomorrow_8am - now).total_seconds() / 3600) + 0.5) * 2) / 2
     print(f"Hours_to_useable_solar: {hours_to_useable_solar}")
-    soc_at_useable_solar = current_soc - (hours_to_useable_solar * 5)
+    if expected_load is None:
+        soc_at_useable_solar = current_soc - (hours_to_useable_solar * idle_batt_usage)
+    else:
+        trajectory = soc_simulator.simulate([False] * len(expected_load), expected_load, solar, battery_size, current_soc).soc
+        soc_at_useable_solar = trajectory[min(int(hours_to_useable_solar * 2), len(expected_load))]
 
     spare_solar = tomorrow_solar - typical_usage
     if spare_solar < 0:
@@ -860,29 +1057,57 @@ def auto_charge(prices, dummy):
 
 
 
+def report_profile(path, influx=False, dummy=False):
+    # path is where to append the JSON lines, "-" for stderr or None for nowhere.  See spans.py
+    if path == "-":
+        spans.write_json_lines(sys.stderr)
+    elif path:
+        with open(path, "a") as fp:
+            spans.write_json_lines(fp)
+    if influx and not dummy:
+        # Queued before the writer is flushed on the way out
+        get_influx_writer().write(spans.influx_lines())
+
+
 def main():
     #global prices
     global start_time
     global end_time
     global battery_size
+    global inverter_addr
+    global fleet_members
 
 
     prices = None
     args = parse_args()
     print(args)
+    if args.profile or args.profile_influx:
+        spans.enable()
     if args.inverter:
-        inverter_addr = args.inverter
+        fleet_members = args.inverter
+        inverter_addr = fleet_members[0].address
+        if fleet_members[0].battery_size:
+            battery_size = fleet_members[0].battery_size
+    many = len(fleet_members) > 1
+    # Anything we program means the plan the cache thinks is on the inverter might not be, see plan_cache.py
+    import plan_cache
+    cache = None if args.dummy else plan_cache.get_plan_cache()
     if args.zero:
-        zero_charging_slots(args.dummy)
-    if args.dummy:
-        MODBUS = False
+        zero_charging_slots(args.dummy, cache)
     # if args.cheap:
     #     global cheap
     #     cheap = args.cheap
-    if args.schedule:
-        get_current_charging_slots()
+    if args.schedule or (many and args.soc is None):
+        if many:
+            import fleet
+            fleet.print_status(fleet.status(fleet_members))
+        else:
+            get_current_charging_slots()
     if args.time:
-        sync_inverter_time(args.dummy)
+        if many:
+            program_all(lambda slots_available: {}, args.dummy, sync_clock=True)
+        else:
+            sync_inverter_time(args.dummy)
         print("Inverter time set")
     if args.start_time:
         start_time = args.start_time
@@ -896,46 +1121,51 @@ def main():
     if not args.start_time and not args.end_time:
         start_time = datetime.datetime.now()
     if args.soc is None:
-        print(f"Current battery charge: {get_battery_soc()}%")
+        if not many:
+            print(f"Current battery charge: {get_battery_soc()}%")
     elif args.soc > 0:
         print("Setting max SOC")
-        set_max_soc(args.soc, args.dummy)
+        set_max_soc(args.soc, args.dummy, cache)
     if args.battery: battery_size = args.battery
     if args.economy:
         if prices is None:
-            prices = Prices()
-        eco = prices.get_economy_slots()
-        eco = merge_slots(eco)
-        set_charging(eco, args.dummy)
+            prices = Prices(use_cache=not args.no_cache, tariff=args.tariff)
+        set_charging(economy_charge_slots(prices), args.dummy, cache)
         # set_economy_charging(prices)
     if args.fourhour:
         if prices is None:
-            prices = Prices()
-        set_charging(prices.get_four_hour_windows().head(1), args.dummy)
+            prices = Prices(use_cache=not args.no_cache, tariff=args.tariff)
+        set_charging(prices.get_four_hour_windows().head(1), args.dummy, cache)
     if args.twohour:
         if prices is None:
-            prices = Prices()
-        set_charging(prices.get_two_hour_windows().head(1), args.dummy)
-    if args.auto:
+            prices = Prices(use_cache=not args.no_cache, tariff=args.tariff)
+        set_charging(prices.get_two_hour_windows().head(1), args.dummy, cache)
+    if args.window:
+        if prices is None:
+            prices = Prices(use_cache=not args.no_cache, tariff=args.tariff)
+        set_charging(prices.get_windows(datetime.timedelta(minutes=args.duration), count=1), args.dummy, cache)
+    if args.auto and many:
+        print("--auto plans around one inverter's battery, run it for each inverter on its own")
+    elif args.auto:
         if prices is None:
-            prices = Prices()
-        new_auto_charge(prices, args.dummy)
+            prices = Prices(use_cache=not args.no_cache, tariff=args.tariff)
+        new_auto_charge(prices, args.dummy, cache=cache)
     if args.free:
         if prices is None:
-            prices = Prices()
+            prices = Prices(use_cache=not args.no_cache, tariff=args.tariff)
         free_slots = prices.get_free_slots()
         if free_slots.empty:
             print("No free slots found")
         else:
             free_slots = merge_slots(free_slots)
-            set_charging(free_slots, args.dummy)
+            set_charging(free_slots, args.dummy, cache)
     if args.influx:
         if prices is None:
-            prices = Prices()
+            prices = Prices(use_cache=not args.no_cache, tariff=args.tariff)
         prices.write_to_influxdb(args.dummy)
     if args.prices:
         if prices is None:
-            prices = Prices()
+            prices = Prices(use_cache=not args.no_cache, tariff=args.tariff)
         print("All prices in LOCAL time:") # TODO:  No they're not!
         print(prices.prices.to_markdown())
         print("\nCheapest combined TWO HOUR slots in LOCAL time:")
@@ -947,6 +1177,8 @@ def main():
             print("No economy slots found.  Use the four hour slot instead")
         else:
             print(convert_to_local_timezone(prices.get_economy_slots()).to_markdown())
+    if spans.enabled:
+        report_profile(args.profile, args.profile_influx, args.dummy)
     sys.exit()
 
 
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+# An append-only history of half hourly data, e.g. every Agile price we've ever fetched, that can be read back
+# without parsing anything.  Each column is a file of fixed width little endian values (start.col is int64 seconds
+# since the epoch, value_inc_vat.col float64, ...) and is memory mapped when read, so asking for a month or a year is
+# a slice of the mapping rather than a copy.  Rows are kept in start order with no repeats.
+#
+# days.idx is the date -> offset index: one int64 per UTC day from the first day in the archive, the row that day
+# starts at.  A range query looks up the days either end and only searches within them.  Once a day has rows its
+# entry never changes, so the index is only ever appended to, same as the columns.
+#
+# meta.json holds the columns, the first day and the number of rows that have been written completely.  Anything
+# past that in a column file (we were killed part way through an append) is ignored and overwritten next time.
+# Appending rows older than the last one means rewriting the lot, which only happens when backfilling history.
+#
+# Prices are archived per tariff as Prices fetches them.  Telemetry is archived by the poller, see telemetry.py.
+#
+# Usage:
+#   archive.py                                      What's in the archives
+#   archive.py -f 2023-01-01 -t 2024-01-01          Backfill region A's prices for 2023 from Octopus
+#   archive.py --csv agile_2023.csv --tariff N      ... or from a CSV written by octopus_api.py
+#   archive.py --telemetry                          Copy telemetry.bin's half hours in to the telemetry archive
+
+import os
+import json
+import datetime
+from argparse import ArgumentParser
+
+import numpy as np
+
+from json_file import write_json
+
+ARCHIVE_DIR = os.path.expanduser("~/.cache/octopus_agile/archive")
+DAY = 24 * 60 * 60
+SLOT_SECONDS = 30 * 60
+PRICE_COLUMNS = [('start', '<i8'), ('value_inc_vat', '<f8')]
+
+
+def to_seconds(t):
+    # A datetime (UTC if naive), a date (its midnight UTC), an ISO string like Octopus's or seconds since the epoch
+    if isinstance(t, str):
+        t = datetime.datetime.fromisoformat(t.replace("Z", "+00:00"))
+    if isinstance(t, datetime.datetime):
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=datetime.timezone.utc)
+        return int(t.timestamp())
+    if isinstance(t, datetime.date):
+        return int(datetime.datetime(t.year, t.month, t.day, tzinfo=datetime.timezone.utc).timestamp())
+    return int(t)
+
+
+class Archive:
+    def __init__(self, directory, columns):
+        # columns is [(name, dtype)], and the first must be start, int64 seconds since the epoch
+        if columns[0][0] != 'start':
+            raise ValueError(f"The first column has to be start, not {columns[0][0]}")
+        self.directory = directory
+        self.columns = [(name, np.dtype(dtype)) for name, dtype in columns]
+        self.maps = {}
+        meta = self.read_meta()
+        if meta is None:
+            self.rows, self.first_day, self.days = 0, None, 0
+        else:
+            if meta['columns'] != [[name, dtype.str] for name, dtype in self.columns]:
+                raise ValueError(f"{directory} has columns {meta['columns']}, not {self.columns}")
+            self.rows, self.first_day, self.days = meta['rows'], meta['first_day'], meta['days']
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read_meta(self):
+        try:
+            with open(self.path("meta.json")) as fp:
+                return json.load(fp)
+        except OSError:
+            return None
+
+    def write_meta(self):
+        write_json(self.path("meta.json"), {'columns': [[name, dtype.str] for name, dtype in self.columns], 'rows': self.rows,
+                                            'first_day': self.first_day, 'days': self.days})
+        self.maps = {}
+
+    def __len__(self):
+        return self.rows
+
+    def map(self, filename, dtype, count):
+        key = (filename, count)
+        if key not in self.maps:
+            if count == 0:
+                self.maps[key] = np.zeros(0, dtype=dtype)
+            else:
+                self.maps[key] = np.memmap(self.path(filename), dtype=dtype, mode='r', shape=(count,))
+        return self.maps[key]
+
+    def column(self, name):
+        # The whole column, memory mapped
+        return self.map(name + ".col", dict(self.columns)[name], self.rows)
+
+    def index(self):
+        return self.map("days.idx", np.dtype('<i8'), self.days)
+
+    def offset(self, t):
+        # The first row starting at or after t
+        t = to_seconds(t)
+        if self.rows == 0 or t <= self.first_day * DAY:
+            return 0
+        day = t // DAY - self.first_day
+        index = self.index()
+        if day >= self.days:
+            lo, hi = index[-1], self.rows
+        else:
+            lo, hi = index[day], index[day + 1] if day + 1 < self.days else self.rows
+        return int(lo + np.searchsorted(self.column('start')[lo:hi], t))
+
+    def range(self, start=None, end=None):
+        # {column: array} of the rows starting in [start, end), as views of the mappings
+        lo = 0 if start is None else self.offset(start)
+        hi = self.rows if end is None else self.offset(end)
+        return {name: self.column(name)[lo:max(lo, hi)] for name, dtype in self.columns}
+
+    def day(self, date):
+        return self.range(date, to_seconds(date) + DAY)
+
+    def last(self):
+        return int(self.column('start')[-1]) if self.rows else None
+
+    def append(self, columns):
+        # columns is {name: array} (or a structured array) with every column, in any order.  Rows that are already
+        # here are left as they were.  Returns how many rows were added.
+        start = np.asarray(columns['start'], dtype=np.int64)
+        order = np.argsort(start, kind='stable')
+        data = {name: np.asarray(columns[name], dtype=dtype)[order] for name, dtype in self.columns}
+        if len(start) > 1:
+            keep = np.concatenate(([True], np.diff(data['start']) != 0))
+            data = {name: values[keep] for name, values in data.items()}
+        last = self.last()
+        if last is not None:
+            old = data['start'] <= last
+            if old.any():
+                existing = self.column('start')
+                at = np.minimum(np.searchsorted(existing, data['start'][old]), self.rows - 1)
+                if (existing[at] != data['start'][old]).any():
+                    return self.rewrite(data)
+                data = {name: values[~old] for name, values in data.items()}
+        added = len(data['start'])
+        if added == 0:
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+        for name, dtype in self.columns:
+            with open(self.path(name + ".col"), "ab") as fp:
+                fp.truncate(self.rows * dtype.itemsize) # Anything past rows is from an append that didn't finish
+                fp.write(data[name].tobytes())
+        self.rows += added
+        self.extend_index()
+        self.write_meta()
+        return added
+
+    def extend_index(self):
+        # Index every day up to the one the last row is on.  Those entries can't change, later rows start later.
+        self.maps = {}
+        start = self.column('start')
+        if self.first_day is None:
+            self.first_day = int(start[0]) // DAY
+        days = int(start[-1]) // DAY - self.first_day + 1
+        if days > self.days:
+            new = np.searchsorted(start, (self.first_day + np.arange(self.days, days)) * DAY).astype('<i8')
+            with open(self.path("days.idx"), "ab") as fp:
+                fp.truncate(self.days * 8)
+                fp.write(new.tobytes())
+            self.days = days
+
+    def rewrite(self, data):
+        # Merge in rows from before the end.  The rows already here win over new ones for the same half hour.
+        before = self.rows
+        merged = {name: np.concatenate((np.array(self.column(name)), data[name])) for name, dtype in self.columns}
+        order = np.argsort(merged['start'], kind='stable')
+        merged = {name: values[order] for name, values in merged.items()}
+        keep = np.concatenate(([True], np.diff(merged['start']) != 0))
+        self.maps = {}
+        for name, dtype in self.columns:
+            tmp_path = self.path(name + ".col.tmp")
+            merged[name][keep].astype(dtype).tofile(tmp_path)
+            os.replace(tmp_path, self.path(name + ".col"))
+        self.rows, self.first_day, self.days = int(keep.sum()), None, 0
+        self.extend_index()
+        self.write_meta()
+        return self.rows - before
+
+    def describe(self):
+        if self.rows == 0:
+            return "empty"
+        first = datetime.datetime.fromtimestamp(int(self.column('start')[0]), datetime.timezone.utc)
+        last = datetime.datetime.fromtimestamp(self.last(), datetime.timezone.utc)
+        return f"{self.rows} rows from {first:%Y-%m-%d %H:%M} to {last:%Y-%m-%d %H:%M} UTC over {self.days} days"
+
+
+def prices_archive(tariff_code, directory=ARCHIVE_DIR):
+    return Archive(os.path.join(directory, "prices", tariff_code), PRICE_COLUMNS)
+
+
+def add_rates(archive, rates):
+    # rates is a price_parser.UnitRates
+    return archive.append({'start': rates.start // 10**9, 'value_inc_vat': rates.value})
+
+
+def unit_rates(archive, start=None, end=None):
+    # The archived prices starting in [start, end) as a price_parser.UnitRates, e.g. for Prices(rates=...)
+    import price_parser
+    rows = archive.range(start, end)
+    start_ns = rows['start'] * 10**9
+    gaps = np.flatnonzero(np.diff(start_ns) != SLOT_SECONDS * 10**9) + 1
+    return price_parser.UnitRates(start_ns, start_ns + SLOT_SECONDS * 10**9, rows['value_inc_vat'], gaps, price_parser.dst_days(start_ns))
+
+
+def open_archive(directory):
+    # With whatever columns it was made with
+    with open(os.path.join(directory, "meta.json")) as fp:
+        return Archive(directory, json.load(fp)['columns'])
+
+
+def archives(directory=ARCHIVE_DIR):
+    # (name, Archive) for every archive under directory
+    for root, dirs, files in sorted(os.walk(directory)):
+        dirs.sort()
+        if "meta.json" in files:
+            yield os.path.relpath(root, directory), open_archive(root)
+
+
+def parse_args():
+    parser = ArgumentParser(description="Keep and query the local archive of prices and telemetry.")
+    parser.add_argument("-f", "--from", dest="start_time", help="Fetch prices from Octopus from this day. YYYY-MM-DD", type=datetime.datetime.fromisoformat)
+    parser.add_argument("-t", "--to", dest="end_time", help="... up to this day. YYYY-MM-DD  Default is now", type=datetime.datetime.fromisoformat)
+    parser.add_argument("--csv", dest="csv", help="Add the prices in a CSV written by octopus_api.py", default=None)
+    parser.add_argument("--tariff", dest="tariff", help="Region letter (A-P) or whole tariff code. Default is region A", default=None)
+    parser.add_argument("--telemetry", dest="telemetry", help="Add the half hours from the telemetry poller's file", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.start_time or args.csv:
+        import octopus_api
+        import price_parser
+        product_code, tariff_code = octopus_api.parse_tariff(args.tariff or octopus_api.TARIFF_CODE)
+        if args.csv:
+            import pandas as pd
+            history = pd.read_csv(args.csv)
+            rates = price_parser.columns(pd.to_datetime(history.start_time, utc=True).values.view('i8'),
+                                         pd.to_datetime(history.end_time, utc=True).values.view('i8'), history.value_inc_vat.to_numpy(dtype=float))
+        else:
+            end_time = args.end_time if args.end_time is not None else datetime.datetime.utcnow()
+            rates = price_parser.concat([price_parser.parse_content(page)[0] for page in octopus_api.fetch_history(args.start_time, end_time, product_code, tariff_code)])
+        prices = prices_archive(tariff_code)
+        print(f"Added {add_rates(prices, rates)} prices to {tariff_code}")
+    if args.telemetry:
+        import time
+        import telemetry
+        records = telemetry.read_half_hours()
+        records = records[records['start'] + telemetry.HALF_HOUR <= time.time()] # Only the ones that have finished
+        print(f"Added {telemetry.get_archive().append(records)} half hours of telemetry")
+    for name, each in archives():
+        print(f"{name}: {each.describe()}")
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+# Replay a history of Agile prices through the planners to see what they would have cost.
+# Each day we pretend it's PLAN_HOUR (UTC), hand the planner that day's prices and a load/solar profile, and swap
+# the inverter and the HTTP calls for fakes.  Whatever the planner would have programmed is then "charged"
+# against the real prices for those half hours.
+#
+# Every day is independent, so they're farmed out to a pool of processes.  Each process gets its own copy of the
+# planner modules, which is what makes it safe to point their inverter at a fake.
+#
+# The battery isn't carried over from one day to the next: each evening starts at the SOC in the profile.
+#
+# Usage:
+#   octopus_api.py -f 2023-01-01 -t 2024-01-01 -o agile_2023.csv
+#   backtest.py -p agile_2023.csv --planner calculation
+#   backtest.py --archive A -f 2023-01-01 -t 2024-01-01     Straight from the price archive, see archive.py
+
+import io
+import datetime
+import contextlib
+import warnings
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import registers
+
+PLANNERS = ['calculation', 'new_auto_charge', 'auto_charge']
+PLAN_HOUR = 18 # UTC.  The planners expect to be run in the evening
+DEFAULT_LOAD = 20 # kWh per day, same as get_lifetime_average_daily_load() without an inverter
+DEFAULT_SOLAR = 5 # kWh
+DEFAULT_SOC = 30 # % at PLAN_HOUR
+BATTERY_CAPACITY = 13 # kWh
+CHARGE_RATE = 2.7 # kW
+
+
+def read_history(path):
+    # A CSV as written by octopus_api.py
+    prices = pd.read_csv(path)
+    prices['start_time'] = pd.to_datetime(prices.start_time, utc=True)
+    prices['end_time'] = pd.to_datetime(prices.end_time, utc=True)
+    prices['duration'] = prices.end_time - prices.start_time
+    prices.sort_values(by="start_time", inplace=True)
+    prices.reset_index(drop=True, inplace=True)
+    return prices
+
+
+def read_archive(tariff_code, start_date=None, end_date=None, directory=None):
+    # The same frame as read_history() from the price archive, reading only the days asked for.  end_date is the
+    # day after the last one, like --to.
+    import archive
+    import price_parser
+    prices = archive.prices_archive(tariff_code, directory or archive.ARCHIVE_DIR)
+    return price_parser.to_frame(archive.unit_rates(prices, start_date, end_date))
+
+
+def read_profile(path):
+    # CSV with a date column and any of load_kwh, solar_kwh and soc.  Returns {date: {column: value}}
+    profile = pd.read_csv(path)
+    profile['date'] = pd.to_datetime(profile.date).dt.date
+    return profile.set_index('date').to_dict('index')
+
+
+def day_profile(profile, day):
+    values = {'load_kwh': DEFAULT_LOAD, 'solar_kwh': DEFAULT_SOLAR, 'soc': DEFAULT_SOC}
+    for key, value in profile.get(day, {}).items():
+        if not pd.isna(value):
+            values[key] = value
+    return values
+
+
+def octopus_results(prices):
+    # Turn a slice of the history back in to what the Octopus API would have returned, newest first
+    return {'results': [{'valid_from': r.start_time.isoformat().replace('+00:00', 'Z'),
+                         'valid_to': r.end_time.isoformat().replace('+00:00', 'Z'),
+                         'value_inc_vat': r.value_inc_vat} for r in prices.iloc[::-1].itertuples()]}
+
+
+class FakeInverter:
+    # Just enough of an Inverter for agile_prices: a dict of registers, with writes landing in it.
+    def __init__(self, now, soc, load_kwh, battery_kwh=BATTERY_CAPACITY):
+        self.holding = {}
+        self.input = {}
+        self.holding.update({45 + i: v for i, v in enumerate([now.year - 2000, now.month, now.day, now.hour, now.minute, now.second, 0])})
+        self.input[1014] = int(soc)
+        self.input[1110] = max(1, round(battery_kwh / 6.5))
+        # One day of runtime (0.5s) and load (0.1kWh) gives the right lifetime average
+        self.set_u32(57, 2 * 60 * 60 * 24)
+        self.set_u32(1062, int(load_kwh * 10))
+        self.set_u32(1060, int(load_kwh * 10))
+        self.writes = 0
+
+    def set_u32(self, address, value):
+        self.input[address] = value >> 16
+        self.input[address + 1] = value & 0xffff
+
+    def read_holding_registers(self, address, count=1):
+        return [self.holding.get(address + i, 0) for i in range(count)]
+
+    def read_input_registers(self, address, count=1):
+        return [self.input.get(address + i, 0) for i in range(count)]
+
+    def write_registers(self, address, values_list):
+        self.writes += 1
+        for i, value in enumerate(values_list):
+            self.holding[address + i] = value
+
+    def read_input_u32(self, address):
+        high, low = self.read_input_registers(address, 2)
+        return high << 16 | low
+
+    def close(self):
+        pass
+
+    def charge_intervals(self, window_start):
+        # The enabled battery first slots as (start, end) datetimes, the first time each comes round after window_start
+        values = self.read_holding_registers(1100, 9) + self.read_holding_registers(1018, 9)
+        intervals = []
+        for start, end, enabled in registers.decode_slots(values):
+            if not enabled or start == end:
+                continue
+            start_dt = datetime.datetime.combine(window_start.date(), start, tzinfo=window_start.tzinfo)
+            if start_dt < window_start:
+                start_dt += datetime.timedelta(days=1)
+            end_dt = datetime.datetime.combine(start_dt.date(), end, tzinfo=window_start.tzinfo)
+            if end_dt <= start_dt:
+                end_dt += datetime.timedelta(days=1)
+            intervals.append((start_dt, end_dt))
+        return intervals
+
+
+def charge(prices, intervals, start_kwh, target_kwh, rate=CHARGE_RATE):
+    # Charge at rate through each half hour in intervals until we hit target_kwh.  Returns (cost in p, kWh, half hours)
+    starts = prices.start_time.values
+    ends = prices.end_time.values
+    in_slot = np.zeros(len(prices), dtype=bool)
+    for start, end in intervals:
+        in_slot |= (starts >= np.datetime64(pd.Timestamp(start).tz_convert(None))) & (ends <= np.datetime64(pd.Timestamp(end).tz_convert(None)))
+    hours = prices.duration.dt.total_seconds().to_numpy()[in_slot] / 3600
+    need = max(target_kwh - start_kwh, 0)
+    # Each half hour adds rate * hours until the battery reaches target_kwh
+    charged = np.minimum(np.cumsum(rate * hours), need)
+    added = np.diff(charged, prepend=0.0)
+    cost = float(np.dot(added, prices.value_inc_vat.to_numpy()[in_slot]))
+    return cost, float(charged[-1]) if len(charged) else 0.0, int(in_slot.sum())
+
+
+def count_runs(intervals):
+    # Contiguous intervals would be one inverter slot once merged
+    runs, last_end = 0, None
+    for start, end in sorted(intervals):
+        if start != last_end:
+            runs += 1
+        last_end = end
+    return runs
+
+
+def no_load_forecast(now):
+    # The planners use the profile's daily load rather than whatever telemetry this machine happens to have
+    return None
+
+
+def run_calculation(prices, now, profile):
+    import new_prices_thing
+    start_kwh = BATTERY_CAPACITY * profile['soc'] / 100
+    slots_dict = new_prices_thing.plan(electricity_provider_fn=lambda start_time, end_time: octopus_results(prices),
+                                       get_forecast_fn=lambda: profile['solar_kwh'],
+                                       get_battery_charge_fn=lambda: start_kwh,
+                                       get_daily_load_fn=lambda: profile['load_kwh'],
+                                       start_time=now,
+                                       get_load_fn=no_load_forecast)
+    calculation_dict = new_prices_thing.calculation(slots_dict)
+    slots = calculation_dict['battery_charge_slots']
+    intervals = list(zip(slots.start_time, slots.end_time))
+    target_kwh = min(BATTERY_CAPACITY, start_kwh + calculation_dict['max_battery_charge_percent'] / 100 * BATTERY_CAPACITY)
+    return intervals, start_kwh, target_kwh
+
+
+def run_agile_prices(planner, prices, now, profile):
+    # agile_prices talks to the inverter through its module globals, so point them at a fake.  This is only ever
+    # done in a worker process.
+    import agile_prices
+    fake = FakeInverter(now, profile['soc'], profile['load_kwh'])
+    agile_prices.MODBUS = True
+    agile_prices.inverter = fake
+    agile_prices.battery_size = None
+    battery_kwh = agile_prices.get_battery_size()
+    fake.holding[1091] = 100
+    day_prices = agile_prices.Prices(prices_dict=octopus_results(prices))
+    forecast = lambda: profile['solar_kwh']
+    if planner == 'new_auto_charge':
+        agile_prices.new_auto_charge(day_prices, dummy=False, now=now, get_forecast_fn=forecast, get_load_fn=no_load_forecast, use_cache=False)
+    else:
+        agile_prices.auto_charge(day_prices, dummy=False, now=now, get_forecast_fn=forecast, get_load_fn=no_load_forecast)
+    start_kwh = battery_kwh * profile['soc'] / 100
+    target_kwh = battery_kwh * fake.holding[1091] / 100
+    return fake.charge_intervals(prices.start_time.iloc[0].to_pydatetime()), start_kwh, target_kwh
+
+
+def backtest_day(task):
+    # One day.  Returns a dict for the results table.  A planner blowing up is reported rather than raised so that
+    # one bad day doesn't lose the rest of the year.
+    planner, prices, now, profile = task
+    row = {'date': now.date(), 'cost': 0.0, 'kwh': 0.0, 'half_hours': 0, 'slots': 0, 'error': None}
+    try:
+        # The planners are chatty, and we'd get it all once per day
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            if planner == 'calculation':
+                intervals, start_kwh, target_kwh = run_calculation(prices, now, profile)
+            else:
+                intervals, start_kwh, target_kwh = run_agile_prices(planner, prices, now, profile)
+        row['cost'], row['kwh'], row['half_hours'] = charge(prices, intervals, start_kwh, target_kwh)
+        row['slots'] = count_runs(intervals)
+    except Exception as e:
+        row['error'] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def day_tasks(history, planner, profile=None, start_date=None, end_date=None):
+    # One task per day which has a full 24 hours of prices after PLAN_HOUR
+    profile = profile or {}
+    starts = history.start_time.values
+    first = history.start_time.iloc[0].normalize()
+    last = history.end_time.iloc[-1]
+    tasks = []
+    day = first
+    while day + pd.Timedelta(hours=PLAN_HOUR) + pd.Timedelta(days=1) <= last:
+        now = day + pd.Timedelta(hours=PLAN_HOUR)
+        if (start_date is None or now.date() >= start_date) and (end_date is None or now.date() < end_date):
+            lo = starts.searchsorted(now.to_datetime64())
+            hi = starts.searchsorted((now + pd.Timedelta(days=1)).to_datetime64())
+            prices = history.iloc[lo:hi].reset_index(drop=True)
+            if len(prices) == 48:
+                tasks.append((planner, prices, now.to_pydatetime(), day_profile(profile, now.date())))
+        day += pd.Timedelta(days=1)
+    return tasks
+
+
+def backtest(history, planner, profile=None, start_date=None, end_date=None, workers=None):
+    # Returns a frame of date, cost (p), kwh, half_hours, slots and error, one row per day
+    if planner not in PLANNERS:
+        raise ValueError(f"Unknown planner {planner}, choose from {', '.join(PLANNERS)}")
+    tasks = day_tasks(history, planner, profile, start_date, end_date)
+    if workers == 1:
+        rows = [backtest_day(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(backtest_day, tasks, chunksize=max(1, len(tasks) // 64)))
+    return pd.DataFrame(rows, columns=['date', 'cost', 'kwh', 'half_hours', 'slots', 'error'])
+
+
+def parse_args():
+    parser = ArgumentParser(description="Replay historical Agile prices through the charge planners.")
+    prices_group = parser.add_mutually_exclusive_group(required=True)
+    prices_group.add_argument("-p", "--prices", dest="prices", help="CSV of historical prices, see octopus_api.py", default=None)
+    prices_group.add_argument("--archive", dest="tariff", help="Region letter (A-P) or tariff code to read from the price archive instead, see archive.py", default=None)
+    parser.add_argument("--planner", dest="planner", help=f"Which planner to run. One of {', '.join(PLANNERS)}. Default is calculation", default='calculation', choices=PLANNERS)
+    parser.add_argument("--profile", dest="profile", help="CSV of date, load_kwh, solar_kwh and soc for each day", default=None)
+    parser.add_argument("-f", "--from", dest="start_date", help="First day to replay. YYYY-MM-DD", type=datetime.date.fromisoformat)
+    parser.add_argument("-t", "--to", dest="end_date", help="Stop before this day. YYYY-MM-DD", type=datetime.date.fromisoformat)
+    parser.add_argument("-w", "--workers", dest="workers", help="Number of processes.  Default is one per core", default=None, type=int)
+    parser.add_argument("-o", "--output", dest="output", help="Write the per day results to this CSV file", default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.prices:
+        history = read_history(args.prices)
+    else:
+        import octopus_api
+        history = read_archive(octopus_api.parse_tariff(args.tariff)[1], args.start_date, args.end_date)
+    profile = read_profile(args.profile) if args.profile else None
+    results = backtest(history, args.planner, profile, args.start_date, args.end_date, args.workers)
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f"Written to {args.output}")
+    else:
+        print(results.to_string())
+    errors = results.error.notna().sum()
+    print(f"{len(results)} days, {errors} failed")
+    print(f"Total cost: £{results.cost.sum() / 100:.2f}\tCharged: {results.kwh.sum():.1f} kWh\tSlots: {results.slots.sum()}")
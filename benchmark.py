@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+# Timings for the bits of price analysis that get slower as the price series gets longer, run against
+# synthetic Agile prices from one day up to a year of half hours.
+# Results are written as JSON so that two commits (or two machines) can be compared:
+#
+#   benchmark.py -o before.json
+#   ... change something ...
+#   benchmark.py -o after.json --compare before.json
+#
+# There are also startup benchmarks, which time agile_prices.py in a fresh interpreter the way Home Assistant runs
+# it, and list what it imported.  Anything that reads the inverter shouldn't be importing pandas.
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import datetime
+import contextlib
+import warnings
+import subprocess
+import statistics
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+
+import optimiser
+import price_parser
+import soc_simulator
+import new_prices_thing
+from windows import non_overlapping_windows, window_means
+from backtest import octopus_results
+
+import agile_prices
+
+SIZES = {'day': 1, 'week': 7, 'month': 30, 'year': 365} # days
+HEAVY_MODULES = ['pandas', 'numpy', 'requests', 'influxdb_client']
+MIN_TIME = 0.2 # seconds to spend on each benchmark, at least MIN_REPEATS times
+MIN_REPEATS = 3
+MAX_REPEATS = 1000
+SLOWER = 1.2 # --compare flags anything this much slower than the baseline
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def synthetic_prices(days, seed=0, start="2023-01-01"):
+    # Something shaped like Agile: cheap overnight, a peak from 16:00 to 19:00 (capped like the real thing), a
+    # wholesale price that wanders from day to day, and the odd windy night where it goes negative.
+    rng = np.random.default_rng(seed)
+    start_time = pd.date_range(start, periods=days * 48, freq="30min", tz="UTC")
+    hour = start_time.hour.to_numpy() + start_time.minute.to_numpy() / 60
+    daily = 22 + 8 * np.sin((hour - 9) / 24 * 2 * np.pi) - 6 * ((hour >= 0) & (hour < 6))
+    peak = np.where((hour >= 16) & (hour < 19), 14, 0)
+    wholesale = np.repeat(np.cumsum(rng.normal(0, 1.5, days)), 48)
+    windy = np.repeat(rng.random(days) < 0.05, 48) & (hour < 6)
+    value_inc_vat = daily + peak + wholesale + rng.normal(0, 2, len(start_time))
+    value_inc_vat = np.where(windy, value_inc_vat - 25, value_inc_vat)
+    value_inc_vat = np.round(np.clip(value_inc_vat, -20, 100), 2)
+    prices = pd.DataFrame({'start_time': start_time, 'end_time': start_time + pd.Timedelta('30m'), 'value_inc_vat': value_inc_vat})
+    prices['duration'] = prices.end_time - prices.start_time
+    return prices
+
+
+@contextlib.contextmanager
+def quiet():
+    # The code being timed prints a lot, and pandas warns about things we aren't here to fix
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        yield
+
+
+def quietly(fn, *args, **kwargs):
+    with quiet():
+        return fn(*args, **kwargs)
+
+
+def time_it(fn, min_time=MIN_TIME, min_repeats=MIN_REPEATS, max_repeats=MAX_REPEATS):
+    # Returns a list of timings for fn(), in seconds
+    timings = []
+    started = time.perf_counter()
+    with quiet():
+        while len(timings) < min_repeats or (time.perf_counter() - started < min_time and len(timings) < max_repeats):
+            t = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - t)
+    return timings
+
+
+# Each benchmark is set up with a prices frame and returns the function to time
+
+def bench_window_means(prices):
+    starts = prices.start_time.values.view('i8')
+    values = prices.value_inc_vat.to_numpy(dtype=float)
+    return lambda: window_means(starts, values, 8)
+
+def bench_non_overlapping_windows(prices):
+    last_slot, means = window_means(prices.start_time.values.view('i8'), prices.value_inc_vat.to_numpy(dtype=float), 8)
+    windows = prices.iloc[last_slot][['start_time']].copy()
+    windows['value_inc_vat'] = means
+    windows.sort_values(by='value_inc_vat', inplace=True)
+    windows.drop(windows[windows.value_inc_vat > prices.value_inc_vat.mean()].index, inplace=True)
+    return lambda: non_overlapping_windows(windows, pd.Timedelta('3h30m'))
+
+def bench_cheapest_charge_slots(prices):
+    return lambda: optimiser.cheapest_charge_slots(prices, 13, 2.7, 6)
+
+def bench_calculation(prices):
+    results = octopus_results(prices)
+    slots_dict = quietly(new_prices_thing.plan, electricity_provider_fn=lambda start_time, end_time: results,
+                         get_forecast_fn=lambda: 5, get_battery_charge_fn=lambda: 3, get_daily_load_fn=lambda: 20,
+                         start_time=prices.start_time.iloc[0].to_pydatetime(), get_load_fn=lambda start_time: None)
+    return lambda: new_prices_thing.calculation(slots_dict)
+
+def agile_prices_for(prices):
+    return quietly(agile_prices.Prices, prices_dict=octopus_results(prices))
+
+def bench_build_dataframe(prices):
+    p = agile_prices_for(prices)
+    return p.build_dataframe
+
+def bench_parse_content(prices):
+    content = json.dumps(octopus_results(prices)).encode()
+    return lambda: price_parser.to_frame(price_parser.parse_content(content)[0])
+
+def bench_archive_range(prices):
+    # Reading the prices back out of the archive and in to a frame, no JSON
+    import tempfile
+    import archive
+    tmp = tempfile.TemporaryDirectory()
+    prices_archive = archive.prices_archive("benchmark", tmp.name)
+    archive.add_rates(prices_archive, price_parser.parse_results(octopus_results(prices)['results']))
+    def run():
+        tmp.name # Keep the directory until the benchmark is done with it
+        return price_parser.to_frame(archive.unit_rates(prices_archive))
+    return run
+
+def bench_get_windows(prices):
+    p = agile_prices_for(prices)
+    def run():
+        p.windows = {} # Otherwise we're just timing the cache
+        p.get_windows(pd.Timedelta('4h'))
+    return run
+
+def bench_merge_slots(prices):
+    # The cheapest quarter of the slots, which are spread out enough to be worth merging
+    slots = prices[prices.value_inc_vat <= prices.value_inc_vat.quantile(0.25)]
+    return lambda: agile_prices.merge_slots(slots.copy())
+
+def bench_get_economy_slots(prices):
+    p = agile_prices_for(prices)
+    start_time = prices.start_time.iloc[0]
+    end_time = prices.end_time.iloc[-1]
+    return lambda: p.get_economy_slots(start_time=start_time, end_time=end_time)
+
+def bench_simulate(prices):
+    # 1000 random schedules for a day, fewer for longer so that each run is about the same number of half hours
+    slots = len(prices)
+    rng = np.random.default_rng(0)
+    schedules = rng.random((max(10, 48000 // slots), slots)) < 0.2
+    hour = prices.start_time.dt.hour.to_numpy()
+    load = np.where((hour >= 16) & (hour < 22), 0.8, 0.3)
+    solar = np.where((hour >= 9) & (hour < 16), 0.6, 0.0)
+    values = prices.value_inc_vat.to_numpy(dtype=float)
+    return lambda: soc_simulator.simulate(schedules, load, solar, 13, 30, values)
+
+
+BENCHMARKS = {
+    'window_means': bench_window_means,
+    'non_overlapping_windows': bench_non_overlapping_windows,
+    'cheapest_charge_slots': bench_cheapest_charge_slots,
+    'calculation': bench_calculation,
+    'build_dataframe': bench_build_dataframe,
+    'parse_content': bench_parse_content,
+    'archive_range': bench_archive_range,
+    'get_windows': bench_get_windows,
+    'merge_slots': bench_merge_slots,
+    'get_economy_slots': bench_get_economy_slots,
+    'simulate': bench_simulate,
+}
+
+def without_inverter(*argv):
+    # python args that run agile_prices.py with argv, but with Modbus switched off so that it never tries to connect
+    # to the inverter, even on a machine with pymodbus installed
+    return ['-c', f"import sys, agile_prices; agile_prices.MODBUS = False; sys.argv = {['agile_prices.py', *argv]!r}; agile_prices.main()"]
+
+
+# Command lines to time from a cold start
+STARTUP = {
+    'startup_import': ['-c', 'import agile_prices'],
+    'startup_schedule': without_inverter('--dummy', '-S'),
+    'startup_soc': without_inverter('--dummy', '-C'),
+}
+
+
+def run_python(args, env=None):
+    return subprocess.run([sys.executable] + args, cwd=HERE, capture_output=True, text=True, env=env)
+
+
+def heavy_imports(args):
+    # Which of HEAVY_MODULES running python with args ends up importing
+    stderr = run_python(['-X', 'importtime'] + args).stderr
+    imported = {line.split('|')[-1].strip() for line in stderr.splitlines() if line.startswith('import time:')}
+    return [name for name in HEAVY_MODULES if name in imported]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names=None, sizes=None, min_time=MIN_TIME):
+    # Returns the results as a dict, ready to be written out as JSON
+    names = names or list(BENCHMARKS) + list(STARTUP)
+    sizes = sizes or list(SIZES)
+    rows = []
+    for size in sizes:
+        prices = synthetic_prices(SIZES[size])
+        for name in [name for name in names if name in BENCHMARKS]:
+            fn = quietly(BENCHMARKS[name], prices)
+            timings = time_it(fn, min_time)
+            rows.append({'benchmark': name, 'size': size, 'slots': len(prices), 'repeats': len(timings),
+                         'min': min(timings), 'median': statistics.median(timings)})
+            print(f"{name:<24} {size:<6} {len(prices):>6} slots  {rows[-1]['median'] * 1000:10.3f} ms  ({len(timings)} runs)")
+    for name in [name for name in names if name in STARTUP]:
+        timings = time_it(lambda: run_python(STARTUP[name]), min_time)
+        imported = heavy_imports(STARTUP[name])
+        rows.append({'benchmark': name, 'size': 'startup', 'slots': 0, 'repeats': len(timings),
+                     'min': min(timings), 'median': statistics.median(timings), 'imports': imported})
+        print(f"{name:<24} {'cold':<6} {'':>12}  {rows[-1]['median'] * 1000:10.3f} ms  ({len(timings)} runs)  imports {', '.join(imported) or 'nothing heavy'}")
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.utcnow().isoformat(timespec='seconds') + "Z",
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'results': rows,
+    }
+
+
+def compare(baseline, current, slower=SLOWER):
+    # Returns a list of (benchmark, size, ratio) where current is more than slower times baseline.
+    # Compares the fastest runs, which are much less noisy than the medians for the quick benchmarks.
+    base = {(r['benchmark'], r['size']): r['min'] for r in baseline['results']}
+    regressions = []
+    for r in current['results']:
+        key = (r['benchmark'], r['size'])
+        if key not in base:
+            continue
+        ratio = r['min'] / base[key]
+        print(f"{r['benchmark']:<24} {r['size']:<6} {ratio:6.2f}x{'  SLOWER' if ratio > slower else ''}")
+        if ratio > slower:
+            regressions.append((r['benchmark'], r['size'], ratio))
+    return regressions
+
+
+def parse_args():
+    parser = ArgumentParser(description="Time the price analysis against synthetic Agile prices.")
+    parser.add_argument("-b", "--benchmark", dest="benchmarks", help=f"Only run these. Any of {', '.join(list(BENCHMARKS) + list(STARTUP))}", nargs="+", choices=list(BENCHMARKS) + list(STARTUP))
+    parser.add_argument("-s", "--size", dest="sizes", help=f"Only use these sizes. Any of {', '.join(SIZES)}", nargs="+", choices=list(SIZES))
+    parser.add_argument("-m", "--min-time", dest="min_time", help=f"Seconds to spend on each benchmark. Default is {MIN_TIME}", default=MIN_TIME, type=float)
+    parser.add_argument("-o", "--output", dest="output", help="Write the results to this JSON file", default=None)
+    parser.add_argument("-c", "--compare", dest="compare", help="Compare against the results in this JSON file, and exit 1 if anything got slower", default=None)
+    parser.add_argument("--slower", dest="slower", help=f"How much slower counts as slower for --compare. Default is {SLOWER}", default=SLOWER, type=float)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_benchmarks(args.benchmarks, args.sizes, args.min_time)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+        print(f"Written to {args.output}")
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        print(f"\nCompared to {args.compare} ({baseline.get('commit')} on {baseline.get('machine')}):")
+        if compare(baseline, results, args.slower):
+            sys.exit(1)
@@ -1,13 +1,14 @@
 #!/bin/env python3
 
-from pymodbus.client import ModbusTcpClient
+from inverter import Inverter
+import registers
 import datetime
 
-client = ModbusTcpClient('ew11-2')
+client = Inverter('ew11-2')
 client.connect()
-results = client.read_holding_registers(45, 7, slave=1)
-year, month, day, hour, minute, second, dow = results.registers
-print(results.registers)
+results = client.read_holding_registers(45, 7)
+year, month, day, hour, minute, second, dow = results
+print(results)
 
 system_now = datetime.datetime.utcnow()
 inverter_now = datetime.datetime(year, month, day, hour, minute, second)
@@ -28,7 +29,7 @@ if difference > 30:
     print("Setting inverter time to system time")
     print(system_now.year, system_now.month, system_now.day, system_now.hour, system_now.minute, system_now.second, system_now.weekday()+1)
     #result = client.write_registers(50, [system_now.second], slave=1) # , system_now.month, system_now.day, system_now.hour, system_now.minute, system_now.second, system_now.weekday()+1], slave=1)
-    result = client.write_registers(45, [system_now.year-2000, system_now.month, system_now.day, system_now.hour, system_now.minute, system_now.second], slave=1) #, system_now.weekday()+1], slave=1)
+    result = client.write_registers(45, [system_now.year-2000, system_now.month, system_now.day, system_now.hour, system_now.minute, system_now.second]) #, system_now.weekday()+1])
     print(result)
 
 print("^ Time \n\n  Slots v")
@@ -72,69 +73,80 @@ print("^ Time \n\n  Slots v")
 
 # Read battery mode slots
 
+# Everything below is fetched up front in as few block reads as possible (see registers.py), then sliced up.
+HOLDING_RANGES = [(1100, 9), (1017, 9), (1091, 1), (1026, 9), (1080, 9), (1110, 9)]
+INPUT_RANGES = [(1082, 43), (1044, 20), (1056, 2), (100, 20), (57, 2), (1062, 2), (0, 100)]
+values = registers.read_ranges(client, [(registers.HOLDING, a, c) for a, c in HOLDING_RANGES] + [(registers.INPUT, a, c) for a, c in INPUT_RANGES])
+
+def holding(address, count):
+    return [values[(registers.HOLDING, address + i)] for i in range(count)]
+
+def inputs(address, count):
+    return [values[(registers.INPUT, address + i)] for i in range(count)]
+
 print("\n\nBattery Mode Slots")
-results = client.read_holding_registers(1100, 9, slave=1).registers
+results = holding(1100, 9)
 for e in results:
     if e > 254:
-        print(e >> 8, e & 255)
+        print(*registers.split_time(e))
     else:
         print(e)
 print("\n\nBattery Mode Slots")
-results = client.read_holding_registers(1017, 9, slave=1).registers
+results = holding(1017, 9)
 for e in results:
     if e > 255:
-        print(e >> 8, e & 255)
+        print(*registers.split_time(e))
     else:
         print(e)
 print("Batt levels")
-results = client.read_holding_registers(1091, 1, slave=1).registers
+results = holding(1091, 1)
 for e in results:
     if e > 255:
-        print(e >> 8, e & 255)
+        print(*registers.split_time(e))
     else:
         print(e)
 
 print("\n\Grid First Slots")
-results = client.read_holding_registers(1026, 9, slave=1).registers
+results = holding(1026, 9)
 for e in results:
     if e > 254:
-        print(e >> 8, e & 255)
+        print(*registers.split_time(e))
     else:
         print(e)
 print("\n\Grid First Slots")
-results = client.read_holding_registers(1080, 9, slave=1).registers
+results = holding(1080, 9)
 for e in results:
     if e > 255:
-        print(e >> 8, e & 255)
+        print(*registers.split_time(e))
     else:
         print(e)
 print("Batt levels")
-results = client.read_holding_registers(1091, 1, slave=1).registers
+results = holding(1091, 1)
 for e in results:
     if e > 255:
-        print(e >> 8, e & 255)
+        print(*registers.split_time(e))
     else:
         print(e)
 
 print("\n\Load First Slots")
-results = client.read_holding_registers(1110, 9, slave=1).registers
+results = holding(1110, 9)
 for e in results:
     if e > 254:
-        print(e >> 8, e & 255)
+        print(*registers.split_time(e))
     else:
         print(e)
 print("\n\Load First Slots")
-results = client.read_holding_registers(1080, 9, slave=1).registers
+results = holding(1080, 9)
 for e in results:
     if e > 255:
-        print(e >> 8, e & 255)
+        print(*registers.split_time(e))
     else:
         print(e)
 print("Batt levels")
-results = client.read_holding_registers(1091, 1, slave=1).registers
+results = holding(1091, 1)
 for e in results:
     if e > 255:
-        print(e >> 8, e & 255)
+        print(*registers.split_time(e))
     else:
         print(e)
 
@@ -142,7 +154,7 @@ for e in results:
 
 # Battery Info?
 print("\n\nBattery Info")
-results = client.read_input_registers(1082, 43, slave=1).registers
+results = inputs(1082, 43)
 a = 1082
 for e in results:
     print(f"Register: {a} : {e:04x} | {e}")
@@ -153,7 +165,7 @@ for e in results:
 # 1056 = battery charge today
 # 1060 = load consumption today
 print("\n\nEnergy used today")
-results = client.read_input_registers(1044, 20, slave=1).registers
+results = inputs(1044, 20)
 a = 1044
 print(results)
 for e in range(0, len(results), 2):
@@ -162,7 +174,7 @@ for e in range(0, len(results), 2):
     #print(a*1000)
     a += 2
 
-results = client.read_input_registers(1056, 2, slave=1).registers
+results = inputs(1056, 2)
 a = 1056
 print(results)
 for e in range(0, len(results), 2):
@@ -175,7 +187,7 @@ for e in range(0, len(results), 2):
 
 
 print("\n\nEnergy used today")
-results = client.read_input_registers(100, 20, slave=1).registers
+results = inputs(100, 20)
 a = 100
 print(results)
 for e in range(0, len(results), 2):
@@ -185,19 +197,19 @@ for e in range(0, len(results), 2):
     a += 2
 
 print("\n\nWork time total")
-results = client.read_input_registers(57, 2, slave=1).registers
+results = inputs(57, 2)
 sum = results[0] << 16 | results[1]
 print(f"Register: 57 : {sum}")
 print(f"Register: 57 : {(sum/2)/60/60} hours")
 
 print("\n\nLoad load total")
-results = client.read_input_registers(1062, 2, slave=1).registers
+results = inputs(1062, 2)
 print(results)
 sum = results[0] << 16 | results[1]
 print(f"Register: 1062 : {sum/10}kWh")
 
-runtime    = client.read_input_registers(57, 2, slave=1).registers
-total_load = client.read_input_registers(1062, 2, slave=1).registers
+runtime    = inputs(57, 2)
+total_load = inputs(1062, 2)
 runtime = ((runtime[0] << 16 | runtime[1]) / 2) / 60 / 60 # Reading is in 0.5 second increments.  Convert to hours.
 total_load = (total_load[0] << 16 | total_load[1]) / 10 # Reading is in 0.1kWh increments.  Convert to kWh.
 print(f"Runtime: {runtime} hours\nTotal load: {total_load} kWh")
@@ -205,7 +217,7 @@ average_load = total_load / runtime
 print(f"Average load: {average_load} kWh")
 
 print("Status:")
-results = client.read_input_registers(0,100, slave=1).registers
+results = inputs(0, 100)
 for index, item in enumerate(results):
     print(f"{index}: {item}")
 
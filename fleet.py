@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# More than one inverter.  The plan is worked out once and then every inverter is read or programmed at the same
+# time, each from its own thread with its own Modbus connection.  The serial bridges are slow, so doing them one
+# after another took minutes; now it takes about as long as the slowest one.
+#
+# An inverter is given as "address[:battery kWh[:charge slots]]" on the command line, e.g.
+#   agile_prices.py -e -i ew11-1 ew11-2:13:5
+# programs the same schedule on both, and leaves slot 6 on ew11-2 alone (e.g. for Home Assistant).
+# The battery size is read from the inverter if it isn't given.
+#
+# Usage:
+#   fleet.py ew11-1 ew11-2              Print the SOC and charge slots of each inverter
+
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser
+
+import registers
+from inverter import Inverter
+
+MAX_CHARGE_SLOTS = 6 # Battery first time slots on the inverter
+KWH_PER_MODULE = 6.5
+
+Member = namedtuple('Member', ['address', 'battery_size', 'charge_slots'])
+Result = namedtuple('Result', ['address', 'value', 'error', 'seconds'])
+
+
+def parse_member(spec):
+    address, *rest = spec.split(":")
+    if len(rest) > 2 or not address:
+        raise ValueError(f"Expected address[:battery kWh[:charge slots]], not {spec}")
+    battery_size = float(rest[0]) if rest and rest[0] else None
+    charge_slots = int(rest[1]) if len(rest) > 1 else MAX_CHARGE_SLOTS
+    if not 0 <= charge_slots <= MAX_CHARGE_SLOTS:
+        raise ValueError(f"An inverter has {MAX_CHARGE_SLOTS} charge slots, not {charge_slots}")
+    return Member(address, battery_size, charge_slots)
+
+
+def run(members, fn, connect_fn=Inverter):
+    # fn(member, inverter) for every member at once, each with its own connection.  Returns {address: Result} in the
+    # same order as members.  One inverter failing doesn't stop the others, its Result has the error instead.
+    def one(member):
+        started = time.monotonic()
+        inverter = connect_fn(member.address)
+        try:
+            return Result(member.address, fn(member, inverter), None, time.monotonic() - started)
+        except Exception as e:
+            return Result(member.address, None, e, time.monotonic() - started)
+        finally:
+            inverter.close()
+    with ThreadPoolExecutor(max_workers=max(1, len(members)), thread_name_prefix="inverter") as pool:
+        return {result.address: result for result in pool.map(one, members)}
+
+
+def program(members, desired_fn, dummy=True, sync_clock=False, connect_fn=Inverter):
+    # desired_fn(charge slots) gives the {holding register: value} for each inverter.  The value of each Result is the
+    # list of writes, see agile_prices.program_inverter()
+    import agile_prices
+    def program_one(member, inverter):
+        return agile_prices.program_inverter(desired_fn(member.charge_slots), dummy, sync_clock, inv=inverter)
+    return run(members, program_one, connect_fn)
+
+
+def read_status(member, inverter):
+    current = registers.read_registers(inverter, ['battery_soc', 'battery_modules', 'charge_stop_soc', 'charge_slots_1_3', 'charge_slots_4_6'])
+    battery_size = member.battery_size or current['battery_modules'] * KWH_PER_MODULE
+    slots = (current['charge_slots_1_3'] + current['charge_slots_4_6'])[:member.charge_slots]
+    return {'soc': current['battery_soc'], 'battery_size': battery_size, 'battery_kwh': battery_size * current['battery_soc'] / 100,
+            'charge_stop_soc': current['charge_stop_soc'], 'charge_slots': [slot for slot in slots if slot[2]]}
+
+
+def status(members, connect_fn=Inverter):
+    return run(members, read_status, connect_fn)
+
+
+def report(results, done="done"):
+    # One line per inverter.  Returns True if they all worked.
+    for result in results.values():
+        if result.error is None:
+            print(f"{result.address}: {done} in {result.seconds:.1f}s")
+        else:
+            print(f"{result.address}: failed after {result.seconds:.1f}s ({result.error})")
+    return all(result.error is None for result in results.values())
+
+
+def print_status(results):
+    total_kwh = 0
+    for result in results.values():
+        if result.error is not None:
+            print(f"{result.address}: failed ({result.error})")
+            continue
+        s = result.value
+        total_kwh += s['battery_kwh']
+        slots = ", ".join(f"{start:%H:%M}-{end:%H:%M}" for start, end, enabled in s['charge_slots']) or "none"
+        print(f"{result.address}: {s['soc']}% of {s['battery_size']}kWh, charging to {s['charge_stop_soc']}% in {slots}")
+    print(f"Total: {total_kwh:.1f}kWh")
+
+
+def parse_args():
+    parser = ArgumentParser(description="Print the SOC and charge slots of several inverters at once.")
+    parser.add_argument("inverters", help="address[:battery kWh[:charge slots]] for each inverter", nargs="+", type=parse_member)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print_status(status(args.inverters))
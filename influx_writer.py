@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+# Writes points to InfluxDB from a background thread, in batches, without writing the same point twice.
+# Points are line protocol strings, each with a key (measurement + timestamp).  We remember every point Influx has
+# accepted, so sending the same day's prices again on the next run only sends the ones that are new or different.
+# If a batch can't be written (Influx down, network gone, a 5xx or 429) it's spooled to disk and replayed the next
+# time a write gets through, so nothing is lost.  A batch Influx turns down with any other 4xx (bad points, wrong
+# token) would only be turned down again, so it's put aside as rejected-*.json in the spool directory instead, where
+# it doesn't hold up the batches behind it.
+#
+# It talks to the InfluxDB v2 HTTP API with requests rather than going through influxdb_client, which is a lot to
+# import for what is one POST.
+
+import os
+import json
+import time
+import queue
+import threading
+
+from json_file import read_json, write_json
+
+SPOOL_DIR = os.path.expanduser("~/.cache/octopus_agile/influx_spool")
+BATCH_SIZE = 500 # points per request
+LINGER_SECONDS = 1 # how long to wait for more points before sending a part full batch
+TIMEOUT = 10 # seconds for each request
+REMEMBER_SECONDS = 14 * 24 * 60 * 60 # forget points older than this, measured by their timestamp
+STOP = None
+
+
+def escape_key(s):
+    return str(s).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def escape_string(s):
+    return str(s).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def format_field(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return f'"{escape_string(value)}"'
+
+
+def line(measurement, fields, timestamp_ns, tags=None):
+    # Returns (key, line protocol) for one point.  Fields are written in the order given.
+    tag_set = "".join(f",{escape_key(k)}={escape_key(v)}" for k, v in sorted((tags or {}).items()))
+    field_set = ",".join(f"{escape_key(k)}={format_field(v)}" for k, v in fields.items())
+    series = f"{escape_key(measurement)}{tag_set}"
+    return f"{series} {timestamp_ns}", f"{series} {field_set} {timestamp_ns}"
+
+
+def price_lines(prices, measurement='agile_prices'):
+    # The same points Prices.write_to_influxdb used to write as a DataFrame: start_time is the timestamp, end_time
+    # is a string field and value_inc_vat a float.
+    lines = []
+    for r in prices.itertuples():
+        if r.value_inc_vat != r.value_inc_vat: # NaN
+            continue
+        lines.append(line(measurement, {'end_time': str(r.end_time), 'value_inc_vat': float(r.value_inc_vat)}, r.start_time.value))
+    return lines
+
+
+class InfluxWriteError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def rejected(e):
+    # Whether sending the same batch again would only fail the same way
+    return isinstance(e, InfluxWriteError) and e.status_code is not None and 400 <= e.status_code < 500 and e.status_code != 429
+
+
+class InfluxWriter:
+    def __init__(self, url, token, org, bucket, spool_dir=SPOOL_DIR, batch_size=BATCH_SIZE, linger_seconds=LINGER_SECONDS, session=None):
+        # session lets you hand in something that looks like a requests.Session, e.g. for testing
+        self.url = url.rstrip("/") + "/api/v2/write"
+        self.params = {'org': org, 'bucket': bucket, 'precision': 'ns'}
+        self.headers = {'Authorization': f"Token {token}", 'Content-Type': 'text/plain; charset=utf-8'}
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.linger_seconds = linger_seconds
+        self.session = session
+        self.lock = threading.Lock()
+        self.written = self.load_written() # {key: line} for everything Influx has accepted
+        self.queued = set()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="influx-writer", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # What's been written, kept next to the spool
+
+    def written_path(self):
+        return os.path.join(self.spool_dir, "written.json")
+
+    def load_written(self):
+        # If it's missing or mangled, worst case we write some points again, which Influx doesn't mind
+        return read_json(self.written_path(), {})
+
+    def save_written(self):
+        # Points far enough in the past won't be sent again, so there's no need to remember them forever
+        oldest = (time.time() - REMEMBER_SECONDS) * 1e9
+        with self.lock:
+            self.written = {key: value for key, value in self.written.items() if int(key.rsplit(" ", 1)[1]) >= oldest}
+            written = dict(self.written)
+        write_json(self.written_path(), written)
+
+    # Public interface
+
+    def write(self, lines):
+        # lines is a list of (key, line).  Returns how many were queued, after leaving out the ones Influx already has.
+        # Doesn't wait for them to be sent, see flush().
+        count = 0
+        with self.lock:
+            for key, value in lines:
+                if self.written.get(key) == value or (key, value) in self.queued:
+                    continue
+                self.queued.add((key, value))
+                self.queue.put((key, value))
+                count += 1
+        return count
+
+    def flush(self):
+        # Wait until everything queued so far has been written or spooled
+        self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(STOP)
+            self.thread.join()
+
+    # The background thread
+
+    def run(self):
+        self.replay_spool()
+        while True:
+            item = self.queue.get()
+            if item is STOP:
+                self.queue.task_done()
+                return
+            batch = [item]
+            stopping = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=self.linger_seconds)
+                except queue.Empty:
+                    break
+                if item is STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                if self.send_batch(batch):
+                    self.replay_spool()
+            finally:
+                with self.lock:
+                    self.queued.difference_update(batch)
+                for _ in range(len(batch) + stopping):
+                    self.queue.task_done()
+            if stopping:
+                return
+
+    def send_batch(self, batch):
+        # Returns True if Influx took it, otherwise it's spooled for later or put aside if it was rejected
+        try:
+            self.post(batch)
+        except Exception as e:
+            if rejected(e):
+                print(f"InfluxDB rejected {len(batch)} points ({e}), putting them aside")
+                self.spool(batch, "rejected-")
+                return True
+            print(f"Failed to write {len(batch)} points to InfluxDB ({e}), spooling them for later")
+            self.spool(batch)
+            return False
+        self.remember(batch)
+        return True
+
+    def post(self, batch):
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+        r = self.session.post(self.url, params=self.params, headers=self.headers, data="\n".join(value for key, value in batch).encode(), timeout=TIMEOUT)
+        if r.status_code not in (200, 204):
+            raise InfluxWriteError(f"InfluxDB said {r.status_code}: {r.text}", r.status_code)
+
+    def remember(self, batch):
+        with self.lock:
+            for key, value in batch:
+                self.written[key] = value
+        self.save_written()
+
+    # The spool
+
+    def spool(self, batch, prefix="batch-"):
+        path = os.path.join(self.spool_dir, f"{prefix}{time.time_ns()}.json")
+        write_json(path, batch)
+
+    def spooled(self):
+        try:
+            names = os.listdir(self.spool_dir)
+        except OSError:
+            return []
+        return sorted(os.path.join(self.spool_dir, name) for name in names if name.startswith("batch-") and name.endswith(".json"))
+
+    def replay_spool(self):
+        # Oldest first, stopping at the first one that fails since Influx is probably still down.  Rejected ones are
+        # put aside and we carry on.
+        for path in self.spooled():
+            try:
+                with open(path) as fp:
+                    batch = [tuple(each) for each in json.load(fp)]
+            except (OSError, ValueError):
+                print(f"Can't read spooled batch {path}, skipping it")
+                continue
+            try:
+                self.post(batch)
+            except Exception as e:
+                if rejected(e):
+                    print(f"InfluxDB rejected spooled batch {path} ({e}), putting it aside")
+                    os.replace(path, os.path.join(self.spool_dir, "rejected-" + os.path.basename(path)[len("batch-"):]))
+                    continue
+                print(f"Still can't write spooled points to InfluxDB ({e})")
+                return
+            self.remember(batch)
+            os.remove(path)
+            print(f"Replayed {len(batch)} spooled points")
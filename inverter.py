@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# One long lived Modbus connection to a Growatt SPH inverter (via an EW11 or similar bridge).
+# Opening a new TCP connection for every register makes the serial bridge flaky and is slow, so everything
+# that talks to the inverter should go through one of these.  If the connection drops it is reopened
+# and the request tried again.
+
+import spans
+
+try:
+    from pymodbus.client import ModbusTcpClient
+    from pymodbus.exceptions import ModbusException
+    MODBUS = True
+except:
+    print("If you want to control your inverter with this script you need to install pymodbus")
+    MODBUS = False
+    ModbusException = Exception
+
+
+class InverterError(Exception):
+    pass
+
+
+class Inverter:
+    def __init__(self, address, slave=1, retries=2, client=None):
+        # client lets you hand in something that looks like a ModbusTcpClient, e.g. for testing
+        self.address = address
+        self.slave = slave
+        self.retries = retries
+        self.client = client
+
+    def connect(self):
+        if self.client is None:
+            if not MODBUS:
+                raise InverterError("pymodbus is not installed")
+            self.client = ModbusTcpClient(self.address)
+        if not self.client.is_socket_open():
+            if not self.client.connect():
+                raise InverterError(f"Failed to connect to inverter at {self.address}")
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, method, address, *args):
+        # Make one Modbus call, reconnecting and trying again if the connection has gone away
+        with spans.span(f"modbus {method}"):
+            return self.retry(method, address, *args)
+
+    def retry(self, method, address, *args):
+        last_error = None
+        for attempt in range(self.retries + 1):
+            try:
+                self.connect()
+                result = getattr(self.client, method)(address, *args, slave=self.slave)
+                if not result.isError():
+                    return result
+                last_error = result
+            except (ModbusException, OSError, InverterError) as e:
+                last_error = e
+            print(f"Modbus {method} {address} on {self.address} failed ({last_error}), reconnecting")
+            self.close()
+        raise InverterError(f"Modbus {method} {address} on {self.address} failed after {self.retries + 1} attempts: {last_error}")
+
+    def read_holding_registers(self, address, count=1):
+        return self.request("read_holding_registers", address, count).registers
+
+    def read_input_registers(self, address, count=1):
+        return self.request("read_input_registers", address, count).registers
+
+    def write_registers(self, address, values_list):
+        return self.request("write_registers", address, values_list)
+
+    def read_input_u32(self, address):
+        # Lots of the energy counters are 32 bit values split over two registers, high word first
+        high, low = self.read_input_registers(address, 2)
+        return high << 16 | low
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+
+# Reading and writing the small JSON files we keep under ~/.cache: the price and plan caches, the solar forecast and
+# the InfluxDB writer's spool.  Writes go to a .tmp file which is then renamed over the real one, so a cron run being
+# killed half way through can't leave a broken file behind.
+
+import os
+import json
+
+
+def read_json(path, default=None):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        # Missing or mangled.  Either way start again, they're only caches.
+        return default
+
+
+def write_json(path, value):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(value, fp)
+    os.replace(tmp_path, path)
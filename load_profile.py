@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+# Expected household load for each half hour, from what the house has actually used rather than a fixed % per hour.
+#
+# History (telemetry.py's half hours, or half hourly meter readings from Octopus) is grouped by local day of the week
+# and half hour of the day, giving a 7 x 48 table of kWh.  Recent weeks count for more than older ones: each reading's
+# weight halves every HALF_LIFE_DAYS.  Asking for a quantile instead of the mean gives a more cautious figure, e.g.
+# 0.8 is a load we'd only expect to go over one week in five.  A day/half hour with no history falls back to the same
+# half hour on the other days, then to everything.
+#
+# The planners ask for the forecast several times a run, so the profile is only built once for each version of the
+# telemetry (its file's size and modification time, or the archive's length) and half hour.  After that a forecast is
+# a lookup of the next 48 cells, worked out with integer arithmetic rather than by converting times with pandas.
+#
+# Usage:
+#   load_profile.py                     Print the next 24 hours from the telemetry on disk
+#   load_profile.py -q 0.8              ... using the 80th percentile instead of the mean
+
+import os
+import time
+import datetime
+from argparse import ArgumentParser
+
+import numpy as np
+
+LOCAL_TZ = "Europe/London"
+SLOTS = 48 # half hours in a day
+HALF_HOUR = 1800
+HALF_LIFE_DAYS = 14
+HISTORY_DAYS = 8 * 7
+MIN_DAYS = 3 # Less history than this and the planners fall back to the inverter's lifetime average
+EPOCH_DAY_OF_WEEK = 3 # 1970-01-01 was a Thursday
+
+profiles = {} # The last profile built by load_forecast(), keyed by where it came from and when, see profile_key()
+
+
+def local_cells(starts):
+    # Index in to the 7 x 48 table (day of the week * 48 + half hour, Monday first) for each start, in seconds since
+    # the epoch.  The hour that repeats when the clocks go back lands in the same cells twice, which is fine.
+    import pandas as pd
+    local = pd.to_datetime(np.asarray(starts, dtype=np.int64), unit='s', utc=True).tz_convert(LOCAL_TZ)
+    return np.asarray(local.dayofweek * SLOTS + local.hour * 2 + local.minute // 30, dtype=np.int64)
+
+
+def utc_offset(t):
+    # Seconds local time is ahead of UTC at t, in seconds since the epoch
+    import pytz
+    return int(datetime.datetime.fromtimestamp(int(t), pytz.timezone(LOCAL_TZ)).utcoffset().total_seconds())
+
+
+def slot_cells(first, slots=SLOTS):
+    # local_cells() for slots half hours from first (seconds since the epoch, on the half hour).  Local time is UTC
+    # plus the offset at either end, and only if the clocks change in between is it looked up for every half hour.
+    starts = first + HALF_HOUR * np.arange(slots, dtype=np.int64)
+    if slots == 0:
+        return starts
+    offset = utc_offset(starts[0])
+    if utc_offset(starts[-1]) == offset:
+        local = starts + offset
+    else:
+        local = starts + np.array([utc_offset(t) for t in starts], dtype=np.int64)
+    day_of_week = (local // 86400 + EPOCH_DAY_OF_WEEK) % 7
+    return day_of_week * SLOTS + local % 86400 // HALF_HOUR
+
+
+def recency_weights(starts, now, half_life_days=HALF_LIFE_DAYS):
+    age_days = np.maximum(now - np.asarray(starts, dtype=np.float64), 0) / 86400
+    return 0.5 ** (age_days / half_life_days)
+
+
+def weighted_quantiles(cells, values, weights, q, n):
+    # The weighted q quantile of values in each of n cells, NaN for cells with nothing in them.  One sort for all of
+    # them: order by cell then value, and take the first value in each cell where the running weight reaches q.
+    order = np.lexsort((values, cells))
+    cells, values, weights = cells[order], values[order], weights[order]
+    totals = np.bincount(cells, weights, minlength=n)
+    within = np.cumsum(weights) - np.concatenate(([0], np.cumsum(totals)))[cells]
+    reached = within >= q * totals[cells] * (1 - 1e-9)
+    found, first = np.unique(cells[reached], return_index=True)
+    result = np.full(n, np.nan)
+    result[found] = values[reached][first]
+    return result
+
+
+def aggregate(cells, values, weights, n, quantile=None):
+    if quantile is not None:
+        return weighted_quantiles(cells, values, weights, quantile, n)
+    totals = np.bincount(cells, weights, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.bincount(cells, weights * values, minlength=n) / totals
+
+
+def build_profile(starts, kwh, now=None, half_life_days=HALF_LIFE_DAYS, quantile=None):
+    # starts are in seconds since the epoch, kwh is what was used in each of those half hours.  Returns a 7 x 48 array
+    # of kWh per half hour, Monday first, in local time, or None if there's no history at all.
+    starts = np.asarray(starts, dtype=np.int64)
+    kwh = np.asarray(kwh, dtype=np.float64)
+    known = np.isfinite(kwh)
+    starts, kwh = starts[known], kwh[known]
+    if len(starts) == 0:
+        return None
+    if now is None:
+        now = time.time()
+    cells = local_cells(starts)
+    weights = recency_weights(starts, now, half_life_days)
+    table = aggregate(cells, kwh, weights, 7 * SLOTS, quantile).reshape(7, SLOTS)
+    missing = np.isnan(table)
+    if missing.any():
+        by_slot = aggregate(cells % SLOTS, kwh, weights, SLOTS, quantile)
+        table = np.where(missing, by_slot[None, :], table)
+        overall = aggregate(np.zeros(len(cells), dtype=np.int64), kwh, weights, 1, quantile)[0]
+        table = np.where(np.isnan(table), overall, table)
+    return table
+
+
+def expected_load(profile, start, slots=SLOTS):
+    # kWh for each of the slots half hours from the one start is in
+    first = int(start.timestamp()) // HALF_HOUR * HALF_HOUR
+    return profile.reshape(-1)[slot_cells(first, slots)]
+
+
+def from_telemetry(records):
+    # (starts, kwh) from telemetry.read_half_hours().  load_w is the average over the half hour.
+    return records['start'].astype(np.int64), records['load_w'].astype(np.float64) * 0.5 / 1000
+
+
+def from_consumption(results):
+    # (starts, kwh) from the "results" of Octopus's half hourly consumption API
+    import pandas as pd
+    if not results:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    starts = pd.to_datetime([r['interval_start'] for r in results], utc=True)
+    return np.asarray(starts.asi8 // 10**9), np.array([r['consumption'] for r in results], dtype=np.float64)
+
+
+def profile_key(path, archive, first, quantile, min_days):
+    if archive is not None:
+        source = ('archive', archive.directory, len(archive))
+    else:
+        try:
+            stat = os.stat(path)
+            source = ('file', path, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            source = ('file', path, None, None)
+    return source, first, quantile, min_days
+
+
+def read_profile(first, path, archive, quantile, min_days):
+    # The profile from the HISTORY_DAYS of half hours up to and including the one starting at first, or None if
+    # there are fewer than min_days of them
+    import telemetry
+    since = first + HALF_HOUR - HISTORY_DAYS * 86400
+    if archive is not None:
+        records = archive.range(since, first + HALF_HOUR)
+    else:
+        records = telemetry.read_half_hours(path, since=since)
+        records = records[records['start'] <= first]
+    if len(records['start']) < min_days * SLOTS:
+        return None
+    starts, kwh = from_telemetry(records)
+    # Every weight is scaled by the same amount as time goes by, so the half hour is as good as now
+    return build_profile(starts, kwh, now=first, quantile=quantile)
+
+
+def load_forecast(now=None, path=None, quantile=None, min_days=MIN_DAYS, archive=None):
+    # Expected kWh for each of the next 48 half hours, built from the telemetry poller's history up to now.  None
+    # if we don't have min_days of it yet.  archive reads it from a telemetry archive (telemetry.get_archive())
+    # rather than the poller's file, which only reads the HISTORY_DAYS we want.
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    if path is None and archive is None:
+        import telemetry
+        path = telemetry.TELEMETRY_PATH
+    first = int(now.timestamp()) // HALF_HOUR * HALF_HOUR
+    key = profile_key(path, archive, first, quantile, min_days)
+    if key not in profiles:
+        profiles.clear()
+        profiles[key] = read_profile(first, path, archive, quantile, min_days)
+    profile = profiles[key]
+    return None if profile is None else expected_load(profile, now)
+
+
+def parse_args():
+    parser = ArgumentParser(description="Print the expected household load for the next 24 hours.")
+    parser.add_argument("-f", "--file", dest="path", help="Telemetry file. Default is telemetry.py's", default=None)
+    parser.add_argument("-a", "--archive", dest="archive", help="Read the telemetry archive rather than the poller's file", action="store_true")
+    parser.add_argument("-q", "--quantile", dest="quantile", help="Use this quantile (0-1) instead of the mean", default=None, type=float)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if args.archive:
+        import telemetry
+        load = load_forecast(now, quantile=args.quantile, archive=telemetry.get_archive())
+    else:
+        load = load_forecast(now, args.path, args.quantile)
+    if load is None:
+        print(f"Not enough telemetry yet, need at least {MIN_DAYS} days")
+    else:
+        first = int(now.timestamp()) // HALF_HOUR * HALF_HOUR
+        for i, kwh in enumerate(load):
+            print(f"{datetime.datetime.fromtimestamp(first + i * HALF_HOUR):%a %H:%M}  {kwh:.2f} kWh")
+        print(f"Total: {load.sum():.1f} kWh")
@@ -1,19 +1,23 @@
 #!/usr/bin/env python3
 
 import sys
-import requests
 import pandas as pd
+import numpy as np
 import datetime
 import pytz
 from argparse import ArgumentParser
 import math
-
-try:
-    from pymodbus.client import ModbusTcpClient
-    MODBUS = True
-except:
-    print("If you want to control your inverter with this script you need to install pymodbus")
-    MODBUS = False
+import atexit
+
+import price_cache
+import octopus_api
+import price_parser
+from price_series import PriceSeries
+from inverter import Inverter, MODBUS
+import registers
+import optimiser
+import solar_forecast
+import load_profile
 
 __version__ = '0.0.1'
 GAS_PRICE = 10.2 * 10000 # pence per kWh
@@ -21,62 +25,66 @@ POWER_RESERVE_IN_CASE_OF_POWERCUT_HOURS = 2
 BATTERY_CHARGE_RATE = 2.7 # kW/h
 BATTERY_CAPACITY = 13 # kWh
 INVERTER_ADDR = "ew11-1"
+MAX_CHARGE_SLOTS = 6 # Battery first time slots on the inverter
+inverter = None # The shared Inverter connection.  Use get_inverter()
+
+def get_inverter():
+    # One connection for the whole run rather than one per register
+    global inverter
+    if inverter is None:
+        inverter = Inverter(INVERTER_ADDR)
+        atexit.register(inverter.close)
+    return inverter
 
 def get_current_battery_charge():
     if not MODBUS:
         return 0
-    client = ModbusTcpClient(INVERTER_ADDR)
-    client.connect()
-    results = client.read_input_registers(1014, 1, slave=1)
-    client.close()
-    soc = results.registers[0]
+    soc = get_inverter().read_input_registers(1014, 1)[0]
     battery_kwh = 13 / 100 * soc
     return battery_kwh
 
 
 def get_forecast_solar_prediction():
-    url = "https://api.forecast.solar/estimate/watthours/day/52.1322466021396/-0.21998598515728754/27/-80/6.720"
-    # Might change this to use the per-hour data.  Then we can see how much solar is left for the day.
-    # That might mean signing up for an account, then we can hit the API once a minute if we really want to
-    headers = {"Accept": "application/json"}
-    r = requests.get(url, headers=headers)
-    j = r.json()
-    if not j["result"]:
-        print("Problem fetching the solar prediction")
-        print(r.text)
-        raise Exception("Solar problem")
-    wh = j['result'][(datetime.datetime.now() + datetime.timedelta(days=1)).strftime('%Y-%m-%d')]
-    return wh / 1000
-
-
-def actually_get_prices_from_octopus(start_time, end_time):
-    base_url = "https://api.octopus.energy/v1"
-    product_code = "AGILE-FLEX-22-11-25"
-    tariff_code = "E-1R-AGILE-FLEX-22-11-25-A" # https://api.octopus.energy/v1/products/AGILE-FLEX-22-11-25
-    
-    agile_price_url = f"{base_url}/products/{product_code}/electricity-tariffs/{tariff_code}/standard-unit-rates/"
-    url_params = {
-        "period_from": start_time,
-        "period_to": end_time
-    }
-    r = requests.get(agile_price_url, params=url_params)
-    if r.status_code == 200:
-        prices_dict = r.json()
-        return prices_dict
-    else:
-        raise Exception(
-            f"Failed to fetch from Octopus with this complaint: {r.text}")
+    # kWh tomorrow.  Cached, and falls back to the last forecast we had if forecast.solar is throttling us, see
+    # solar_forecast.py
+    return solar_forecast.tomorrow_kwh()
+
+
+def actually_get_prices_from_octopus(start_time, end_time, use_cache=True, tariff=octopus_api.TARIFF_CODE):
+    # tariff is a region letter or a whole tariff code, see octopus_api.parse_tariff()
+    product_code, tariff_code = octopus_api.parse_tariff(tariff)
+
+    # fetch_unit_rates follows the "next" links so we get every page, not just the first
+    if not use_cache:
+        return octopus_api.fetch_unit_rates(start_time, end_time, product_code, tariff_code)
+    # Published prices never change, so only go to Octopus for the half hours we don't already have
+    prices_dict = price_cache.get_unit_rates(tariff_code, start_time, end_time,
+                                             lambda period_from, period_to: octopus_api.fetch_unit_rates(period_from, period_to, product_code, tariff_code)['results'])
+    return prices_dict
 
 
 def plan(electricity_provider_fn=actually_get_prices_from_octopus,
          get_forecast_fn=get_forecast_solar_prediction,
-         get_battery_charge_fn=get_current_battery_charge):
-    # Get the prices from Octopus
-    electricity_prices_slots = get_prices_from_octopus(electricity_provider_fn=electricity_provider_fn) # returns a pandas dataframe
-    free_electricity_slots   = electricity_prices_slots.drop(electricity_prices_slots[electricity_prices_slots.cost  > 0].index)
-    less_than_gas_slots      = electricity_prices_slots.drop(electricity_prices_slots[electricity_prices_slots.cost  > GAS_PRICE].index)
-    slots_dict = {'all': electricity_prices_slots, 'free': free_electricity_slots, 'less_than_gas': less_than_gas_slots}
-    slots_dict['daily_load'] = get_lifetime_average_daily_load()
+         get_battery_charge_fn=get_current_battery_charge,
+         get_daily_load_fn=None,
+         start_time=None,
+         get_load_fn=load_profile.load_forecast):
+    # start_time defaults to now.  get_load_fn gives the expected kWh for each of the next 48 half hours, or None if
+    # it can't, in which case get_daily_load_fn is used.  That defaults to asking the inverter, see
+    # get_lifetime_average_daily_load()
+    if get_daily_load_fn is None:
+        get_daily_load_fn = get_lifetime_average_daily_load
+    # Get the prices from Octopus.  The cost is fixed point, in 1/10000ths of a penny, see price_series.py
+    series = get_price_series(start_time=start_time, electricity_provider_fn=electricity_provider_fn)
+    slots_dict = {'series': series,
+                  'all': series.frame(value_column='cost', fixed_point=True),
+                  'free': series.frame(np.flatnonzero(series.price <= 0), value_column='cost', fixed_point=True),
+                  'less_than_gas': series.frame(np.flatnonzero(series.price <= GAS_PRICE), value_column='cost', fixed_point=True)}
+    slots_dict['load_forecast'] = get_load_fn(start_time)
+    if slots_dict['load_forecast'] is None:
+        slots_dict['daily_load'] = get_daily_load_fn()
+    else:
+        slots_dict['daily_load'] = slots_dict['load_forecast'].sum()
     slots_dict['shortfall'] = get_shortfall(get_forecast_fn=get_forecast_fn, avg_load=slots_dict['daily_load'])
     slots_dict['battery_kwh_remaining'] = get_battery_charge_fn()
     return slots_dict
@@ -88,13 +96,19 @@ def calculation(slots_dict):
     shortfall                = slots_dict['shortfall']
     battery_kwh_remaining    = slots_dict['battery_kwh_remaining']
     daily_load               = slots_dict['daily_load']
+    load_forecast            = slots_dict.get('load_forecast')
 
     print(f"Shortfall: {shortfall}")
     print(f"Current battery charge: {battery_kwh_remaining} kWh")
     print(f"Daily load: {daily_load}")
 
     
-    buffer_kwh = POWER_RESERVE_IN_CASE_OF_POWERCUT_HOURS / 24 * daily_load # 2 hours of buffer.
+    if load_forecast is None:
+        buffer_kwh = POWER_RESERVE_IN_CASE_OF_POWERCUT_HOURS / 24 * daily_load # 2 hours of buffer.
+    else:
+        # Enough for the busiest 2 hours of the day rather than an average 2 hours
+        reserve_slots = POWER_RESERVE_IN_CASE_OF_POWERCUT_HOURS * 2
+        buffer_kwh = pd.Series(load_forecast).rolling(reserve_slots).sum().max()
     power_needed = (shortfall + buffer_kwh) - battery_kwh_remaining
     slots_needed = math.ceil(power_needed / (BATTERY_CHARGE_RATE / 2))
     print(f"Slots needed: {slots_needed}")
@@ -102,19 +116,15 @@ def calculation(slots_dict):
     if len(free_electricity_slots) >= slots_needed:
         battery_charge_slots = free_electricity_slots.copy()
     else:
-        battery_charge_slots = electricity_prices_slots.copy()
-        battery_charge_slots.sort_values(by=['cost'], inplace=True)
-        battery_charge_slots = battery_charge_slots.head(slots_needed)
-        battery_charge_slots.sort_values(by=['start_time'], inplace=True)
+        # Cheapest slots that will fit in to the inverter's time slots once they're merged
+        battery_charge_slots = optimiser.cheapest_charge_slots(electricity_prices_slots, power_needed, BATTERY_CHARGE_RATE, MAX_CHARGE_SLOTS, price_column='cost', slots_needed=slots_needed).copy()
         print(f"Battery charge slots: {battery_charge_slots}")
     
-    hot_water_slots = less_than_gas_slots.copy()
-    hot_water_slots.sort_values(by=['start_time'], inplace=True)
+    hot_water_slots = less_than_gas_slots.copy() # Already in time order
 
     # Add hot water slots to battery slots BEFORE we coalesce the hot water slots
-    battery_charge_slots = pd.concat([battery_charge_slots, hot_water_slots])
-    battery_charge_slots.sort_values(by=['start_time'], inplace=True)
-    battery_charge_slots = battery_charge_slots.drop_duplicates(subset='end_time', keep="first")
+    # Both are rows of the 'all' frame, labelled by their position in the series, so that's the time order too
+    battery_charge_slots = electricity_prices_slots.loc[np.union1d(battery_charge_slots.index, hot_water_slots.index)]
     max_battery_charge_percent = math.ceil((power_needed / BATTERY_CAPACITY) * 100)
 
 
@@ -145,8 +155,7 @@ def calculation(slots_dict):
     dishwasher_slots = dishwasher_slots.rolling('2h', min_periods=4, on=dishwasher_slots.index).mean()
     dishwasher_slots = dishwasher_slots.dropna()
     dishwasher_slots = dishwasher_slots.reset_index()
-    dishwasher_slots['start_time'] = dishwasher_slots["start_time"] - datetime.timedelta(minutes=90)
-    dishwasher_slots.sort_values(by=['start_time'], inplace=True)
+    dishwasher_slots['start_time'] = dishwasher_slots["start_time"] - datetime.timedelta(minutes=90) # Still in time order
 
     calculation_dict = {'battery_charge_slots': battery_charge_slots, 'hot_water_slots': hot_water_slots, 'dishwasher_slots': dishwasher_slots, 'max_battery_charge_percent': max_battery_charge_percent, 'all_slots': electricity_prices_slots}
     return calculation_dict
@@ -165,7 +174,7 @@ def execute(calculation_dict):
     print(f"Battery charge slots: {battery_charge_slots}")
 
 
-def get_prices_from_octopus(start_time = None, end_time = None, electricity_provider_fn=actually_get_prices_from_octopus):
+def get_price_series(start_time = None, end_time = None, electricity_provider_fn=actually_get_prices_from_octopus):
     # Get the prices from Octopus
     # TODO: move the product code etc to either a config file or a command line argument, or pull it from the API
     if start_time is None:
@@ -179,25 +188,22 @@ def get_prices_from_octopus(start_time = None, end_time = None, electricity_prov
     print(f"End time: {end_time}")
 
     prices_dict = electricity_provider_fn(start_time, end_time)
-    start_time_list = pd.DatetimeIndex(x['valid_from'] for x in prices_dict['results'])
-    end_time_list   = pd.DatetimeIndex(x['valid_to']   for x in prices_dict['results'])
-    value_inc_vat   = [x['value_inc_vat']*10000 for x in prices_dict['results']]
-    electricity_prices_slots = pd.DataFrame({'start_time':start_time_list, 'end_time': end_time_list, 'cost': value_inc_vat})
-    electricity_prices_slots['duration'] = electricity_prices_slots.end_time - electricity_prices_slots.start_time
-    electricity_prices_slots.sort_values(by=['start_time'], inplace=True)
-    return electricity_prices_slots
-    
+    return PriceSeries.from_rates(price_parser.parse_results(prices_dict['results']))
+
+
+def get_prices_from_octopus(start_time = None, end_time = None, electricity_provider_fn=actually_get_prices_from_octopus):
+    # As a frame sorted by start time, with the cost in 1/10000ths of a penny
+    return get_price_series(start_time, end_time, electricity_provider_fn).frame(value_column='cost', fixed_point=True)
+
 
 def get_lifetime_average_daily_load():
     if not MODBUS:
         return 20
-    client = ModbusTcpClient(INVERTER_ADDR)
-    client.connect()
-    runtime    = client.read_input_registers(57, 2, slave=1).registers
-    total_load = client.read_input_registers(1062, 2, slave=1).registers
-    client.close()
-    runtime = ((runtime[0] << 16 | runtime[1]) / 2) / 60 / 60 # Reading is in 0.5 second increments.  Convert to hours.
-    total_load = (total_load[0] << 16 | total_load[1]) / 10 # Reading is in 0.1kWh increments.  Convert to kWh.
+    current = registers.read_registers(get_inverter(), ['runtime', 'load_total'])
+    runtime    = current['runtime']
+    total_load = current['load_total']
+    runtime = (runtime / 2) / 60 / 60 # Reading is in 0.5 second increments.  Convert to hours.
+    total_load = total_load / 10 # Reading is in 0.1kWh increments.  Convert to kWh.
     #print(f"Total inverter running time: {runtime} hours\nTotal load: {total_load} kWh")
     average_load = total_load / runtime # per hour
     average_load = average_load * 24
@@ -207,12 +213,8 @@ def get_lifetime_average_daily_load():
 def get_local_load_today():
     if not MODBUS:
         return False
-    client = ModbusTcpClient(INVERTER_ADDR)
-    client.connect()
-    results = client.read_input_registers(1060, 2, slave=1).registers
-    #batt_charge = client.read_input_registers(1056, 2, slave=1).registers
-    client.close()
-    inv1 = results[0] << 16 | results[1]
+    inv1 = get_inverter().read_input_u32(1060)
+    #batt_charge = get_inverter().read_input_u32(1056)
     # int is close enough precision for my purposes
     print(f"Local load today: {int(inv1/10)}")
     return int(inv1/10)
@@ -7,46 +7,41 @@ import datetime
 import pytz
 from argparse import ArgumentParser
 import math
+import atexit
 
-try:
-    from pymodbus.client import ModbusTcpClient
-    MODBUS = True
-except:
-    print("If you want to control your inverter with this script you need to install pymodbus")
-    MODBUS = False
+from inverter import Inverter, MODBUS
+import optimiser
+import plan_cache
+import solar_forecast
 
 __version__ = '0.0.1'
 POWER_RESERVE_IN_CASE_OF_POWERCUT_HOURS = 2
 BATTERY_CHARGE_RATE = 2.7 # kW/h
 BATTERY_CAPACITY = 13 # kWh
 INVERTER_ADDR = "ew11-1"
+MAX_CHARGE_SLOTS = 5 # Battery first time slots we can use.  Slot 6 is left for HA
+inverter = None # The shared Inverter connection.  Use get_inverter()
+
+def get_inverter():
+    # One connection for the whole run rather than one per register
+    global inverter
+    if inverter is None:
+        inverter = Inverter(INVERTER_ADDR)
+        atexit.register(inverter.close)
+    return inverter
 
 def get_current_battery_charge():
     if not MODBUS:
         return False
-    client = ModbusTcpClient(INVERTER_ADDR)
-    client.connect()
-    results = client.read_input_registers(1014, 1, slave=1)
-    client.close()
-    soc = results.registers[0]
+    soc = get_inverter().read_input_registers(1014, 1)[0]
     battery_kwh = 13 / 100 * soc
     return battery_kwh
 
 
 def get_forecast_solar_prediction():
-    #return 3.723
-    url = "https://api.forecast.solar/estimate/watthours/day/52.1322466021396/-0.21998598515728754/27/-80/6.720"
-    # Might change this to use the per-hour data.  Then we can see how much solar is left for the day.
-    # That might mean signing up for an account, then we can hit the API once a minute if we really want to
-    headers = {"Accept": "application/json"}
-    r = requests.get(url, headers=headers)
-    j = r.json()
-    if not j["result"]:
-        print("Problem fetching the solar prediction")
-        print(r.text)
-        raise Exception("Solar problem")
-    wh = j['result'][(datetime.datetime.now() + datetime.timedelta(days=1)).strftime('%Y-%m-%d')]
-    return wh / 1000
+    # kWh tomorrow.  Cached, and falls back to the last forecast we had if forecast.solar is throttling us, see
+    # solar_forecast.py
+    return solar_forecast.tomorrow_kwh()
 
 
 def actually_get_prices_from_octopus(start_time, end_time):
@@ -96,10 +91,8 @@ def calculation(slots_dict):
     print(f"Slots needed: {slots_needed}")
 
     if slots_needed > 0:
-        battery_charge_slots = electricity_prices_slots.copy()
-        battery_charge_slots.sort_values(by=['cost'], inplace=True)
-        battery_charge_slots = battery_charge_slots.head(slots_needed)
-        battery_charge_slots.sort_values(by=['start_time'], inplace=True)
+        # Cheapest slots that will fit in to the inverter's time slots once they're merged
+        battery_charge_slots = optimiser.cheapest_charge_slots(electricity_prices_slots, power_needed, BATTERY_CHARGE_RATE, MAX_CHARGE_SLOTS, price_column='cost', slots_needed=slots_needed).copy()
         max_battery_charge_percent = math.ceil((power_needed / BATTERY_CAPACITY) * 100)
         print(f"Battery charge slots: {battery_charge_slots}")
 
@@ -165,13 +158,10 @@ def get_prices_from_octopus(start_time = None, end_time = None, electricity_prov
 def get_lifetime_average_daily_load():
     if not MODBUS:
         return 20
-    client = ModbusTcpClient(INVERTER_ADDR)
-    client.connect()
-    runtime    = client.read_input_registers(57, 2, slave=1).registers
-    total_load = client.read_input_registers(1062, 2, slave=1).registers
-    client.close()
-    runtime = ((runtime[0] << 16 | runtime[1]) / 2) / 60 / 60 # Reading is in 0.5 second increments.  Convert to hours.
-    total_load = (total_load[0] << 16 | total_load[1]) / 10 # Reading is in 0.1kWh increments.  Convert to kWh.
+    runtime    = get_inverter().read_input_u32(57)
+    total_load = get_inverter().read_input_u32(1062)
+    runtime = (runtime / 2) / 60 / 60 # Reading is in 0.5 second increments.  Convert to hours.
+    total_load = total_load / 10 # Reading is in 0.1kWh increments.  Convert to kWh.
     #print(f"Total inverter running time: {runtime} hours\nTotal load: {total_load} kWh")
     average_load = total_load / runtime # per hour
     average_load = average_load * 24
@@ -181,12 +171,8 @@ def get_lifetime_average_daily_load():
 def get_local_load_today():
     if not MODBUS:
         return False
-    client = ModbusTcpClient(INVERTER_ADDR)
-    client.connect()
-    results = client.read_input_registers(1060, 2, slave=1).registers
-    #batt_charge = client.read_input_registers(1056, 2, slave=1).registers
-    client.close()
-    inv1 = results[0] << 16 | results[1]
+    inv1 = get_inverter().read_input_u32(1060)
+    #batt_charge = get_inverter().read_input_u32(1056)
     # int is close enough precision for my purposes
     print(f"Local load today: {int(inv1/10)}")
     return int(inv1/10)
@@ -251,10 +237,10 @@ def set_max_soc(soc):
 
 def write_to_inverter(register, values_list):
     if MODBUS is True:
-        client = ModbusTcpClient(INVERTER_ADDR)
-        client.connect()
-        client.write_registers(register, values_list, slave=1)
-        client.close()
+        if register != 45:
+            # Charge slots or max SOC, so whatever plan agile_prices thinks is on the inverter isn't any more
+            plan_cache.get_plan_cache().forget_programmed()
+        get_inverter().write_registers(register, values_list)
         return True
     else:
         print("No MODBUS - can't write to inverter")
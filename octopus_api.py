@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+# Talking to the Octopus API.
+# The standard-unit-rates endpoint is paginated: each response has a "next" link and anything past the
+# first page is missed unless you follow it.  A day is 48 slots so that's fine for day-ahead planning,
+# but longer ranges (e.g. a year of history for analysis) need every page, so everything goes through here.
+
+import datetime
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+import price_cache
+import price_parser
+import spans
+
+BASE_URL = "https://api.octopus.energy/v1"
+PRODUCT_CODE = "AGILE-FLEX-22-11-25"
+TARIFF_CODE = "E-1R-AGILE-FLEX-22-11-25-A" # https://api.octopus.energy/v1/products/AGILE-FLEX-22-11-25
+PAGE_SIZE = 1500 # The biggest page Octopus will give us.  A month of half hours fits in one page.
+HISTORY_CHUNK_DAYS = 28
+HISTORY_WORKERS = 4
+REGIONS = "ABCDEFGHJKLMNP" # One letter per DNO region, the end of the tariff code.  There's no I or O.
+POOL_SIZE = len(REGIONS) # Connections kept open to Octopus when fetching several tariffs at once
+
+
+def unit_rates_url(product_code=PRODUCT_CODE, tariff_code=TARIFF_CODE):
+    return f"{BASE_URL}/products/{product_code}/electricity-tariffs/{tariff_code}/standard-unit-rates/"
+
+
+def tariff_code_for(region, product_code=PRODUCT_CODE):
+    region = region.upper()
+    if region not in REGIONS or len(region) != 1:
+        raise ValueError(f"Region must be one of {', '.join(REGIONS)}, not {region}")
+    return f"E-1R-{product_code}-{region}"
+
+
+def parse_tariff(spec):
+    # (product code, tariff code) from either a region letter, which gets the default product, or a whole
+    # tariff code like E-1R-AGILE-FLEX-22-11-25-B
+    if len(spec) == 1:
+        return PRODUCT_CODE, tariff_code_for(spec)
+    parts = spec.split("-")
+    if len(parts) < 4 or parts[0] != "E" or len(parts[-1]) != 1:
+        raise ValueError(f"Expected a region letter or a tariff code like {TARIFF_CODE}, not {spec}")
+    return "-".join(parts[2:-1]), spec
+
+
+def pooled_session(pool_size=POOL_SIZE):
+    # One session whose connections are shared between threads, so fetching every region costs one TLS
+    # handshake per connection rather than one per region per page
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+
+def iter_unit_rate_pages(period_from, period_to=None, product_code=PRODUCT_CODE, tariff_code=TARIFF_CODE, session=None, raw=False):
+    # Yields the "results" list of each page in turn, following the "next" links until there are none left.
+    # With raw it's the bytes of each response instead, for price_parser.parse_content()
+    if session is None:
+        session = requests.Session()
+    url_params = {"period_from": period_from, "page_size": PAGE_SIZE}
+    if period_to is not None:
+        url_params["period_to"] = period_to
+    url = unit_rates_url(product_code, tariff_code)
+    while url is not None:
+        with spans.span("octopus"):
+            r = session.get(url, params=url_params)
+        if r.status_code != 200:
+            raise Exception(
+                f"Failed to fetch from Octopus with this complaint: {r.text}")
+        # The next link already carries all the query parameters
+        if raw:
+            yield r.content
+            url = price_parser.next_url(r.content)
+        else:
+            page = r.json()
+            yield page['results']
+            url = page.get('next')
+        url_params = None
+
+
+def fetch_unit_rates(period_from, period_to=None, product_code=PRODUCT_CODE, tariff_code=TARIFF_CODE, session=None):
+    # Returns a dict shaped like a single Octopus response, but with every page's results in it.
+    results = []
+    for page in iter_unit_rate_pages(period_from, period_to, product_code, tariff_code, session):
+        results.extend(page)
+    return {'count': len(results), 'next': None, 'previous': None, 'results': results}
+
+
+def fetch_tariffs(tariffs, period_from, period_to=None, use_cache=True, session=None, workers=POOL_SIZE):
+    # Unit rates for several tariffs at once, e.g. the same product in different regions.  tariffs are anything
+    # parse_tariff() understands.  Returns {tariff code: prices_dict} in the order they were asked for.  Each
+    # tariff has its own price cache, so only the half hours we haven't seen are fetched.
+    codes = [parse_tariff(tariff) for tariff in tariffs]
+    own_session = session is None
+    if own_session:
+        session = pooled_session(max(1, min(workers, len(codes))))
+
+    def fetch_one(code):
+        product_code, tariff_code = code
+        fetch_fn = lambda start, end: fetch_unit_rates(start, end, product_code, tariff_code, session)
+        if not use_cache:
+            return fetch_fn(period_from, period_to)
+        return price_cache.get_unit_rates(tariff_code, period_from, period_to, lambda start, end: fetch_fn(start, end)['results'])
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(codes))), thread_name_prefix="octopus") as executor:
+            return {tariff_code: prices_dict for (product_code, tariff_code), prices_dict in zip(codes, executor.map(fetch_one, codes))}
+    finally:
+        if own_session:
+            session.close()
+
+
+def split_range(start_time, end_time, chunk_days=HISTORY_CHUNK_DAYS):
+    chunks = []
+    chunk_start = start_time
+    while chunk_start < end_time:
+        chunk_end = min(chunk_start + datetime.timedelta(days=chunk_days), end_time)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+    return chunks
+
+
+def fetch_history(start_time, end_time, product_code=PRODUCT_CODE, tariff_code=TARIFF_CODE, chunk_days=HISTORY_CHUNK_DAYS, workers=HISTORY_WORKERS):
+    # Splits a long range in to chunks and fetches them in parallel.  Pages are yielded as soon as their
+    # chunk arrives, so they come back in no particular order.  Sort them afterwards if you care.
+    # Each page is the undecoded bytes of the response, see history_dataframe()
+    def fetch_chunk(chunk):
+        with requests.Session() as session:
+            period_from = chunk[0].strftime("%Y-%m-%dT%H:%M:%SZ")
+            period_to = chunk[1].strftime("%Y-%m-%dT%H:%M:%SZ")
+            return list(iter_unit_rate_pages(period_from, period_to, product_code, tariff_code, session, raw=True))
+
+    chunks = split_range(start_time, end_time, chunk_days)
+    print(f"Fetching {len(chunks)} chunks of up to {chunk_days} days with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch_chunk, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            for page in future.result():
+                yield page
+
+
+def history_dataframe(pages):
+    # Builds the same frame as Prices.build_dataframe, but from a stream of pages so that we never
+    # hold the decoded JSON for a whole year at once.  A page is either the bytes of a response or its
+    # decoded "results" list.  Pages can overlap and come in any order.
+    parts = []
+    for page in pages:
+        parts.append(price_parser.parse_content(page)[0] if isinstance(page, bytes) else price_parser.parse_results(page))
+    return price_parser.to_frame(price_parser.concat(parts))
+
+
+def parse_args():
+    parser = ArgumentParser(description="Pull a range of historical Agile prices from Octopus.")
+    parser.add_argument("-f", "--from", dest="start_time", help="Start of the range. YYYY-MM-DD", required=True, type=datetime.datetime.fromisoformat)
+    parser.add_argument("-t", "--to", dest="end_time", help="End of the range. YYYY-MM-DD  Default is now", type=datetime.datetime.fromisoformat)
+    parser.add_argument("-o", "--output", dest="output", help="Write the prices to this CSV file", default=None)
+    parser.add_argument("-w", "--workers", dest="workers", help=f"Number of parallel requests. Default is {HISTORY_WORKERS}", default=HISTORY_WORKERS, type=int)
+    parser.add_argument("--tariff", dest="tariff_code", help=f"Tariff code. Default is {TARIFF_CODE}", default=TARIFF_CODE)
+    parser.add_argument("--product", dest="product_code", help=f"Product code. Default is {PRODUCT_CODE}", default=PRODUCT_CODE)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    end_time = args.end_time if args.end_time is not None else datetime.datetime.utcnow()
+    prices = history_dataframe(fetch_history(args.start_time, end_time, args.product_code, args.tariff_code, workers=args.workers))
+    print(f"Fetched {len(prices)} slots from {prices.start_time.min()} to {prices.start_time.max()}")
+    if args.output:
+        prices.to_csv(args.output, index=False)
+        print(f"Written to {args.output}")
+    else:
+        print(prices.to_string())
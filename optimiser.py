@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# Picking charge slots when the inverter only has a handful of programmable time slots.
+# Sorting by price and taking the cheapest N half hours is only optimal if they happen to bunch together.
+# When they don't, merge_slots() ends up with more runs than the inverter can hold and set_charging() drops
+# the rest, so the battery doesn't get charged.  This finds the cheapest set of half hours that fits in at most
+# max_runs contiguous runs using a dynamic program over the half hour grid.
+#
+# The state after looking at slot i is (slots chosen so far, runs used so far, is slot i chosen?).
+# Each step is three array operations over (slots, runs) so a day takes a fraction of a millisecond,
+# and a longer horizon just means more steps.
+
+import math
+
+import numpy as np
+
+SLOT_HOURS = 0.5
+INF = np.inf
+
+
+def optimise_runs(values, slots_needed, max_runs, contiguous=None):
+    # values: price of each half hour, in time order.
+    # contiguous[i] is False if slot i doesn't follow straight on from slot i-1 (a gap in the prices), in which
+    # case a run can't carry on across it.  Defaults to all contiguous.
+    # Returns the indexes of the chosen slots, or None if it can't be done (not enough slots).
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if slots_needed <= 0:
+        return np.array([], dtype=int)
+    if slots_needed > n or max_runs < 1:
+        return None
+    if contiguous is None:
+        contiguous = np.ones(n, dtype=bool)
+    m, k = slots_needed, max_runs
+    # off[i] is the best cost after the first i slots with slot i-1 not chosen, on[i] with it chosen.
+    # Indexed [slots chosen, runs used].  Every step is written straight in to these so that the loop is
+    # only three array operations, and we walk back through them afterwards to find out what was chosen.
+    off = np.full((n + 1, m + 1, k + 1), INF)
+    on = np.full((n + 1, m + 1, k + 1), INF)
+    off[0, 0, 0] = 0.0
+    for i in range(1, n + 1):
+        np.minimum(off[i - 1], on[i - 1], out=off[i])
+        if contiguous[i - 1]:
+            np.minimum(on[i - 1, :-1, 1:], off[i, :-1, :-1], out=on[i, 1:, 1:])
+            on[i, 1:, 1:] += values[i - 1]
+        else:
+            np.add(off[i, :-1, :-1], values[i - 1], out=on[i, 1:, 1:])
+    final = np.minimum(off[n, m], on[n, m])
+    runs = int(np.argmin(final))
+    if final[runs] == INF:
+        return None
+    chosen = []
+    i, j = n, m
+    state_on = on[n, m, runs] < off[n, m, runs]
+    while i > 0:
+        if state_on:
+            chosen.append(i - 1)
+            carry_on = on[i - 1, j - 1, runs] if contiguous[i - 1] else INF
+            if carry_on <= off[i, j - 1, runs - 1]:
+                i, j = i - 1, j - 1
+                continue
+            j, runs = j - 1, runs - 1
+        # off[i] is the better of off[i-1] and on[i-1]
+        state_on = on[i - 1, j, runs] < off[i - 1, j, runs]
+        i -= 1
+    return np.array(chosen[::-1], dtype=int)
+
+
+def slots_for_energy(energy_kwh, charge_rate_kw):
+    # Number of half hours needed to put energy_kwh in to the battery at charge_rate_kw
+    if energy_kwh <= 0:
+        return 0
+    return math.ceil(round(energy_kwh / (charge_rate_kw * SLOT_HOURS), 6))
+
+
+def cheapest_charge_slots(prices, energy_kwh, charge_rate_kw, max_runs, start_time=None, deadline=None, price_column='value_inc_vat', slots_needed=None):
+    # prices is a frame of half hour slots with start_time, end_time and a price column.
+    # Returns the rows of the cheapest slots between start_time and deadline that will add energy_kwh (or
+    # exactly slots_needed slots, if given), merged in to at most max_runs runs.  Sorted by start_time.
+    # If there aren't enough slots in the window you get all of them.
+    slots = prices.sort_values(by="start_time")
+    if start_time is not None:
+        slots = slots[slots.start_time >= start_time]
+    if deadline is not None:
+        slots = slots[slots.end_time <= deadline]
+    if slots_needed is None:
+        slots_needed = slots_for_energy(energy_kwh, charge_rate_kw)
+    if slots_needed >= len(slots):
+        print(f"Need {slots_needed} slots but there are only {len(slots)} available")
+        return slots
+    starts = slots.start_time.values.view('i8')
+    ends = slots.end_time.values.view('i8')
+    contiguous = np.ones(len(slots), dtype=bool)
+    contiguous[1:] = starts[1:] == ends[:-1]
+    chosen = optimise_runs(slots[price_column].to_numpy(dtype=float), slots_needed, max_runs, contiguous)
+    if chosen is None:
+        print(f"Can't fit {slots_needed} slots in to {max_runs} runs")
+        return slots.head(0)
+    return slots.iloc[chosen]
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+# Remembers charge plans so that re-running the planner every half hour with nothing new to go on doesn't work the
+# whole thing out again, and doesn't touch the inverter when the plan it would program is already on it.
+#
+# A plan is looked up by two things:
+#   The prices.  Published prices never change, so between one run and the next the only difference is that the
+#   half hours which have been and gone drop off the front.  Each slot's hash covers it and every slot after it (a
+#   hash chain built from the end), so a later run's prices are found among the hashes of an earlier run's as long
+#   as nothing new has been published.
+#   Everything else the plan depends on: the half hour it was made in, the SOC (in SOC_BUCKET % steps), the forecasts
+#   (in KWH_BUCKET steps) and the configuration, hashed together by inputs_key().  The plan's slots are absolute
+#   times worked out from now, and the ones that have gone by would fire again at the same time tomorrow, so a plan
+#   is only ever reused in the half hour it was made in.  A later run plans again, and if it comes up with the same
+#   plan the inverter is still left alone.
+#
+# The plan that was last programmed is kept in its own file along with the inverter it went to.  Anything else that
+# agile_prices programs with the cache handed in (see agile_prices.program_all(), main() and scheduler_daemon.py)
+# forgets it, so that we never skip writing a plan that isn't there.  Backtests don't hand it in, their inverter is
+# a fake.  new_prices_thing_2.py forgets it too when it writes.  control_inverter.py only ever sets the clock, which
+# isn't part of a plan.  Anything else that writes charge slots or the max SOC isn't covered: run
+# plan_cache.py --clear afterwards.
+#
+# Usage:
+#   plan_cache.py                       Print the cached plans and which one is programmed
+#   plan_cache.py --clear               Forget them all
+
+import os
+import json
+import time
+import hashlib
+from argparse import ArgumentParser
+
+from json_file import read_json, write_json
+
+PLAN_CACHE_PATH = os.path.expanduser("~/.cache/octopus_agile/plans.json")
+PROGRAMMED_PATH = os.path.expanduser("~/.cache/octopus_agile/programmed.json")
+MAX_PLANS = 96 # Two days of half hourly runs
+SOC_BUCKET = 5 # %
+KWH_BUCKET = 0.5
+
+plan_cache = None # Use get_plan_cache()
+
+
+def bucket(value, size):
+    if value is None or value is False:
+        return None
+    return round(round(float(value) / size) * size, 6)
+
+
+def series_hashes(starts, values):
+    # One hex digest per slot, covering that slot and all the ones after it.  starts is int64 nanoseconds, values
+    # float64, e.g. Prices.prices.start_time.values.view('i8') and value_inc_vat.to_numpy(dtype=float).
+    hashes = [None] * len(starts)
+    digest = b""
+    for i in range(len(starts) - 1, -1, -1):
+        digest = hashlib.sha256(starts[i].tobytes() + values[i].tobytes() + digest).digest()
+        hashes[i] = digest.hex()
+    return hashes
+
+
+def half_hour(now):
+    # The half hour now is in, for inputs_key().  now is a timezone aware datetime.
+    return now.replace(minute=now.minute - now.minute % 30, second=0, microsecond=0).isoformat()
+
+
+def inputs_key(**inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def plan_id(plan):
+    return hashlib.sha256(json.dumps(plan, sort_keys=True).encode()).hexdigest()
+
+
+class PlanCache:
+    def __init__(self, path=PLAN_CACHE_PATH, programmed_path=PROGRAMMED_PATH, max_plans=MAX_PLANS, clock=time.time):
+        self.path = path
+        self.programmed_path = programmed_path
+        self.max_plans = max_plans
+        self.clock = clock
+        self.plans = read_json(path, [])
+
+    def get(self, prices_hash, key):
+        # The plan made from these inputs and prices (or prices that these are the tail end of), or None
+        for entry in reversed(self.plans):
+            if entry['key'] == key and prices_hash in entry['prices']:
+                return entry['plan']
+        return None
+
+    def put(self, hashes, key, plan):
+        # hashes is series_hashes() of the prices the plan was made from.  Oldest plans go first.
+        self.plans = [entry for entry in self.plans if not (entry['key'] == key and hashes and hashes[0] in entry['prices'])]
+        self.plans.append({'key': key, 'prices': hashes, 'plan': plan, 'when': self.clock()})
+        self.plans = self.plans[-self.max_plans:]
+        write_json(self.path, self.plans)
+
+    def programmed(self):
+        return read_json(self.programmed_path, None)
+
+    def is_programmed(self, plan, inverter):
+        programmed = self.programmed()
+        return programmed is not None and programmed['plan'] == plan_id(plan) and programmed['inverter'] == inverter
+
+    def mark_programmed(self, plan, inverter):
+        write_json(self.programmed_path, {'plan': plan_id(plan), 'inverter': inverter, 'when': self.clock()})
+
+    def forget_programmed(self):
+        # Something other than a cached plan has been written to the inverter
+        if os.path.exists(self.programmed_path):
+            os.remove(self.programmed_path)
+
+    def clear(self):
+        self.plans = []
+        for path in (self.path, self.programmed_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def get_plan_cache():
+    global plan_cache
+    if plan_cache is None:
+        plan_cache = PlanCache()
+    return plan_cache
+
+
+def parse_args():
+    parser = ArgumentParser(description="Show or clear the cached charge plans.")
+    parser.add_argument("--clear", dest="clear", help="Forget every cached plan and which one is programmed", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    cache = get_plan_cache()
+    if args.clear:
+        cache.clear()
+        print("Cleared")
+    else:
+        programmed = cache.programmed()
+        for entry in cache.plans:
+            mark = " (programmed)" if programmed is not None and programmed['plan'] == plan_id(entry['plan']) else ""
+            slots = ", ".join(f"{start[11:16]}-{end[11:16]}" for start, end in entry['plan']['slots'] or []) or "none"
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['when']))}  max SOC {entry['plan']['max_soc']}%  slots {slots}{mark}")
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# A local store of Agile unit rates.
+# Once Octopus has published the price for a half hour it never changes, so there is no point asking
+# for it again.  Prices are kept in one JSON file per tariff code, keyed by valid_from, and we only go
+# to the API for the half hours we don't already have.
+
+import os
+import datetime
+
+from json_file import read_json, write_json
+
+CACHE_DIR = os.path.expanduser("~/.cache/octopus_agile")
+SLOT_LENGTH = datetime.timedelta(minutes=30)
+PUBLISH_HOUR = 16 # Octopus publish tomorrow's prices from about 16:00 UK time
+
+
+def parse_time(t):
+    # Accepts the strings Octopus hands back ("2023-03-28T23:30:00Z"), the ones we build ourselves
+    # ("...+00:00") or a datetime.  Naive datetimes are assumed to be UTC, like everything else here.
+    if isinstance(t, str):
+        t = datetime.datetime.fromisoformat(t.replace("Z", "+00:00"))
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=datetime.timezone.utc)
+    return t.astimezone(datetime.timezone.utc)
+
+
+def format_time(t):
+    return t.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def floor_to_slot(t):
+    return t.replace(minute=(t.minute // 30) * 30, second=0, microsecond=0)
+
+
+def prices_expected_until(now):
+    # Agile days run 23:00 to 23:00 UK time.  Before PUBLISH_HOUR we should have prices until 23:00 tonight, after
+    # it until 23:00 tomorrow.
+    import pytz
+    local_tz = pytz.timezone("Europe/London")
+    local = now.astimezone(local_tz)
+    day = local.date()
+    if local.hour >= PUBLISH_HOUR:
+        day += datetime.timedelta(days=1)
+    return local_tz.localize(datetime.datetime(day.year, day.month, day.day, 23)).astimezone(datetime.timezone.utc)
+
+
+class PriceCache:
+    def __init__(self, tariff_code, cache_dir=CACHE_DIR):
+        self.tariff_code = tariff_code
+        self.path = os.path.join(cache_dir, f"{tariff_code}.json")
+        self.slots = {}
+        self.load()
+
+    def load(self):
+        self.slots = read_json(self.path, {})
+
+    def save(self):
+        write_json(self.path, self.slots)
+
+    def add(self, results):
+        # results is the list of dicts from the "results" key of the Octopus response
+        added = 0
+        for each in results:
+            key = format_time(parse_time(each['valid_from']))
+            if key not in self.slots:
+                added += 1
+            self.slots[key] = each
+        return added
+
+    def slot_times(self, start_time, end_time):
+        t = floor_to_slot(parse_time(start_time))
+        end_time = parse_time(end_time)
+        while t < end_time:
+            yield t
+            t += SLOT_LENGTH
+
+    def missing_ranges(self, start_time, end_time=None, now=None):
+        # Returns a list of (period_from, period_to) tuples covering the half hours we don't have.
+        # With no end time we ask for everything Octopus has published after the last contiguous cached slot
+        # (period_to=None), unless the cache already goes as far as anything could have been published by now.
+        missing = []
+        if end_time is None:
+            t = floor_to_slot(parse_time(start_time))
+            while format_time(t) in self.slots:
+                t += SLOT_LENGTH
+            now = datetime.datetime.now(datetime.timezone.utc) if now is None else parse_time(now)
+            if t < prices_expected_until(now):
+                missing.append((t, None))
+            return missing
+        gap_start = None
+        for t in self.slot_times(start_time, end_time):
+            if format_time(t) in self.slots:
+                if gap_start is not None:
+                    missing.append((gap_start, t))
+                    gap_start = None
+            elif gap_start is None:
+                gap_start = t
+        if gap_start is not None:
+            missing.append((gap_start, parse_time(end_time)))
+        return missing
+
+    def get_results(self, start_time, end_time=None):
+        # Same shape and ordering as the API: newest slot first.
+        start_time = floor_to_slot(parse_time(start_time))
+        results = []
+        for key, value in self.slots.items():
+            t = parse_time(key)
+            if t < start_time:
+                continue
+            if end_time is not None and t >= parse_time(end_time):
+                continue
+            results.append((t, value))
+        results.sort(key=lambda x: x[0], reverse=True)
+        return [value for t, value in results]
+
+
+def get_unit_rates(tariff_code, start_time, end_time, fetch_fn, cache=None, now=None):
+    # fetch_fn(period_from, period_to) should return the list of results from Octopus for that period.
+    # period_to may be None, meaning "everything that has been published".
+    # Returns a dict shaped like the Octopus response so that the existing dataframe code doesn't care
+    # whether it came from the cache or not.
+    if cache is None:
+        cache = PriceCache(tariff_code)
+    missing = cache.missing_ranges(start_time, end_time, now)
+    added = 0
+    for period_from, period_to in missing:
+        if period_to is not None:
+            period_to = format_time(period_to)
+        print(f"Fetching prices from Octopus for {format_time(period_from)} to {period_to}")
+        added += cache.add(fetch_fn(format_time(period_from), period_to))
+    if added:
+        cache.save()
+    results = cache.get_results(start_time, end_time)
+    print(f"Prices: {len(results)} slots, {added} new from Octopus")
+    return {'count': len(results), 'next': None, 'previous': None, 'results': results}
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Turns Octopus unit rates in to columns: int64 nanosecond start and end times and float64 prices, sorted, with
+# duplicates dropped.  Building the frame with pd.DatetimeIndex(x['valid_from'] for x in results) parses every
+# timestamp on its own, which is most of the time spent on a year of history.  Octopus timestamps are all the same
+# width ("2023-03-28T23:30:00Z"), so instead they're joined in to one buffer and the digits are picked out of it with
+# NumPy.  Anything that doesn't look like that goes through pandas instead.
+#
+# Raw response bytes can be parsed without decoding the JSON at all, see parse_content().
+#
+# Every slot must be 30 minutes long.  Missing half hours are allowed but reported (gaps), as are the UK days that
+# are 23 or 25 hours long because the clocks change (dst_days), since those don't have 48 slots.
+#
+# Usage:
+#   price_parser.py prices.json         Parse a saved Octopus response and say what's in it
+
+import re
+import json
+import datetime
+from collections import namedtuple
+from argparse import ArgumentParser
+
+import numpy as np
+
+SLOT_NS = 30 * 60 * 10**9
+LOCAL_TZ = "Europe/London"
+STAMP = b"0000-00-00T00:00:00Z"
+SEPARATORS = [i for i, c in enumerate(STAMP) if c != ord("0")]
+
+# start and end are int64 nanoseconds since the epoch, UTC.  gaps is the index of each slot that doesn't start where
+# the one before it ended.  dst_days are the local dates in range that aren't 48 slots long.
+UnitRates = namedtuple('UnitRates', ['start', 'end', 'value', 'gaps', 'dst_days'])
+
+VALUE_RE = re.compile(rb'"value_inc_vat"\s*:\s*(-?[0-9.eE+-]+)')
+VALID_FROM_RE = re.compile(rb'"valid_from"\s*:\s*"([^"]*)"')
+VALID_TO_RE = re.compile(rb'"valid_to"\s*:\s*(?:"([^"]*)"|null)')
+NEXT_RE = re.compile(rb'"next"\s*:\s*("(?:[^"\\]|\\.)*"|null)')
+
+
+def parse_timestamps(stamps):
+    # stamps is a list of str or bytes.  Returns int64 nanoseconds.
+    n = len(stamps)
+    joined = b"".join(stamps) if n and isinstance(stamps[0], bytes) else "".join(stamps).encode("ascii", "replace")
+    if len(joined) == n * len(STAMP):
+        chars = np.frombuffer(joined, dtype=np.uint8).reshape(n, len(STAMP))
+        if (chars[:, SEPARATORS] == np.frombuffer(STAMP, dtype=np.uint8)[SEPARATORS]).all():
+            digits = chars.astype(np.int64) - ord("0")
+            number = lambda first, last: digits[:, first:last] @ (10 ** np.arange(last - first - 1, -1, -1))
+            days = ((number(0, 4) - 1970).astype('M8[Y]').astype('M8[M]') + (number(5, 7) - 1).astype('m8[M]')).astype('M8[D]')
+            days = days + (number(8, 10) - 1).astype('m8[D]')
+            seconds = (number(11, 13) * 60 + number(14, 16)) * 60 + number(17, 19)
+            return days.astype('M8[ns]').view(np.int64) + seconds * 10**9
+    import pandas as pd
+    return pd.to_datetime([s.decode() if isinstance(s, bytes) else s for s in stamps], utc=True).asi8
+
+
+def dst_days(start):
+    # Local dates in start on which the clocks change, so they're 46 or 50 half hours long rather than 48
+    import pandas as pd
+    if len(start) < 2:
+        return []
+    local = pd.DatetimeIndex(start.view('M8[ns]'), tz='UTC').tz_convert(LOCAL_TZ)
+    offset = local.tz_localize(None).asi8 - start
+    changes = np.flatnonzero(np.diff(offset)) + 1
+    return list(local[changes].date)
+
+
+def columns(start, end, value):
+    # Sort, drop repeated start times (keeping the first) and check the slots
+    order = np.argsort(start, kind='stable')
+    start, end, value = start[order], end[order], value[order]
+    if len(start):
+        keep = np.concatenate(([True], np.diff(start) != 0))
+        if not keep.all():
+            start, end, value = start[keep], end[keep], value[keep]
+    wrong = np.flatnonzero(end - start != SLOT_NS)
+    if len(wrong):
+        raise ValueError(f"{len(wrong)} slots aren't 30 minutes long, the first starts at {start[wrong[0]].astype('M8[ns]')}")
+    gaps = np.flatnonzero(start[1:] != end[:-1]) + 1
+    return UnitRates(start, end, value, gaps, dst_days(start))
+
+
+def parse_results(results):
+    # From the decoded "results" list, in one pass over it
+    n = len(results)
+    value = np.empty(n)
+    valid_from = [None] * n
+    valid_to = [None] * n
+    for i, x in enumerate(results):
+        value[i] = x['value_inc_vat']
+        valid_from[i] = x['valid_from']
+        valid_to[i] = x['valid_to'] or ""
+    return columns(parse_timestamps(valid_from), parse_timestamps(valid_to), value)
+
+
+def next_url(content):
+    # The "next" link from the bytes of a response, or None on the last page
+    found = NEXT_RE.search(content)
+    return json.loads(found.group(1)) if found else None
+
+
+def parse_content(content):
+    # From the bytes of a response, without decoding the JSON.  Returns (UnitRates, next URL or None).
+    valid_from = VALID_FROM_RE.findall(content)
+    valid_to = VALID_TO_RE.findall(content)
+    value = VALUE_RE.findall(content)
+    if not len(valid_from) == len(valid_to) == len(value):
+        raise ValueError(f"Expected the same number of valid_from, valid_to and value_inc_vat, not {len(valid_from)}, {len(valid_to)} and {len(value)}")
+    value = np.fromiter(map(float, value), dtype=np.float64, count=len(value))
+    return columns(parse_timestamps(valid_from), parse_timestamps(valid_to), value), next_url(content)
+
+
+def concat(parts):
+    # One UnitRates from several, e.g. pages of history that arrived in any order
+    if not parts:
+        return columns(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+    return columns(np.concatenate([p.start for p in parts]), np.concatenate([p.end for p in parts]), np.concatenate([p.value for p in parts]))
+
+
+def to_frame(rates, value_column='value_inc_vat', scale=None):
+    # The frame the rest of the code expects: start_time, end_time, value_inc_vat and duration.  The time columns
+    # are views of the arrays rather than copies.
+    import pandas as pd
+    utc = pd.DatetimeTZDtype(tz='UTC')
+    start = pd.arrays.DatetimeArray(rates.start.view('M8[ns]'), dtype=utc, copy=False)
+    end = pd.arrays.DatetimeArray(rates.end.view('M8[ns]'), dtype=utc, copy=False)
+    value = rates.value if scale is None else rates.value * scale
+    duration = pd.arrays.TimedeltaArray((rates.end - rates.start).view('m8[ns]'), copy=False)
+    return pd.DataFrame({'start_time': start, 'end_time': end, value_column: value, 'duration': duration}, copy=False)
+
+
+def describe(rates):
+    if len(rates.start) == 0:
+        return "No prices"
+    first = datetime.datetime.utcfromtimestamp(rates.start[0] // 10**9)
+    last = datetime.datetime.utcfromtimestamp(rates.end[-1] // 10**9)
+    text = f"{len(rates.start)} slots from {first:%Y-%m-%d %H:%M} to {last:%Y-%m-%d %H:%M} UTC"
+    if len(rates.gaps):
+        text += f", {len(rates.gaps)} gaps"
+    if rates.dst_days:
+        text += ", clocks change on " + ", ".join(f"{day}" for day in rates.dst_days)
+    return text
+
+
+def parse_args():
+    parser = ArgumentParser(description="Parse a saved Octopus unit rates response.")
+    parser.add_argument("path", help="JSON file, as returned by the standard-unit-rates endpoint")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with open(args.path, "rb") as fp:
+        rates, more = parse_content(fp.read())
+    print(describe(rates))
+    if more:
+        print(f"More at {more}")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# Prices as two NumPy arrays rather than a DataFrame: the half hour each price is for (half hours since the epoch)
+# and the price in fixed point (SCALE ths of a penny, the same units as new_prices_thing's cost column).  Everything
+# the planners do with prices is "these slots, cheapest first" or "the slots under some price", which is a mask and
+# an index array here rather than a sort and a drop on a copy of the whole frame.  The price order is only worked
+# out once, however many times it's asked for, and when only the n cheapest are wanted they're partitioned off
+# without sorting the rest.
+#
+# Frames are only built at the end, for display or for the code that wants one (merge_slots(), set_charging()).
+
+import numpy as np
+
+SLOT_SECONDS = 30 * 60
+SLOT_NS = SLOT_SECONDS * 10**9
+SCALE = 10000 # Fixed point prices are in 1/SCALE ths of a penny
+
+
+class PriceSeries:
+    __slots__ = ('slot', 'price', '_by_price')
+
+    def __init__(self, slot, price):
+        # slot is int64 half hours since the epoch, sorted.  price is int64 fixed point.
+        self.slot = np.asarray(slot, dtype=np.int64)
+        self.price = np.asarray(price, dtype=np.int64)
+        self._by_price = None
+
+    @classmethod
+    def from_rates(cls, rates):
+        # From price_parser.UnitRates, which are already sorted
+        return cls(rates.start // SLOT_NS, np.round(rates.value * SCALE))
+
+    def __len__(self):
+        return len(self.slot)
+
+    def __repr__(self):
+        return f"PriceSeries({len(self)} slots)"
+
+    @property
+    def by_price(self):
+        # Every slot, cheapest first.  Ties stay in time order.
+        if self._by_price is None:
+            self._by_price = np.argsort(self.price, kind='stable')
+        return self._by_price
+
+    def cheapest(self, n, mask=None):
+        # Index of the n cheapest slots (of those in mask), cheapest first, ties in time order like by_price.  If the
+        # full order hasn't been needed yet it's cheaper to partition off the n we want and only sort those.
+        if self._by_price is not None:
+            order = self.by_price if mask is None else self.by_price[mask[self.by_price]]
+            return order[:max(n, 0)]
+        candidates = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        n = max(0, min(n, len(candidates)))
+        if n < len(candidates):
+            # Everything cheaper than the nth price, then the earliest of the ones that cost exactly that
+            price = self.price[candidates]
+            nth = np.partition(price, n - 1)[n - 1] if n else np.iinfo(np.int64).min
+            below = candidates[price < nth]
+            candidates = np.concatenate((below, candidates[price == nth][:n - len(below)]))
+        return candidates[np.lexsort((candidates, self.price[candidates]))]
+
+    def sorted_by_price(self, mask):
+        # Index of the slots in mask, cheapest first
+        order = self.by_price
+        return order[mask[order]]
+
+    def at_most(self, pence):
+        # Mask of the slots costing no more than pence (a plain price, not fixed point).  Rounded the same way as the
+        # prices were, or 0.57 * SCALE comes out at 5699.999... and a 0.57p slot isn't at most 0.57p.
+        return self.price <= round(pence * SCALE)
+
+    def between(self, start_time=None, end_time=None):
+        # Mask of the slots starting at or after start_time and at or before end_time (datetimes, UTC if naive)
+        mask = np.ones(len(self), dtype=bool)
+        if start_time is not None:
+            mask &= self.slot * SLOT_SECONDS >= to_seconds(start_time)
+        if end_time is not None:
+            mask &= self.slot * SLOT_SECONDS <= to_seconds(end_time)
+        return mask
+
+    def pence(self, index=None):
+        price = self.price if index is None else self.price[index]
+        return price / SCALE
+
+    def frame(self, index=None, value_column='value_inc_vat', fixed_point=False):
+        # A frame like Prices.prices for the slots in index (every slot by default), in that order and labelled with
+        # their positions in the series.  fixed_point leaves the prices as integers, like new_prices_thing's cost.
+        import pandas as pd
+        if index is None:
+            index = np.arange(len(self))
+        index = np.asarray(index, dtype=np.int64)
+        start = pd.arrays.DatetimeArray((self.slot[index] * SLOT_NS).view('M8[ns]'), dtype=pd.DatetimeTZDtype(tz='UTC'))
+        end = start + pd.Timedelta(seconds=SLOT_SECONDS)
+        value = self.price[index] if fixed_point else self.pence(index)
+        return pd.DataFrame({'start_time': start, 'end_time': end, value_column: value,
+                             'duration': pd.Timedelta(seconds=SLOT_SECONDS)}, index=index)
+
+
+def to_seconds(t):
+    import datetime
+    if hasattr(t, 'tzinfo') and t.tzinfo is None:
+        t = t.replace(tzinfo=datetime.timezone.utc)
+    return t.timestamp()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# Prices for several regions (or tariffs) at once.  Rather than a Prices frame per region, every region's prices go
+# in one regions x half hours array on a shared half hourly grid, with NaN where a region has no price.  The cheapest
+# windows and charge slots for all of them then come out of a handful of NumPy operations along the rows, so twelve
+# regions cost about the same as one.
+#
+# Usage:
+#   regions.py -r A B N                 Cheapest 2 and 4 hour windows, and where to charge 8kWh, in regions A, B and N
+#   regions.py -r A B -d 180 -k 5       ... a 3 hour window and 5kWh instead
+
+import math
+import datetime
+from collections import namedtuple
+from argparse import ArgumentParser
+
+import numpy as np
+
+SLOT_NS = 30 * 60 * 10**9
+CHARGE_RATE = 2.7 # kW, same as agile_prices.max_ac_charge_rate
+
+# starts is int64 nanoseconds since the epoch, one per column of values (regions x half hours, p/kWh).
+# tariffs is the tariff code for each row.
+PriceGrid = namedtuple('PriceGrid', ['tariffs', 'starts', 'values'])
+# One entry per region.  start is the index of the window's first half hour, -1 if no window fits.
+Windows = namedtuple('Windows', ['start', 'mean'])
+# chosen is regions x half hours, True for the half hours to charge in.  mean is the average price of those.
+ChargePlan = namedtuple('ChargePlan', ['chosen', 'slots', 'mean'])
+
+
+def parse_starts(results):
+    import pandas as pd
+    return pd.to_datetime([x['valid_from'] for x in results], utc=True).asi8
+
+
+def stack(prices_dicts):
+    # {tariff code: prices_dict} (see octopus_api.fetch_tariffs()) to a PriceGrid covering every half hour any of
+    # them has a price for
+    tariffs = list(prices_dicts)
+    starts = [parse_starts(prices_dicts[tariff]['results']) for tariff in tariffs]
+    if not any(len(each) for each in starts):
+        return PriceGrid(tariffs, np.zeros(0, dtype=np.int64), np.zeros((len(tariffs), 0)))
+    first = min(each.min() for each in starts if len(each))
+    last = max(each.max() for each in starts if len(each))
+    grid = first + SLOT_NS * np.arange((last - first) // SLOT_NS + 1, dtype=np.int64)
+    values = np.full((len(tariffs), len(grid)), np.nan)
+    for row, (tariff, each) in enumerate(zip(tariffs, starts)):
+        values[row, (each - first) // SLOT_NS] = [x['value_inc_vat'] for x in prices_dicts[tariff]['results']]
+    return PriceGrid(tariffs, grid, values)
+
+
+def window_means(values, slots_per_window):
+    # regions x (half hours - slots_per_window + 1) mean price of every window, from prefix sums along each row.
+    # Windows with a missing price in them are inf so they're never the cheapest.
+    regions, n = values.shape
+    if slots_per_window < 1 or n < slots_per_window:
+        return np.zeros((regions, 0))
+    missing = np.isnan(values)
+    zeros = np.zeros((regions, 1))
+    prefix = np.concatenate((zeros, np.cumsum(np.where(missing, 0, values), axis=1)), axis=1)
+    gaps = np.concatenate((zeros, np.cumsum(missing, axis=1)), axis=1)
+    means = np.round((prefix[:, slots_per_window:] - prefix[:, :-slots_per_window]) / slots_per_window, 9)
+    means[gaps[:, slots_per_window:] - gaps[:, :-slots_per_window] > 0] = np.inf
+    return means
+
+
+def cheapest_windows(values, slots_per_window):
+    # The cheapest window of slots_per_window contiguous half hours in each region.  Ties go to the earliest.
+    means = window_means(values, slots_per_window)
+    if means.shape[1] == 0:
+        return Windows(np.full(len(values), -1), np.full(len(values), np.nan))
+    start = np.argmin(means, axis=1)
+    mean = means[np.arange(len(values)), start]
+    found = np.isfinite(mean)
+    return Windows(np.where(found, start, -1), np.where(found, mean, np.nan))
+
+
+def charge_plans(values, kwh, charge_rate=CHARGE_RATE):
+    # The cheapest half hours to put kwh in to each battery, whenever they are.  kwh can be one figure for every
+    # region or one each.  Every region is ranked at once: a stable sort of each row, missing prices last.
+    regions, n = values.shape
+    slots = np.ceil(np.broadcast_to(np.asarray(kwh, dtype=np.float64), (regions,)) / (charge_rate / 2) - 1e-9)
+    slots = np.minimum(np.maximum(slots, 0).astype(int), np.isfinite(values).sum(axis=1))
+    rank = np.empty((regions, n), dtype=int)
+    order = np.argsort(np.where(np.isnan(values), np.inf, values), axis=1, kind='stable')
+    np.put_along_axis(rank, order, np.arange(n)[None, :], axis=1)
+    chosen = rank < slots[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(chosen, values, 0).sum(axis=1) / slots
+    return ChargePlan(chosen, slots, mean)
+
+
+def slot_time(starts, index):
+    return datetime.datetime.fromtimestamp(int(starts[index]) // 10**9, datetime.timezone.utc)
+
+
+def parse_args():
+    parser = ArgumentParser(description="Compare the cheapest charging windows across several regions.")
+    parser.add_argument("-r", "--regions", dest="tariffs", help="Region letters or tariff codes. Default is every region", nargs="+", default=None)
+    parser.add_argument("-d", "--duration", dest="duration", help="Also find the cheapest window this many minutes long, a multiple of 30", default=None, type=int)
+    parser.add_argument("-k", "--kwh", dest="kwh", help="kWh to charge. Default is 8", default=8, type=float)
+    parser.add_argument("--no-cache", dest="no_cache", help="Ignore the local price caches and fetch everything from Octopus", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import octopus_api
+    args = parse_args()
+    tariffs = args.tariffs or list(octopus_api.REGIONS)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    grid = stack(octopus_api.fetch_tariffs(tariffs, now.strftime("%Y-%m-%dT%H:%M:%SZ"), use_cache=not args.no_cache))
+    minutes = [120, 240] + ([args.duration] if args.duration else [])
+    windows = {m: cheapest_windows(grid.values, math.ceil(m / 30)) for m in minutes}
+    plans = charge_plans(grid.values, args.kwh)
+    for row, tariff in enumerate(grid.tariffs):
+        print(tariff)
+        for m, found in windows.items():
+            if found.start[row] < 0:
+                print(f"  {m} minutes: no window")
+            else:
+                print(f"  {m} minutes: {found.mean[row]:.2f}p/kWh from {slot_time(grid.starts, found.start[row]):%a %H:%M}")
+        chosen = ", ".join(f"{slot_time(grid.starts, i):%H:%M}" for i in np.flatnonzero(plans.chosen[row]))
+        print(f"  {args.kwh}kWh: {plans.mean[row]:.2f}p/kWh in {chosen or 'no slots'}")
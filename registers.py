@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# The Growatt SPH registers we care about, and a planner that reads them in as few Modbus requests as possible.
+# Every request over the RS485 bridge costs tens of milliseconds whether it's for 1 register or 100, so rather
+# than asking for each register on its own we work out which blocks cover everything a command needs.
+# A single read can be at most 125 registers (a Modbus limit).  The inverter's register banks are 1000 apart
+# (0-124, 1000-1124) so a block that fits inside that limit can never straddle two banks.
+
+import datetime
+from collections import namedtuple
+
+HOLDING = "holding"
+INPUT = "input"
+MAX_BLOCK = 125
+
+Register = namedtuple('Register', ['table', 'address', 'count', 'decode'])
+
+
+def decode_raw(values):
+    return values[0] if len(values) == 1 else list(values)
+
+def decode_u32(values):
+    # 32 bit counters are split over two registers, high word first
+    return values[0] << 16 | values[1]
+
+def split_time(word):
+    # Slot times are encoded as hours in the high byte, minutes in the low byte
+    return word >> 8, word & 255
+
+def decode_time(word):
+    return datetime.time(*split_time(word))
+
+def decode_slots(values):
+    # Three registers per slot: start, end, enabled
+    return [[decode_time(values[i]), decode_time(values[i+1]), values[i+2]] for i in range(0, len(values), 3)]
+
+def decode_clock(values):
+    year, month, day, hour, minute, second = values[:6]
+    if year < 2000:
+        year += 2000 # We write year - 2000 to the inverter
+    return datetime.datetime(year, month, day, hour, minute, second)
+
+
+REGISTERS = {
+    # Holding registers
+    'inverter_time':      Register(HOLDING, 45, 7, decode_clock),   # Y M D h m s day-of-week.  Kept in UTC.
+    'charge_slots_1_3':   Register(HOLDING, 1100, 9, decode_slots), # Battery first slots 1-3
+    'charge_slots_4_6':   Register(HOLDING, 1018, 9, decode_slots), # Slots 4-6.  The docs say 1017 but it's 1018.
+    'discharge_power':    Register(HOLDING, 1070, 1, decode_raw),
+    'discharge_stop_soc': Register(HOLDING, 1071, 1, decode_raw),
+    'discharge_slot':     Register(HOLDING, 1080, 3, decode_slots), # Grid first slot 1
+    'charge_rate':        Register(HOLDING, 1090, 1, decode_raw),   # Battery charge rate %
+    'charge_stop_soc':    Register(HOLDING, 1091, 1, decode_raw),   # Stop charge SOC %
+    'ac_charge_enabled':  Register(HOLDING, 1092, 1, decode_raw),
+    # Input registers
+    'pv_power':           Register(INPUT, 1, 2, decode_u32),        # 0.1W
+    'runtime':            Register(INPUT, 57, 2, decode_u32),       # Total working time in 0.5s
+    'battery_discharge_power': Register(INPUT, 1009, 2, decode_u32), # 0.1W
+    'battery_charge_power':    Register(INPUT, 1011, 2, decode_u32), # 0.1W
+    'battery_soc':        Register(INPUT, 1014, 1, decode_raw),
+    'grid_import_power':  Register(INPUT, 1021, 2, decode_u32),     # 0.1W
+    'grid_export_power':  Register(INPUT, 1029, 2, decode_u32),     # 0.1W
+    'load_power':         Register(INPUT, 1037, 2, decode_u32),     # 0.1W
+    'load_today':         Register(INPUT, 1060, 2, decode_u32),     # 0.1kWh
+    'load_total':         Register(INPUT, 1062, 2, decode_u32),     # 0.1kWh
+    'battery_modules':    Register(INPUT, 1110, 1, decode_raw),
+}
+
+
+def plan_reads(ranges, max_block=MAX_BLOCK, max_gap=None):
+    # ranges is an iterable of (table, address, count).  Returns a list of (table, start, count) blocks which
+    # cover all of them.  Sorting and then growing each block for as long as it stays within max_block gives
+    # the fewest possible blocks.  max_gap optionally stops us reading long runs of registers we don't want.
+    blocks = []
+    for table, address, count in sorted(set(ranges)):
+        if count > max_block:
+            raise ValueError(f"Can't read {count} registers at once, the most is {max_block}")
+        end = address + count
+        if blocks:
+            last_table, last_start, last_end = blocks[-1]
+            gap = address - last_end
+            if table == last_table and max(end, last_end) - last_start <= max_block and (max_gap is None or gap <= max_gap):
+                blocks[-1] = (table, last_start, max(end, last_end))
+                continue
+        blocks.append((table, address, end))
+    return [(table, start, end - start) for table, start, end in blocks]
+
+
+def read_ranges(inverter, ranges, max_block=MAX_BLOCK, max_gap=None):
+    # Reads everything in ranges with as few requests as possible.  Returns {(table, address): value}
+    values = {}
+    for table, start, count in plan_reads(ranges, max_block, max_gap):
+        if table == HOLDING:
+            results = inverter.read_holding_registers(start, count)
+        else:
+            results = inverter.read_input_registers(start, count)
+        for offset, value in enumerate(results):
+            values[(table, start + offset)] = value
+    return values
+
+
+def read_registers(inverter, names, max_block=MAX_BLOCK, max_gap=None):
+    # Reads the named registers from REGISTERS and decodes them.  Returns {name: value}
+    wanted = [REGISTERS[name] for name in names]
+    values = read_ranges(inverter, [(r.table, r.address, r.count) for r in wanted], max_block, max_gap)
+    decoded = {}
+    for name, r in zip(names, wanted):
+        decoded[name] = r.decode([values[(r.table, r.address + i)] for i in range(r.count)])
+    return decoded
+
+
+# The battery first slots are in two blocks of three: 1100-1108 and 1018-1026.  Each slot is start, end, enabled.
+CHARGE_SLOT_BLOCKS = (1100, 1018)
+SLOTS_PER_BLOCK = 3
+MAX_CHARGE_SLOTS = len(CHARGE_SLOT_BLOCKS) * SLOTS_PER_BLOCK
+SLOTS_PER_DAY = 48
+# The encoded time of the start of every half hour of the day, so compiling a schedule is just looking them up
+HALF_HOUR_WORDS = tuple((i // 2) << 8 | (i % 2) * 30 for i in range(SLOTS_PER_DAY))
+
+
+def charge_slot_address(i):
+    # First register of battery first slot i, counting from 0
+    return CHARGE_SLOT_BLOCKS[i // SLOTS_PER_BLOCK] + 3 * (i % SLOTS_PER_BLOCK)
+
+
+def compile_slots(starts, ends, slots_available=MAX_CHARGE_SLOTS):
+    # starts and ends are half hours since the epoch (UTC, like the inverter's clock), one pair per slot in any order.
+    # Returns [encoded start, encoded end, 1] for each slot, earliest first.  The inverter only knows the time of day,
+    # so a slot may run over midnight (23:00-01:00 is fine) but can't be 24 hours or more, and no two slots may cover
+    # the same time of day, even if they're on different days.  Raises ValueError rather than program any of that.
+    slots = sorted(zip((int(start) for start in starts), (int(end) for end in ends)))
+    if len(slots) > slots_available:
+        raise ValueError(f"{len(slots)} charge slots but the inverter only has {slots_available}")
+    taken = [None] * SLOTS_PER_DAY
+    compiled = []
+    for start, end in slots:
+        if not 0 < end - start < SLOTS_PER_DAY:
+            raise ValueError(f"A charge slot must be between 30 minutes and 23.5 hours long, not {(end - start) / 2} hours")
+        for half_hour in range(start, end):
+            clash = taken[half_hour % SLOTS_PER_DAY]
+            if clash is not None:
+                raise ValueError(f"Charge slots {format_slot(*clash)} and {format_slot(start, end)} overlap on the inverter's clock")
+            taken[half_hour % SLOTS_PER_DAY] = (start, end)
+        compiled.append([HALF_HOUR_WORDS[start % SLOTS_PER_DAY], HALF_HOUR_WORDS[end % SLOTS_PER_DAY], 1])
+    return compiled
+
+
+def usable_slots(starts, ends):
+    # Splits slots (half hours since the epoch, in any order) in to the ones compile_slots() will take and the ones
+    # it won't, each as a list of (start, end) in time order.  Going from the earliest, a slot is left out if it's
+    # 24 hours or longer (or empty) or if it covers the same time of day as one that's already in, e.g. the same
+    # cheap half hours on both days of a long horizon.  The earlier one programmed repeats every day anyway.
+    taken = [False] * SLOTS_PER_DAY
+    usable, unusable = [], []
+    for start, end in sorted(zip((int(start) for start in starts), (int(end) for end in ends))):
+        if not 0 < end - start < SLOTS_PER_DAY or any(taken[half_hour % SLOTS_PER_DAY] for half_hour in range(start, end)):
+            unusable.append((start, end))
+            continue
+        for half_hour in range(start, end):
+            taken[half_hour % SLOTS_PER_DAY] = True
+        usable.append((start, end))
+    return usable, unusable
+
+
+def charge_slot_blocks(compiled):
+    # {first register: values} for both blocks of battery first slots, with any unused slots zeroed
+    compiled = list(compiled) + [[0, 0, 0]] * (MAX_CHARGE_SLOTS - len(compiled))
+    return {address: [value for slot in compiled[i * SLOTS_PER_BLOCK:(i + 1) * SLOTS_PER_BLOCK] for value in slot]
+            for i, address in enumerate(CHARGE_SLOT_BLOCKS)}
+
+
+def format_slot(start, end):
+    return "-".join(f"{decode_time(HALF_HOUR_WORDS[t % SLOTS_PER_DAY]):%H:%M}" for t in (start, end))
+
+
+MAX_WRITE = 123 # The most registers one "write multiple registers" request can carry
+
+def diff_writes(current, desired, max_block=MAX_WRITE):
+    # current and desired are {address: value} for holding registers.  Returns a list of (start, [values]) writes
+    # covering only the registers that need to change, with neighbouring changes grouped in to one write.
+    # Unchanged registers are never rewritten, even if it would save a request, to spare the inverter's flash.
+    writes = []
+    for address in sorted(desired):
+        if current.get(address) == desired[address]:
+            continue
+        if writes and writes[-1][0] + len(writes[-1][1]) == address and len(writes[-1][1]) < max_block:
+            writes[-1][1].append(desired[address])
+        else:
+            writes.append((address, [desired[address]]))
+    return writes
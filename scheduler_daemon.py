@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# Runs agile_prices' economy schedule as a long lived process instead of from cron.
+# pandas, the Octopus prices and the inverter connection are only set up once.  After that, prices are only fetched
+# while we're waiting for new ones (from PUBLISH_HOUR UK time until tomorrow's turn up, polling every POLL_SECONDS),
+# the plan is worked out again at every half hour, and the inverter is only programmed when the plan changes.
+#
+# The slow bits (HTTP and Modbus) run in a thread so that the event loop is free to notice a SIGTERM.
+
+import signal
+import asyncio
+import datetime
+from argparse import ArgumentParser
+
+import pytz
+
+from price_cache import PUBLISH_HOUR, prices_expected_until
+
+POLL_SECONDS = 300
+SLOT = datetime.timedelta(minutes=30)
+
+
+def utcnow():
+    return datetime.datetime.now(pytz.utc)
+
+
+def floor_half_hour(now):
+    return now.replace(minute=now.minute - now.minute % 30, second=0, microsecond=0)
+
+
+def next_half_hour(now):
+    return floor_half_hour(now) + SLOT
+
+
+def remaining(slots, now):
+    # What's left of a plan from now on, as (start, end) pairs.  A slot that is already running is cut to start now,
+    # so that a plan doesn't look like it has changed just because time has moved on.
+    left = []
+    for start, end in slots:
+        if end > now:
+            left.append((max(start, now), end))
+    return left
+
+
+class SchedulerDaemon:
+    def __init__(self, dummy=True, use_cache=True, plan_fn=None, program_fn=None, prices_fn=None, now_fn=utcnow, poll_seconds=POLL_SECONDS):
+        # plan_fn(prices, now) returns a frame of merged charge slots, program_fn(slots, dummy) sends them to the
+        # inverter and prices_fn(start_time) returns a Prices.  They default to agile_prices, and are there to be
+        # swapped out for testing.
+        if plan_fn is None or program_fn is None or prices_fn is None:
+            import agile_prices
+            plan_fn = plan_fn or agile_prices.economy_charge_slots
+            if program_fn is None:
+                import plan_cache
+                program_fn = lambda slots, dummy: agile_prices.set_charging(slots, dummy, None if dummy else plan_cache.get_plan_cache())
+            prices_fn = prices_fn or (lambda start_time: agile_prices.Prices(start_time=start_time, use_cache=use_cache))
+        self.dummy = dummy
+        self.plan_fn = plan_fn
+        self.program_fn = program_fn
+        self.prices_fn = prices_fn
+        self.now_fn = now_fn
+        self.poll_seconds = poll_seconds
+        self.prices = None
+        self.programmed = None # The (start, end) pairs we last sent to the inverter
+        self.stop = asyncio.Event()
+
+    def prices_until(self):
+        if self.prices is None or self.prices.prices.empty:
+            return None
+        return self.prices.prices.end_time.max()
+
+    def waiting_for_prices(self, now):
+        until = self.prices_until()
+        return until is None or until < prices_expected_until(now)
+
+    async def refresh_prices(self, now):
+        # Returns True if we got prices for half hours we didn't have before
+        start_time = floor_half_hour(now).astimezone(pytz.utc).replace(tzinfo=None).isoformat(timespec='seconds') + "Z"
+        before = self.prices_until()
+        self.prices = await asyncio.to_thread(self.prices_fn, start_time)
+        after = self.prices_until()
+        if after is not None and (before is None or after > before):
+            print(f"Got prices until {after}")
+            return True
+        return False
+
+    async def replan(self, now):
+        # Returns True if the inverter was programmed
+        slots = await asyncio.to_thread(self.plan_fn, self.prices, now)
+        planned = remaining(zip(slots.start_time, slots.end_time), now) if not slots.empty else []
+        if self.programmed is not None and planned == remaining(self.programmed, now):
+            return False
+        print(f"Plan has changed, programming {len(planned)} slots")
+        await asyncio.to_thread(self.program_fn, slots, self.dummy)
+        self.programmed = planned
+        return True
+
+    async def step(self):
+        # One wake up: fetch prices if we're waiting for them, then re-plan.  Errors are reported and we carry on,
+        # it'll be tried again next time round.
+        now = self.now_fn()
+        if self.waiting_for_prices(now):
+            try:
+                await self.refresh_prices(now)
+            except Exception as e:
+                print(f"Failed to fetch prices: {e}")
+        if self.prices is not None:
+            try:
+                await self.replan(now)
+            except Exception as e:
+                print(f"Failed to program the inverter: {e}")
+
+    def next_wake(self, now):
+        # The next half hour, or sooner if we're polling for prices
+        wake = next_half_hour(now)
+        if self.waiting_for_prices(now):
+            wake = min(wake, now + datetime.timedelta(seconds=self.poll_seconds))
+        return wake
+
+    async def run(self):
+        while not self.stop.is_set():
+            await self.step()
+            now = self.now_fn()
+            wake = self.next_wake(now)
+            try:
+                await asyncio.wait_for(self.stop.wait(), timeout=max(0, (wake - now).total_seconds()))
+            except asyncio.TimeoutError:
+                pass
+        print("Stopped")
+
+
+async def main(args):
+    import agile_prices
+    agile_prices.inverter_addr = args.inverter
+    daemon = SchedulerDaemon(dummy=args.dummy, use_cache=not args.no_cache, poll_seconds=args.poll)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, daemon.stop.set)
+    await daemon.run()
+
+
+def parse_args():
+    parser = ArgumentParser(description="Keep the inverter programmed with the cheapest economy charging schedule, re-planning as new Agile prices are published.")
+    parser.add_argument("-i", "--inverter", dest="inverter", help="Set the inverter address.  Default is ew11-1", default='ew11-1')
+    parser.add_argument("-p", "--poll", dest="poll", help=f"Seconds between checks for new prices while we're waiting for them. Default is {POLL_SECONDS}", default=POLL_SECONDS, type=int)
+    parser.add_argument("--dummy", dest="dummy", help="Dummy run. Don't actually program the inverter", action="store_true")
+    parser.add_argument("--no-cache", dest="no_cache", help="Ignore the local price cache and fetch everything from Octopus", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Runs the battery forward half hour by half hour for one or many candidate charge schedules at once, giving the SOC
+# all the way along and what we'd pay for what comes from the grid.  The loop is over half hours (48 for a day), each
+# step is a handful of NumPy operations across every candidate, so an optimiser can try thousands of schedules in a
+# few milliseconds.
+#
+# How the inverter behaves, roughly:
+#   Charge (battery first) half hours: the battery charges at up to charge_rate until it reaches ceiling, from the sun
+#   first and then the grid.  The house runs from the sun, then the grid.
+#   Every other half hour (load first): spare sun goes in to the battery, up to charge_rate and until it's full.  Any
+#   shortfall comes out of the battery until it's down to floor, then from the grid.  Spare sun that doesn't fit in
+#   the battery is exported.
+
+from collections import namedtuple
+
+import numpy as np
+
+SOC_FLOOR = 10 # % the inverter stops discharging at
+SOC_CEILING = 100
+CHARGE_RATE = 2.7 # kW, same as agile_prices.max_ac_charge_rate
+
+# soc is in %, with one more column than there are half hours: the first is where we started, each of the others
+# where we are at the end of that half hour.  grid_import and grid_export are kWh for each half hour, cost is in
+# whatever prices were in.  With a single schedule everything loses its first dimension.
+Simulation = namedtuple('Simulation', ['soc', 'grid_import', 'grid_export', 'cost'])
+
+
+def simulate(schedule, load, solar, capacity, start_soc, prices=None, charge_rate=CHARGE_RATE, floor=SOC_FLOOR,
+             ceiling=SOC_CEILING, export_prices=None):
+    # schedule is booleans, True for half hours we're charging in, either one schedule or candidates x half hours.
+    # load and solar are kWh for each half hour, prices and export_prices per kWh (no prices costs nothing).
+    schedule = np.asarray(schedule, dtype=bool)
+    single = schedule.ndim == 1
+    schedule = np.atleast_2d(schedule)
+    candidates, slots = schedule.shape
+    net = np.asarray(solar, dtype=np.float64) - np.asarray(load, dtype=np.float64)
+    if net.shape != (slots,):
+        raise ValueError(f"Need load and solar for each of the {slots} half hours")
+    surplus = np.maximum(net, 0)
+    shortfall = np.maximum(-net, 0)
+    step = charge_rate / 2 # kWh in half an hour
+    floor_kwh, ceiling_kwh = capacity * floor / 100, capacity * ceiling / 100
+
+    energy = np.empty((candidates, slots + 1))
+    energy[:, 0] = capacity * start_soc / 100
+    grid = np.empty((candidates, slots)) # + from the grid, - to it
+    for t in range(slots):
+        e = energy[:, t]
+        from_grid_charge = np.clip(ceiling_kwh - e, 0, step)
+        from_sun = np.minimum(surplus[t], np.clip(capacity - e, 0, step)) - np.minimum(shortfall[t], np.clip(e - floor_kwh, 0, None))
+        battery = np.where(schedule[:, t], from_grid_charge, from_sun)
+        energy[:, t + 1] = e + battery
+        grid[:, t] = battery - net[t]
+
+    grid_import = np.maximum(grid, 0)
+    grid_export = np.maximum(-grid, 0)
+    cost = np.zeros(candidates)
+    if prices is not None:
+        cost += grid_import @ np.asarray(prices, dtype=np.float64)
+    if export_prices is not None:
+        cost -= grid_export @ np.asarray(export_prices, dtype=np.float64)
+    result = Simulation(energy / capacity * 100, grid_import, grid_export, cost)
+    if single:
+        result = Simulation(*(each[0] for each in result))
+    return result
+
+
+def runtime_hours(load, solar, capacity, start_soc, floor=SOC_FLOOR):
+    # How long until the battery can't keep up and we start pulling from the grid, if we don't charge it.  If it
+    # lasts longer than load goes on for, that's how long we say it lasts.
+    load = np.asarray(load, dtype=np.float64)
+    solar = np.asarray(solar, dtype=np.float64)
+    sim = simulate(np.zeros(len(load), dtype=bool), load, solar, capacity, start_soc, floor=floor)
+    short = np.flatnonzero(sim.grid_import > 1e-9)
+    if len(short) == 0:
+        return len(load) / 2
+    t = short[0]
+    covered = 1 - sim.grid_import[t] / (load[t] - solar[t])
+    return (t + covered) / 2
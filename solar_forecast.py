@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+# The forecast.solar prediction, kept on disk so that we don't ask for it more than we have to.
+# The free API only allows a few requests an hour and says no (429) when we go over, which used to take the planner
+# down with it.  Now we fetch the per-period watt hours for today and tomorrow at most once every TTL_SECONDS, keep
+# them in one JSON file keyed by (local) date, and if forecast.solar can't be reached use the last forecast we got
+# for that day, however old.
+#
+# Usage:
+#   solar_forecast.py                   Print tomorrow's total and the next 24 hours
+
+import os
+import time
+import datetime
+from argparse import ArgumentParser
+
+import numpy as np
+import pytz
+
+import spans
+from json_file import read_json, write_json
+
+FORECAST_URL = "https://api.forecast.solar/estimate/watthours/period/52.1322466021396/-0.21998598515728754/27/-80/6.720"
+LOCAL_TZ = pytz.timezone("Europe/London") # forecast.solar gives times in the location's time zone
+CACHE_PATH = os.path.expanduser("~/.cache/octopus_agile/solar_forecast.json")
+TTL_SECONDS = 60 * 60
+RETRY_SECONDS = 5 * 60 # after a failed fetch, don't try again for this long
+KEEP_DAYS = 7
+TIMEOUT = 10
+HALF_HOUR = 1800
+forecast = None # The shared SolarForecast.  Use get_solar_forecast()
+
+
+class SolarForecastError(Exception):
+    pass
+
+
+def fetch_periods(url=FORECAST_URL, session=None):
+    # {"2023-05-01 06:00:00": Wh, ...}, the energy for the period ending at each local time
+    if session is None:
+        import requests
+        session = requests
+    with spans.span("forecast.solar"):
+        r = session.get(url, headers={"Accept": "application/json"}, timeout=TIMEOUT)
+    try:
+        result = r.json().get('result')
+    except ValueError:
+        result = None
+    if r.status_code != 200 or not result:
+        raise SolarForecastError(f"forecast.solar said {r.status_code}: {r.text}")
+    return result
+
+
+def parse_periods(result):
+    # {date: [[start, end, Wh], ...]} with start and end in seconds since the epoch.  Each period runs from the end of
+    # the one before it.  The first one of the day is at sunrise and has nothing in it, so its length doesn't matter.
+    days = {}
+    for key in sorted(result):
+        local = LOCAL_TZ.localize(datetime.datetime.strptime(key, "%Y-%m-%d %H:%M:%S"))
+        end = int(local.timestamp())
+        periods = days.setdefault(key[:10], [])
+        start = periods[-1][1] if periods else end - 3600
+        periods.append([start, end, result[key]])
+    return days
+
+
+def local_date(t):
+    return t.astimezone(LOCAL_TZ).date()
+
+
+class SolarForecast:
+    def __init__(self, path=CACHE_PATH, ttl=TTL_SECONDS, fetch_fn=fetch_periods, clock=time.time):
+        # fetch_fn and clock let you hand in fakes, e.g. for testing
+        self.path = path
+        self.ttl = ttl
+        self.fetch_fn = fetch_fn
+        self.clock = clock
+        self.last_attempt = None
+        self.days = self.load() # {date: {'fetched': seconds since the epoch, 'periods': [[start, end, Wh], ...]}}
+
+    def load(self):
+        return read_json(self.path, {})
+
+    def save(self):
+        write_json(self.path, self.days)
+
+    def refresh(self):
+        now = self.clock()
+        for date, periods in parse_periods(self.fetch_fn()).items():
+            self.days[date] = {'fetched': now, 'periods': periods}
+        oldest = str(datetime.date.fromtimestamp(now) - datetime.timedelta(days=KEEP_DAYS))
+        self.days = {date: day for date, day in self.days.items() if date >= oldest}
+        self.save()
+
+    def periods(self, date):
+        # [[start, end, Wh], ...] for a local date.  Fetched again if what we have is older than the TTL, unless we
+        # tried and failed a moment ago.  Raises SolarForecastError if we've never had a forecast for the day.
+        key = str(date)
+        now = self.clock()
+        day = self.days.get(key)
+        if day is None or now - day['fetched'] >= self.ttl:
+            # A day missing from a fetch that's still fresh is past the end of the forecast, asking again won't help
+            last_fetch = max((each['fetched'] for each in self.days.values()), default=None)
+            recently_fetched = last_fetch is not None and now - last_fetch < self.ttl
+            if not recently_fetched and (self.last_attempt is None or now - self.last_attempt >= RETRY_SECONDS):
+                self.last_attempt = now
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Can't fetch the solar forecast ({e})")
+            day = self.days.get(key)
+            if day is None:
+                raise SolarForecastError(f"No solar forecast for {key}")
+            if now - day['fetched'] >= self.ttl:
+                print(f"Using the solar forecast for {key} from {(now - day['fetched']) / 3600:.1f} hours ago")
+        return day['periods']
+
+    def daily_kwh(self, date):
+        return sum(wh for start, end, wh in self.periods(date)) / 1000
+
+    def half_hourly_kwh(self, start, slots=48):
+        # Expected kWh for each of the slots half hours from the one start is in.  Each period's energy is spread
+        # evenly over the time it covers.  Days past the end of the forecast count as no sun.
+        first = int(start.timestamp()) // HALF_HOUR * HALF_HOUR
+        edges = first + HALF_HOUR * np.arange(slots + 1)
+        periods = []
+        missing = None
+        date = local_date(datetime.datetime.fromtimestamp(edges[0], pytz.utc))
+        while date <= local_date(datetime.datetime.fromtimestamp(edges[-1], pytz.utc)):
+            try:
+                periods += self.periods(date)
+            except SolarForecastError as e:
+                missing = e
+            date += datetime.timedelta(days=1)
+        if not periods:
+            raise missing
+        starts, ends, wh = np.array(periods, dtype=np.float64).T
+        overlap = np.minimum(ends[:, None], edges[None, 1:]) - np.maximum(starts[:, None], edges[None, :-1])
+        fraction = np.clip(overlap, 0, None) / np.maximum(ends - starts, 1)[:, None]
+        return (fraction * wh[:, None]).sum(axis=0) / 1000
+
+
+def get_solar_forecast():
+    global forecast
+    if forecast is None:
+        forecast = SolarForecast()
+    return forecast
+
+
+def tomorrow_kwh(now=None):
+    # Total for tomorrow, UK time
+    if now is None:
+        now = datetime.datetime.now(pytz.utc)
+    return get_solar_forecast().daily_kwh(local_date(now) + datetime.timedelta(days=1))
+
+
+def half_hourly_kwh(start=None, slots=48):
+    if start is None:
+        start = datetime.datetime.now(pytz.utc)
+    return get_solar_forecast().half_hourly_kwh(start, slots)
+
+
+def parse_args():
+    parser = ArgumentParser(description="Print the solar forecast, fetching it from forecast.solar if ours is out of date.")
+    parser.add_argument("-f", "--file", dest="path", help=f"Cache file. Default is {CACHE_PATH}", default=CACHE_PATH)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    forecast = SolarForecast(args.path)
+    now = datetime.datetime.now(pytz.utc)
+    print(f"Tomorrow: {tomorrow_kwh(now):.1f} kWh")
+    first = int(now.timestamp()) // HALF_HOUR * HALF_HOUR
+    for i, kwh in enumerate(half_hourly_kwh(now)):
+        if kwh:
+            print(f"{datetime.datetime.fromtimestamp(first + i * HALF_HOUR, LOCAL_TZ):%a %H:%M}  {kwh:.2f} kWh")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# Timings for the slow bits of a run: fetching prices from Octopus and forecast.solar, building the frames, picking
+# slots and talking to the inverter.  Each phase keeps a count, a total and the longest single call.  Switched off
+# (the default) a timed function costs one check of a global and a span is a shared do-nothing context manager, so
+# it's safe to leave them on the hot paths.
+#
+# agile_prices.py --profile prints the phases as JSON lines once the run is done, --profile-influx also queues them
+# for InfluxDB.  Spans can be inside each other (get_two_hour_windows calls get_windows) so the totals
+# overlap, they don't add up to the run time.
+#
+#   with spans.span("octopus"):
+#       ...
+#
+#   @spans.timed()
+#   def build_dataframe(self):
+
+import sys
+import time
+import functools
+import threading
+
+MEASUREMENT = "agile_prices_profile"
+
+enabled = False
+phases = {} # name: [count, total seconds, max seconds], in the order they were first seen
+lock = threading.Lock() # The fleet programs inverters from several threads at once
+
+
+def record(name, seconds):
+    with lock:
+        phase = phases.get(name)
+        if phase is None:
+            phases[name] = [1, seconds, seconds]
+        else:
+            phase[0] += 1
+            phase[1] += seconds
+            phase[2] = max(phase[2], seconds)
+
+
+class Span:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+def span(name):
+    return Span(name) if enabled else NO_SPAN
+
+
+def timed(name=None):
+    # Decorator.  The phase is called name, or after the function if there isn't one.
+    def decorate(fn):
+        phase = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(phase, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+def enable():
+    global enabled
+    phases.clear()
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def summary():
+    # One dict per phase
+    with lock:
+        return [{'phase': name, 'count': count, 'seconds': round(total, 6), 'max_seconds': round(longest, 6)}
+                for name, (count, total, longest) in phases.items()]
+
+
+def write_json_lines(fp=None, when=None):
+    # when is a timestamp in seconds, by default now
+    import json
+    fp = fp or sys.stderr
+    when = time.time() if when is None else when
+    for phase in summary():
+        fp.write(json.dumps({'time': round(when, 3), **phase}) + "\n")
+    fp.flush()
+
+
+def influx_lines(when=None, measurement=MEASUREMENT, tags=None):
+    # (key, line protocol) for each phase, see influx_writer.line()
+    from influx_writer import line
+    timestamp_ns = time.time_ns() if when is None else int(when * 10**9)
+    return [line(measurement, {'count': phase['count'], 'seconds': float(phase['seconds']), 'max_seconds': float(phase['max_seconds'])},
+                 timestamp_ns, {**(tags or {}), 'phase': phase['phase']}) for phase in summary()]
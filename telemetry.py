@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Samples the inverter every few seconds and keeps half hourly averages on disk, so that the planner can use what
+# the house actually did rather than lifetime totals from the inverter.
+#
+# Samples go in to a fixed size ring buffer of NumPy arrays, one row per sample, so a long running poller never
+# grows.  Every so often each finished half hour is averaged and appended to a file of fixed size binary records
+# (RECORD below).  The file is only ever appended to, and read back in one go with NumPy.  A half hour can end up
+# with more than one record (e.g. the poller was restarted part way through), read_half_hours() merges them.
+#
+# Every finished half hour also goes in to the telemetry archive (see archive.py), which keeps one record per half
+# hour, the first one written, and can be read back a day or a month at a time without reading the rest.
+#
+# Usage:
+#   telemetry.py -i ew11-1              Poll until killed
+#   telemetry.py --show                 Print the half hours we have
+
+import os
+import time
+import datetime
+import threading
+from argparse import ArgumentParser
+
+import numpy as np
+
+import registers
+
+TELEMETRY_PATH = os.path.expanduser("~/.cache/octopus_agile/telemetry.bin")
+SAMPLE_SECONDS = 5
+FLUSH_SECONDS = 60
+CAPACITY = 2048 # samples.  Needs to hold more than FLUSH_SECONDS plus a half hour of them
+HALF_HOUR = 1800
+
+# (field, register, scale).  Powers are read in 0.1W.
+FIELDS = [
+    ('soc',                 'battery_soc',             1),
+    ('load_w',              'load_power',              0.1),
+    ('pv_w',                'pv_power',                0.1),
+    ('grid_import_w',       'grid_import_power',       0.1),
+    ('grid_export_w',       'grid_export_power',       0.1),
+    ('battery_charge_w',    'battery_charge_power',    0.1),
+    ('battery_discharge_w', 'battery_discharge_power', 0.1),
+]
+FIELD_NAMES = [field for field, register, scale in FIELDS]
+SAMPLE_REGISTERS = [register for field, register, scale in FIELDS]
+SCALES = np.array([scale for field, register, scale in FIELDS], dtype=np.float32)
+
+# One half hour on disk.  start is seconds since the epoch (UTC), samples is how many went in to the averages.
+RECORD = np.dtype([('start', '<i8'), ('samples', '<i4')] + [(field, '<f4') for field in FIELD_NAMES])
+
+
+class RingBuffer:
+    # The last capacity samples, each a timestamp and a row of values
+    def __init__(self, capacity=CAPACITY, width=len(FIELDS)):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, width), dtype=np.float32)
+        self.count = 0 # Samples ever added.  The next one goes in at count % capacity
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, t, values):
+        i = self.count % self.capacity
+        self.times[i] = t
+        self.values[i] = values
+        self.count += 1
+
+    def window(self):
+        # (times, values) for everything held, oldest first
+        order = np.arange(self.count - len(self), self.count) % self.capacity
+        return self.times[order], self.values[order]
+
+
+def half_hour_records(times, values):
+    # Average samples in to one record per half hour.  times must be in order.
+    starts = times // HALF_HOUR * HALF_HOUR
+    slot_starts, first, counts = np.unique(starts, return_index=True, return_counts=True)
+    records = np.zeros(len(slot_starts), dtype=RECORD)
+    records['start'] = slot_starts
+    records['samples'] = counts
+    means = np.add.reduceat(values.astype(np.float64), first, axis=0) / counts[:, None]
+    for i, field in enumerate(FIELD_NAMES):
+        records[field] = means[:, i]
+    return records
+
+
+def append_records(path, records):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as fp:
+        fp.write(records.tobytes())
+
+
+def read_half_hours(path=TELEMETRY_PATH, since=None):
+    # Every half hour on disk, oldest first, as a NumPy structured array of RECORD.  since is a datetime or
+    # seconds since the epoch.  Records for the same half hour are merged, weighted by their number of samples.
+    try:
+        records = np.fromfile(path, dtype=RECORD)
+    except (OSError, ValueError):
+        return np.zeros(0, dtype=RECORD)
+    if since is not None:
+        if isinstance(since, datetime.datetime):
+            since = since.timestamp()
+        records = records[records['start'] >= since]
+    if len(records) == 0:
+        return records
+    records = records[np.argsort(records['start'], kind='stable')]
+    starts, first = np.unique(records['start'], return_index=True)
+    if len(starts) == len(records):
+        return records
+    merged = np.zeros(len(starts), dtype=RECORD)
+    merged['start'] = starts
+    weights = records['samples'].astype(np.float64)
+    merged['samples'] = np.add.reduceat(records['samples'], first)
+    for field in FIELD_NAMES:
+        merged[field] = np.add.reduceat(records[field] * weights, first) / merged['samples']
+    return merged
+
+
+def get_archive(directory=None):
+    import archive
+    return archive.Archive(os.path.join(directory or archive.ARCHIVE_DIR, "telemetry"), [(name, RECORD[name].str) for name in RECORD.names])
+
+
+class TelemetryPoller:
+    def __init__(self, inverter, path=TELEMETRY_PATH, interval=SAMPLE_SECONDS, capacity=CAPACITY, clock=time.time, archive=None):
+        # clock lets you hand in a fake time.time, e.g. for testing.  archive is an archive.Archive (get_archive())
+        # to add finished half hours to as well.
+        self.inverter = inverter
+        self.path = path
+        self.archive = archive
+        self.interval = interval
+        self.clock = clock
+        self.buffer = RingBuffer(capacity)
+        self.flushed_until = 0 # Every sample before this (epoch seconds) is on disk
+
+    def sample(self):
+        values = registers.read_registers(self.inverter, SAMPLE_REGISTERS)
+        row = np.array([values[register] for register in SAMPLE_REGISTERS], dtype=np.float32) * SCALES
+        self.buffer.append(int(self.clock()), row)
+        return row
+
+    def flush(self, everything=False):
+        # Write out every half hour that has finished since the last flush.  everything writes the current half hour
+        # too, for when we're stopping.  Returns the number of records written.
+        now = int(self.clock())
+        cutoff = now + 1 if everything else now // HALF_HOUR * HALF_HOUR
+        times, values = self.buffer.window()
+        wanted = (times >= self.flushed_until) & (times < cutoff)
+        self.flushed_until = max(self.flushed_until, cutoff)
+        if not wanted.any():
+            return 0
+        records = half_hour_records(times[wanted], values[wanted])
+        append_records(self.path, records)
+        if self.archive is not None:
+            self.archive.append(records[records['start'] + HALF_HOUR <= now])
+        return len(records)
+
+    def run(self, stop=None, flush_seconds=FLUSH_SECONDS):
+        # Poll until stop (a threading.Event) is set.  A failed read is reported and skipped, the inverter's bridge
+        # drops out now and then.
+        stop = stop or threading.Event()
+        last_flush = self.clock()
+        try:
+            while not stop.is_set():
+                started = time.monotonic()
+                try:
+                    self.sample()
+                except Exception as e:
+                    print(f"Failed to read the inverter: {e}")
+                if self.clock() - last_flush >= flush_seconds:
+                    self.flush()
+                    last_flush = self.clock()
+                stop.wait(max(0, self.interval - (time.monotonic() - started)))
+        finally:
+            self.flush(everything=True)
+
+
+def parse_args():
+    parser = ArgumentParser(description="Sample the inverter's SOC, load, PV and grid power and keep half hourly averages on disk.")
+    parser.add_argument("-i", "--inverter", dest="inverter", help="Set the inverter address.  Default is ew11-1", default='ew11-1')
+    parser.add_argument("-n", "--interval", dest="interval", help=f"Seconds between samples. Default is {SAMPLE_SECONDS}", default=SAMPLE_SECONDS, type=float)
+    parser.add_argument("-o", "--output", dest="path", help=f"Time series file. Default is {TELEMETRY_PATH}", default=TELEMETRY_PATH)
+    parser.add_argument("--no-archive", dest="no_archive", help="Don't add half hours to the telemetry archive", action="store_true")
+    parser.add_argument("--show", dest="show", help="Print the half hours we have and exit", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.show:
+        for r in read_half_hours(args.path):
+            when = datetime.datetime.fromtimestamp(int(r['start']), datetime.timezone.utc)
+            print(f"{when:%Y-%m-%d %H:%M}  " + "  ".join(f"{field} {r[field]:.0f}" for field in FIELD_NAMES) + f"  ({r['samples']} samples)")
+    else:
+        from inverter import Inverter
+        with Inverter(args.inverter) as inverter:
+            try:
+                TelemetryPoller(inverter, args.path, args.interval, archive=None if args.no_archive else get_archive()).run()
+            except KeyboardInterrupt:
+                pass
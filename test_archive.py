@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import os
+import datetime
+import tempfile
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+import archive
+import backtest
+import octopus_api
+import agile_prices
+import price_parser
+from archive import Archive, DAY
+from test_backtest import history
+
+T0 = 1677628800 # 2023-03-01 00:00 UTC
+
+
+def rows(first, count, value=0):
+    start = T0 + 1800 * np.arange(first, first + count)
+    return {'start': start, 'value_inc_vat': value + np.arange(first, first + count) / 10}
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp.name, "prices", "E-1R-AGILE-FLEX-22-11-25-A")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open(self):
+        return Archive(self.directory, archive.PRICE_COLUMNS)
+
+    def test_append_and_range(self):
+        a = self.open()
+        self.assertEqual(len(a), 0)
+        self.assertEqual(len(a.range()['start']), 0)
+        # Out of order and with a repeat
+        self.assertEqual(a.append({'start': [T0 + 1800, T0, T0], 'value_inc_vat': [2.0, 1.0, 5.0]}), 2)
+        self.assertEqual(a.append(rows(1, 200)), 199)
+        self.assertEqual(a.append(rows(0, 10)), 0)
+        a = self.open()
+        self.assertEqual(len(a), 201)
+        self.assertEqual(a.days, 5)
+        np.testing.assert_array_equal(a.index(), [0, 48, 96, 144, 192])
+        day = a.day(datetime.date(2023, 3, 2))
+        np.testing.assert_array_equal(day['start'], T0 + DAY + 1800 * np.arange(48))
+        self.assertIsInstance(day['value_inc_vat'], np.memmap)
+        some = a.range(datetime.datetime(2023, 3, 2, 23, 15), T0 + 3 * DAY + 1800)
+        self.assertEqual(list(some['start']), list(T0 + 1800 * np.arange(95, 145)))
+        self.assertEqual(a.range("2023-03-01T00:30:00Z", T0 + 3600)['value_inc_vat'].tolist(), [2.0])
+        self.assertEqual(len(a.range(T0 + 10 * DAY)['start']), 0)
+        self.assertEqual(len(a.range(T0 - DAY, T0)['start']), 0)
+
+    def test_unfinished_append_is_ignored(self):
+        a = self.open()
+        a.append(rows(0, 10))
+        # Killed after writing a column but before meta.json
+        with open(os.path.join(self.directory, "start.col"), "ab") as fp:
+            fp.write(np.arange(3, dtype='<i8').tobytes())
+        a = self.open()
+        self.assertEqual(len(a), 10)
+        a.append(rows(10, 5))
+        self.assertEqual(list(self.open().column('start')), list(rows(0, 15)['start']))
+
+    def test_backfill(self):
+        a = self.open()
+        a.append(rows(100, 10, value=1))
+        self.assertEqual(a.append(rows(0, 105)), 100)
+        a = self.open()
+        np.testing.assert_array_equal(a.column('start'), rows(0, 110)['start'])
+        # What was already there wins
+        self.assertEqual(a.column('value_inc_vat')[100], 1 + 100 / 10)
+        self.assertEqual(a.column('value_inc_vat')[99], 99 / 10)
+        self.assertEqual(a.first_day, T0 // DAY)
+        np.testing.assert_array_equal(a.index(), [0, 48, 96])
+
+    def test_columns_must_match(self):
+        self.open().append(rows(0, 1))
+        with self.assertRaises(ValueError):
+            Archive(self.directory, [('start', '<i8'), ('value_inc_vat', '<f4')])
+        self.assertEqual(archive.open_archive(self.directory).columns, self.open().columns)
+
+
+class TestPricesFromArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_as_octopus(self):
+        prices = history(3)
+        prices_archive = archive.prices_archive("E-1R-AGILE-FLEX-22-11-25-A", self.tmp.name)
+        parsed = price_parser.parse_results(backtest.octopus_results(prices)['results'])
+        self.assertEqual(archive.add_rates(prices_archive, parsed), 144)
+        rates = archive.unit_rates(prices_archive, "2023-03-02T00:00:00Z", datetime.datetime(2023, 3, 3))
+        np.testing.assert_array_equal(rates.start, parsed.start[48:96])
+        np.testing.assert_array_equal(rates.end, parsed.end[48:96])
+        self.assertEqual(len(rates.gaps), 0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            archived = agile_prices.Prices(rates=rates)
+            fetched = agile_prices.Prices(prices_dict=backtest.octopus_results(prices.iloc[48:96]))
+        pd.testing.assert_frame_equal(archived.prices, fetched.prices)
+        pd.testing.assert_frame_equal(archived.get_economy_slots(), fetched.get_economy_slots())
+
+        # And a year's worth for the backtest
+        frame = backtest.read_archive("E-1R-AGILE-FLEX-22-11-25-A", datetime.date(2023, 3, 2), None, directory=self.tmp.name)
+        pd.testing.assert_frame_equal(frame, price_parser.to_frame(parsed).iloc[48:].reset_index(drop=True))
+
+    def test_empty_archive_fetches_from_octopus(self):
+        prices = history(1)
+        fetches = []
+
+        def fetch_unit_rates(period_from, period_to, product_code, tariff_code):
+            fetches.append(period_from)
+            return backtest.octopus_results(prices)
+        saved = archive.prices_archive, octopus_api.fetch_unit_rates
+        archive.prices_archive = lambda tariff_code: Archive(os.path.join(self.tmp.name, tariff_code), archive.PRICE_COLUMNS)
+        octopus_api.fetch_unit_rates = fetch_unit_rates
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                fetched = agile_prices.Prices("2023-03-01T00:00:00Z", use_cache=False, archive=True)
+                # Which archived them, so next time they come from there
+                archived = agile_prices.Prices("2023-03-01T00:00:00Z", use_cache=False, archive=True)
+        finally:
+            archive.prices_archive, octopus_api.fetch_unit_rates = saved
+        self.assertEqual(fetches, ["2023-03-01T00:00:00Z"])
+        self.assertEqual(len(fetched.prices), 48)
+        pd.testing.assert_frame_equal(archived.prices, fetched.prices)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import registers
+
+
+def history(days, seed=0):
+    rng = np.random.default_rng(seed)
+    start_time = pd.date_range("2023-03-01", periods=days * 48, freq="30min", tz="UTC")
+    prices = pd.DataFrame({'start_time': start_time, 'end_time': start_time + pd.Timedelta('30m'),
+                           'value_inc_vat': np.round(rng.normal(25, 8, len(start_time)), 2)})
+    prices['duration'] = prices.end_time - prices.start_time
+    return prices
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+class TestCharge(unittest.TestCase):
+    def test_stops_at_target(self):
+        prices = history(1)
+        intervals = [(prices.start_time[2], prices.end_time[5])]
+        cost, kwh, half_hours = backtest.charge(prices, intervals, start_kwh=2, target_kwh=6, rate=2.7)
+        self.assertEqual(half_hours, 4)
+        self.assertAlmostEqual(kwh, 4)
+        self.assertAlmostEqual(cost, 1.35 * (prices.value_inc_vat[2] + prices.value_inc_vat[3]) + 1.3 * prices.value_inc_vat[4])
+
+    def test_nothing_to_do(self):
+        prices = history(1)
+        self.assertEqual(backtest.charge(prices, [], 2, 6), (0.0, 0.0, 0))
+        self.assertEqual(backtest.charge(prices, [(prices.start_time[0], prices.end_time[1])], 6, 2)[:2], (0.0, 0.0))
+
+    def test_count_runs(self):
+        intervals = [(utc(2023, 3, 1, 2), utc(2023, 3, 1, 3)), (utc(2023, 3, 1, 1), utc(2023, 3, 1, 2)), (utc(2023, 3, 1, 5), utc(2023, 3, 1, 6))]
+        self.assertEqual(backtest.count_runs(intervals), 2)
+
+
+class TestFakeInverter(unittest.TestCase):
+    def test_reads_back_what_was_programmed(self):
+        now = utc(2023, 3, 1, 18)
+        fake = backtest.FakeInverter(now, soc=40, load_kwh=12)
+        self.assertEqual(registers.read_registers(fake, ['battery_soc'])['battery_soc'], 40)
+        self.assertEqual(registers.read_registers(fake, ['inverter_time'])['inverter_time'], datetime.datetime(2023, 3, 1, 18))
+        fake.write_registers(1100, [23 << 8 | 30, 1 << 8, 1, 19 << 8, 19 << 8 | 30, 1])
+        self.assertEqual(fake.charge_intervals(now), [(utc(2023, 3, 1, 23, 30), utc(2023, 3, 2, 1)),
+                                                      (utc(2023, 3, 1, 19), utc(2023, 3, 1, 19, 30))])
+
+
+class TestBacktest(unittest.TestCase):
+    def test_one_row_per_full_day(self):
+        tasks = backtest.day_tasks(history(4), 'calculation')
+        # Planning at 18:00 needs the next 24 hours, so the last day is lost
+        self.assertEqual([task[2].date() for task in tasks], [datetime.date(2023, 3, d) for d in (1, 2, 3)])
+        self.assertTrue(all(len(task[1]) == 48 for task in tasks))
+
+    def test_profile(self):
+        profile = {datetime.date(2023, 3, 2): {'load_kwh': 5, 'solar_kwh': float('nan')}}
+        tasks = backtest.day_tasks(history(3), 'calculation', profile)
+        self.assertEqual(tasks[1][3], {'load_kwh': 5, 'solar_kwh': backtest.DEFAULT_SOLAR, 'soc': backtest.DEFAULT_SOC})
+
+    def test_calculation(self):
+        results = backtest.backtest(history(3), 'calculation', workers=1)
+        self.assertEqual(len(results), 2)
+        self.assertTrue(results.error.isna().all())
+        self.assertTrue((results.kwh > 0).all())
+        self.assertTrue((results.cost > 0).all())
+
+    def test_parallel_matches_serial(self):
+        serial = backtest.backtest(history(4, seed=1), 'calculation', workers=1)
+        parallel = backtest.backtest(history(4, seed=1), 'calculation', workers=2)
+        pd.testing.assert_frame_equal(serial, parallel)
+
+    def test_unknown_planner(self):
+        with self.assertRaises(ValueError):
+            backtest.backtest(history(2), 'guess')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import tempfile
+
+import pandas as pd
+
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_synthetic_prices(self):
+        prices = benchmark.synthetic_prices(7)
+        self.assertEqual(len(prices), 7 * 48)
+        self.assertTrue((prices.end_time - prices.start_time == pd.Timedelta('30m')).all())
+        # The evening peak should be dearer than the middle of the night
+        hour = prices.start_time.dt.hour
+        self.assertGreater(prices.value_inc_vat[(hour >= 16) & (hour < 19)].mean(), prices.value_inc_vat[hour < 6].mean())
+
+    def test_run_and_compare(self):
+        results = benchmark.run_benchmarks(['window_means', 'cheapest_charge_slots'], ['day'], min_time=0)
+        self.assertEqual([(r['benchmark'], r['size'], r['repeats']) for r in results['results']],
+                         [('window_means', 'day', benchmark.MIN_REPEATS), ('cheapest_charge_slots', 'day', benchmark.MIN_REPEATS)])
+        self.assertEqual(benchmark.compare(results, results), [])
+        slower = {'results': [dict(r, min=r['min'] * 2) for r in results['results']]}
+        self.assertEqual([(name, size) for name, size, ratio in benchmark.compare(results, slower)],
+                         [('window_means', 'day'), ('cheapest_charge_slots', 'day')])
+
+
+class TestStartup(unittest.TestCase):
+    def test_inverter_commands_dont_import_pandas(self):
+        for name in ('startup_import', 'startup_schedule', 'startup_soc'):
+            self.assertEqual(benchmark.heavy_imports(benchmark.STARTUP[name]), [], name)
+
+    def test_inverter_commands_dont_connect(self):
+        # A pymodbus whose client gives up as soon as anything tries to make one
+        with tempfile.TemporaryDirectory() as tmp:
+            os.mkdir(os.path.join(tmp, "pymodbus"))
+            with open(os.path.join(tmp, "pymodbus", "__init__.py"), "w"):
+                pass
+            with open(os.path.join(tmp, "pymodbus", "client.py"), "w") as fp:
+                fp.write("import sys\n\nclass ModbusTcpClient:\n    def __init__(self, *args, **kwargs):\n        sys.exit('Connecting to the inverter')\n")
+            with open(os.path.join(tmp, "pymodbus", "exceptions.py"), "w") as fp:
+                fp.write("class ModbusException(Exception):\n    pass\n")
+            env = dict(os.environ, PYTHONPATH=tmp)
+            for name in ('startup_schedule', 'startup_soc'):
+                result = benchmark.run_python(benchmark.STARTUP[name], env)
+                self.assertEqual(result.returncode, 0, result.stderr)
+                self.assertNotIn('Connecting to the inverter', result.stderr, name)
+
+    def test_heavy_imports_are_noticed(self):
+        self.assertEqual(benchmark.heavy_imports(['-c', 'import pandas']), ['pandas', 'numpy'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import time
+import datetime
+import contextlib
+
+import fleet
+import agile_prices
+import registers
+from fleet import Member
+from inverter import InverterError
+
+
+class FakeInverter:
+    # Holding registers that can be written, input registers that can't.  Anything not set reads as zero.
+    def __init__(self, address, holding=None, inputs=None, delay=0, broken=False):
+        self.address = address
+        self.holding = dict(holding or {})
+        self.inputs = dict(inputs or {})
+        self.delay = delay
+        self.broken = broken
+        self.writes = []
+        self.closed = False
+
+    def check(self):
+        time.sleep(self.delay)
+        if self.broken:
+            raise InverterError(f"Failed to connect to inverter at {self.address}")
+
+    def read_holding_registers(self, address, count=1):
+        self.check()
+        return [self.holding.get(address + i, 0) for i in range(count)]
+
+    def read_input_registers(self, address, count=1):
+        self.check()
+        return [self.inputs.get(address + i, 0) for i in range(count)]
+
+    def write_registers(self, address, values_list):
+        self.check()
+        self.writes.append((address, list(values_list)))
+        for i, value in enumerate(values_list):
+            self.holding[address + i] = value
+
+    def close(self):
+        self.closed = True
+
+
+class FakeFleet:
+    def __init__(self, *inverters):
+        self.inverters = {inverter.address: inverter for inverter in inverters}
+
+    def __call__(self, address):
+        return self.inverters[address]
+
+
+class TestParseMember(unittest.TestCase):
+    def test_parse_member(self):
+        self.assertEqual(fleet.parse_member("ew11-1"), Member("ew11-1", None, 6))
+        self.assertEqual(fleet.parse_member("ew11-2:13"), Member("ew11-2", 13, 6))
+        self.assertEqual(fleet.parse_member("ew11-2::5"), Member("ew11-2", None, 5))
+        for bad in ("", "ew11-1:13:7", "ew11-1:13:5:1", "ew11-1:big"):
+            with self.assertRaises(ValueError):
+                fleet.parse_member(bad)
+
+
+class TestChargeSlotRegisters(unittest.TestCase):
+    def test_reserved_slots_are_left_alone(self):
+        slots = [[0x0100, 0x0300, 1]]
+        desired = agile_prices.charge_slot_registers(slots, 5)
+        self.assertEqual([desired[1100 + i] for i in range(3)], [0x0100, 0x0300, 1])
+        self.assertEqual(desired[1018], 0)
+        self.assertEqual(desired[1021], 0)
+        self.assertNotIn(1024, desired)
+        self.assertEqual(len(agile_prices.charge_slot_registers(slots)), 6 * 3 + 3)
+
+
+class TestSetCharging(unittest.TestCase):
+    def setUp(self):
+        self.saved = agile_prices.MODBUS, agile_prices.inverter, agile_prices.fleet_members
+        agile_prices.MODBUS = True
+        agile_prices.fleet_members = []
+        agile_prices.inverter = FakeInverter("ew11-1", holding={45: 23, 46: 3, 47: 1, 1100: 7 << 8, 1101: 8 << 8, 1102: 1})
+
+    def tearDown(self):
+        agile_prices.MODBUS, agile_prices.inverter, agile_prices.fleet_members = self.saved
+
+    def set_charging(self, *times):
+        import pandas as pd
+        starts = pd.to_datetime(list(times[::2]), utc=True)
+        slots = pd.DataFrame({'start_time': starts, 'end_time': pd.to_datetime(list(times[1::2]), utc=True)})
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            agile_prices.set_charging(slots, dummy=False)
+        return registers.decode_slots([agile_prices.inverter.holding.get(1100 + i, 0) for i in range(9)]), out.getvalue()
+
+    def test_set_charging(self):
+        slots, out = self.set_charging("2023-03-02T02:00Z", "2023-03-02T04:00Z", "2023-03-01T23:30Z", "2023-03-02T00:30Z")
+        self.assertEqual(slots[:2], [[datetime.time(23, 30), datetime.time(0, 30), 1], [datetime.time(2), datetime.time(4), 1]])
+        self.assertEqual(slots[2], [datetime.time(0), datetime.time(0), 0])
+
+    def test_overlap_drops_the_later_slot(self):
+        slots, out = self.set_charging("2023-03-01T02:00Z", "2023-03-01T04:00Z", "2023-03-02T03:00Z", "2023-03-02T03:30Z",
+                                       "2023-03-02T05:00Z", "2023-03-02T06:00Z")
+        self.assertIn("dropping charge slot 03:00-03:30", out)
+        self.assertEqual(slots, [[datetime.time(2), datetime.time(4), 1], [datetime.time(5), datetime.time(6), 1], [datetime.time(0), datetime.time(0), 0]])
+
+    def test_misaligned_slots_leave_the_inverter_alone(self):
+        slots, out = self.set_charging("2023-03-01T02:10Z", "2023-03-01T04:00Z")
+        self.assertIn("leaving the inverter's charge slots as they are", out)
+        self.assertEqual(slots[0], [datetime.time(7), datetime.time(8), 1])
+
+    def test_too_many_slots_keeps_the_earliest(self):
+        times = [f"2023-03-01T{hour:02}:{minute}Z" for hour in range(0, 16, 2) for minute in ("00", "30")]
+        slots, out = self.set_charging(*times)
+        self.assertEqual(out.count("Warning"), 1)
+        self.assertEqual(slots, [[datetime.time(0), datetime.time(0, 30), 1], [datetime.time(2), datetime.time(2, 30), 1], [datetime.time(4), datetime.time(4, 30), 1]])
+
+
+class TestFleet(unittest.TestCase):
+    def setUp(self):
+        # Let program_inverter read and write, like it would with pymodbus installed
+        self.modbus = agile_prices.MODBUS
+        agile_prices.MODBUS = True
+
+    def tearDown(self):
+        agile_prices.MODBUS = self.modbus
+
+    def test_program_in_parallel(self):
+        fakes = FakeFleet(FakeInverter("ew11-1", delay=0.1), FakeInverter("ew11-2", holding={1091: 80}, delay=0.1))
+        members = [Member("ew11-1", None, 6), Member("ew11-2", 13, 5)]
+        started = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = fleet.program(members, lambda slots_available: {1091: 80}, dummy=False, connect_fn=fakes)
+        # One read and one write on ew11-1, one read on ew11-2, at the same time
+        self.assertLess(time.monotonic() - started, 0.28)
+        self.assertEqual(list(results), ["ew11-1", "ew11-2"])
+        self.assertEqual(results["ew11-1"].value, [(1091, [80])])
+        self.assertEqual(results["ew11-2"].value, [])
+        self.assertEqual(fakes.inverters["ew11-1"].writes, [(1091, [80])])
+        self.assertTrue(all(inverter.closed for inverter in fakes.inverters.values()))
+
+    def test_one_failure_doesnt_stop_the_rest(self):
+        fakes = FakeFleet(FakeInverter("ew11-1", broken=True), FakeInverter("ew11-2"))
+        members = [Member("ew11-1", None, 6), Member("ew11-2", None, 5)]
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            results = fleet.program(members, lambda slots_available: agile_prices.charge_slot_registers([], slots_available), dummy=False, connect_fn=fakes)
+            self.assertFalse(fleet.report(results, "programmed"))
+        self.assertIsInstance(results["ew11-1"].error, InverterError)
+        self.assertIn("ew11-2: programmed", out.getvalue())
+        # Every register ew11-2 owns was already zero, so nothing to write
+        self.assertEqual(fakes.inverters["ew11-2"].writes, [])
+
+    def test_status(self):
+        fakes = FakeFleet(FakeInverter("ew11-1", inputs={1014: 50, 1110: 2}, holding={1091: 90, 1100: 0x0100, 1101: 0x0300, 1102: 1}),
+                          FakeInverter("ew11-2", inputs={1014: 20}))
+        results = fleet.status([Member("ew11-1", None, 6), Member("ew11-2", 10, 6)], connect_fn=fakes)
+        self.assertEqual(results["ew11-1"].value['battery_size'], 13)
+        self.assertEqual(results["ew11-1"].value['battery_kwh'], 6.5)
+        self.assertEqual(len(results["ew11-1"].value['charge_slots']), 1)
+        self.assertEqual(results["ew11-2"].value['battery_kwh'], 2)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            fleet.print_status(results)
+        self.assertIn("ew11-1: 50% of 13.0kWh, charging to 90% in 01:00-03:00", out.getvalue())
+        self.assertIn("Total: 8.5kWh", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
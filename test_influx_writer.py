@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import tempfile
+
+import pandas as pd
+
+import influx_writer
+from influx_writer import InfluxWriter
+
+
+class FakeResponse:
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+
+
+class FakeSession:
+    def __init__(self, down=False):
+        self.down = down
+        self.posts = []
+
+    def post(self, url, params=None, headers=None, data=None, timeout=None):
+        if self.down:
+            raise OSError("Connection refused")
+        self.posts.append(data.decode().split("\n"))
+        return FakeResponse(204)
+
+
+def fixture_prices(values, start="2023-03-28T00:00:00Z"):
+    start_time = pd.date_range(start, periods=len(values), freq="30min")
+    return pd.DataFrame({'start_time': start_time, 'end_time': start_time + pd.Timedelta('30m'), 'value_inc_vat': values})
+
+
+class TestLineProtocol(unittest.TestCase):
+    def test_same_as_the_dataframe_writer(self):
+        lines = influx_writer.price_lines(fixture_prices([12.3, -1.5]))
+        self.assertEqual(lines[0], ("agile_prices 1679961600000000000",
+                                    'agile_prices end_time="2023-03-28 00:30:00+00:00",value_inc_vat=12.3 1679961600000000000'))
+        self.assertTrue(lines[1][1].endswith("value_inc_vat=-1.5 1679963400000000000"))
+
+    def test_escaping(self):
+        key, value = influx_writer.line("a b", {'n,x': 1, 'ok': True, 's': 'say "hi"'}, 5, tags={'t': 'x=y'})
+        self.assertEqual(value, 'a\\ b,t=x\\=y n\\,x=1i,ok=true,s="say \\"hi\\"" 5')
+
+
+class TestInfluxWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.spool_dir = os.path.join(self.tmp.name, "spool")
+        # Recent timestamps so that they aren't forgotten straight away
+        self.prices = fixture_prices([float(i) for i in range(48)], start=pd.Timestamp.utcnow().floor('D'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def writer(self, session, **kwargs):
+        return InfluxWriter("http://influx:8086/", "token", "org", "bucket", spool_dir=self.spool_dir, linger_seconds=0.01, session=session, **kwargs)
+
+    def test_batches(self):
+        session = FakeSession()
+        with self.writer(session, batch_size=20) as writer:
+            self.assertEqual(writer.write(influx_writer.price_lines(self.prices)), 48)
+        self.assertEqual([len(post) for post in session.posts], [20, 20, 8])
+
+    def test_points_are_only_written_once(self):
+        session = FakeSession()
+        with self.writer(session) as writer:
+            writer.write(influx_writer.price_lines(self.prices))
+            writer.flush()
+            self.assertEqual(writer.write(influx_writer.price_lines(self.prices)), 0)
+        # And it's remembered for the next run
+        changed = self.prices.copy()
+        changed.loc[3, 'value_inc_vat'] = 99.0
+        with self.writer(session) as writer:
+            self.assertEqual(writer.write(influx_writer.price_lines(changed)), 1)
+        self.assertEqual([len(post) for post in session.posts], [48, 1])
+
+    def test_failed_batches_are_spooled_and_replayed(self):
+        session = FakeSession(down=True)
+        with self.writer(session) as writer:
+            writer.write(influx_writer.price_lines(self.prices))
+        self.assertEqual(len(os.listdir(self.spool_dir)), 1)
+        session.down = False
+        with self.writer(session) as writer:
+            writer.flush()
+        self.assertEqual([len(post) for post in session.posts], [48])
+        self.assertEqual(os.listdir(self.spool_dir), ["written.json"])
+
+    def spool_files(self, prefix):
+        return [name for name in os.listdir(self.spool_dir) if name.startswith(prefix)]
+
+    def test_influx_errors(self):
+        class Failing(FakeSession):
+            status_code = 503
+
+            def post(self, *args, **kwargs):
+                return FakeResponse(self.status_code, "no")
+        session = Failing()
+        for session.status_code in (503, 429):
+            with self.writer(session) as writer:
+                writer.write(influx_writer.price_lines(self.prices.head(2)))
+        self.assertEqual(len(self.spool_files("batch-")), 2)
+        # Trying a bad batch again won't help, so it's put aside, and so are the spooled ones when they're replayed
+        session.status_code = 401
+        with self.writer(session) as writer:
+            writer.write(influx_writer.price_lines(self.prices.tail(2)))
+        self.assertEqual(self.spool_files("batch-"), [])
+        self.assertEqual(len(self.spool_files("rejected-")), 3)
+
+    def test_rejected_spooled_batches_dont_hold_up_the_rest(self):
+        class Picky(FakeSession):
+            def post(self, url, params=None, headers=None, data=None, timeout=None):
+                if not self.down and b"value_inc_vat=0.0 " in data:
+                    return FakeResponse(400, "partial write: field type conflict")
+                return super().post(url, params, headers, data, timeout)
+        session = Picky(down=True)
+        with self.writer(session, batch_size=2) as writer:
+            writer.write(influx_writer.price_lines(self.prices.head(6)))
+        self.assertEqual(len(self.spool_files("batch-")), 3)
+        session.down = False
+        with self.writer(session) as writer:
+            writer.flush()
+        self.assertEqual([len(post) for post in session.posts], [2, 2])
+        self.assertEqual(self.spool_files("batch-"), [])
+        self.assertEqual(len(self.spool_files("rejected-")), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from inverter import Inverter, InverterError
+
+
+class FakeResult:
+    def __init__(self, registers=None, error=False):
+        self.registers = registers
+        self.error = error
+
+    def isError(self):
+        return self.error
+
+
+class FakeModbusClient:
+    # Looks enough like a ModbusTcpClient.  Holding and input registers share one address space here.
+    def __init__(self, fail_next=0):
+        self.registers = {}
+        self.open = False
+        self.connects = 0
+        self.fail_next = fail_next
+
+    def connect(self):
+        self.connects += 1
+        self.open = True
+        return True
+
+    def is_socket_open(self):
+        return self.open
+
+    def close(self):
+        self.open = False
+
+    def read(self, address, count, slave=1):
+        if self.fail_next:
+            self.fail_next -= 1
+            self.open = False
+            raise OSError("Connection reset by peer")
+        return FakeResult([self.registers.get(address + i, 0) for i in range(count)])
+
+    read_holding_registers = read
+    read_input_registers = read
+
+    def write_registers(self, address, values, slave=1):
+        for i, value in enumerate(values):
+            self.registers[address + i] = value
+        return FakeResult()
+
+
+class TestInverter(unittest.TestCase):
+    def test_one_connection_for_many_requests(self):
+        client = FakeModbusClient()
+        inverter = Inverter("fake", client=client)
+        inverter.write_registers(1100, [1, 2, 3])
+        self.assertEqual(inverter.read_holding_registers(1100, 3), [1, 2, 3])
+        self.assertEqual(inverter.read_input_registers(1014), [0])
+        self.assertEqual(client.connects, 1)
+
+    def test_reconnects_after_failure(self):
+        client = FakeModbusClient(fail_next=1)
+        client.registers[1014] = 57
+        inverter = Inverter("fake", client=client)
+        self.assertEqual(inverter.read_input_registers(1014, 1), [57])
+        self.assertEqual(client.connects, 2)
+
+    def test_gives_up_eventually(self):
+        inverter = Inverter("fake", retries=2, client=FakeModbusClient(fail_next=3))
+        with self.assertRaises(InverterError):
+            inverter.read_input_registers(1014, 1)
+
+    def test_read_u32(self):
+        client = FakeModbusClient()
+        client.registers[1062] = 1
+        client.registers[1063] = 2
+        self.assertEqual(Inverter("fake", client=client).read_input_u32(1062), 65538)
+
+
+if __name__ == "__main__":
+    unittest.main()
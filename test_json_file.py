@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import tempfile
+
+from json_file import read_json, write_json
+
+
+class TestJsonFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "a", "b.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        write_json(self.path, {'x': [1, 2]})
+        self.assertEqual(read_json(self.path), {'x': [1, 2]})
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_missing_or_mangled_gives_the_default(self):
+        self.assertEqual(read_json(self.path, {}), {})
+        write_json(self.path, {})
+        with open(self.path, "w") as fp:
+            fp.write("{not json")
+        self.assertEqual(read_json(self.path, []), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
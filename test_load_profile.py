@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import datetime
+import tempfile
+
+import numpy as np
+
+import load_profile
+import telemetry
+
+MONDAY = 1682899200 # 2023-05-01 00:00 UTC, 01:00 BST
+DAY = 86400
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+def history(days, kwh_fn, start=MONDAY):
+    # kwh_fn(days since start, local day of the week * 48 + half hour) for each half hour of days days
+    starts = start + load_profile.HALF_HOUR * np.arange(days * 48)
+    cells = load_profile.local_cells(starts)
+    return starts, np.array([kwh_fn(i // 48, cell) for i, cell in enumerate(cells)])
+
+
+class TestLoadProfile(unittest.TestCase):
+    def test_local_cells(self):
+        # Midnight UTC on a Monday in May is 01:00 BST
+        self.assertEqual(list(load_profile.local_cells([MONDAY, MONDAY + 1800, MONDAY - 7200])), [2, 3, 6 * 48 + 46])
+
+    def test_weekday_profile(self):
+        # Weekends use more
+        starts, kwh = history(14, lambda day, cell: 0.5 if cell // 48 >= 5 else 0.2)
+        profile = load_profile.build_profile(starts, kwh, now=MONDAY + 14 * DAY)
+        self.assertEqual(profile.shape, (7, 48))
+        np.testing.assert_allclose(profile[:5], 0.2)
+        np.testing.assert_allclose(profile[5:], 0.5)
+
+    def test_recent_weeks_count_for_more(self):
+        starts, kwh = history(14, lambda day, cell: 0.2 if day < 7 else 0.4)
+        profile = load_profile.build_profile(starts, kwh, now=MONDAY + 14 * DAY, half_life_days=7)
+        # The second week has twice the weight of the first
+        np.testing.assert_allclose(profile, (0.2 + 2 * 0.4) / 3)
+
+    def test_quantile(self):
+        starts, kwh = history(35, lambda day, cell: 1.0 if day == 0 else 0.2)
+        profile = load_profile.build_profile(starts, kwh, now=MONDAY + 35 * DAY, half_life_days=1000, quantile=0.5)
+        np.testing.assert_allclose(profile, 0.2)
+        profile = load_profile.build_profile(starts, kwh, now=MONDAY + 35 * DAY, half_life_days=1000, quantile=0.9)
+        self.assertAlmostEqual(profile[0, 10], 1.0)
+
+    def test_gaps_are_filled(self):
+        # Only Mondays
+        starts, kwh = history(1, lambda day, cell: cell % 48 / 100)
+        profile = load_profile.build_profile(starts, kwh)
+        np.testing.assert_allclose(profile[3], profile[0])
+        self.assertIsNone(load_profile.build_profile([], []))
+
+    def test_expected_load(self):
+        profile = np.tile(np.arange(48) / 100, (7, 1))
+        load = load_profile.expected_load(profile, utc(2023, 5, 1, 18, 10))
+        self.assertEqual(len(load), 48)
+        # 18:00 UTC is 19:00 BST, half hour 38 of the day
+        self.assertAlmostEqual(load[0], 0.38)
+        self.assertAlmostEqual(load[10], 0.0)
+
+    def test_slot_cells(self):
+        # Either side of and across both clock changes, same as converting every time with pandas
+        for first in (MONDAY, utc(2023, 3, 25, 12).timestamp(), utc(2023, 10, 28, 22, 30).timestamp()):
+            first = int(first)
+            self.assertEqual(list(load_profile.slot_cells(first, 96)), list(load_profile.local_cells(first + load_profile.HALF_HOUR * np.arange(96))))
+
+    def test_from_consumption(self):
+        starts, kwh = load_profile.from_consumption([{'consumption': 0.25, 'interval_start': '2023-05-01T01:00:00+01:00', 'interval_end': '2023-05-01T01:30:00+01:00'}])
+        self.assertEqual(list(starts), [MONDAY])
+        self.assertEqual(list(kwh), [0.25])
+
+
+class TestLoadForecast(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "telemetry.bin")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_days(self, days, load_w):
+        records = np.zeros(days * 48, dtype=telemetry.RECORD)
+        records['start'] = MONDAY + load_profile.HALF_HOUR * np.arange(days * 48)
+        records['samples'] = 360
+        records['load_w'] = load_w
+        telemetry.append_records(self.path, records)
+
+    def test_needs_enough_history(self):
+        self.write_days(2, 1000)
+        self.assertIsNone(load_profile.load_forecast(utc(2023, 5, 3), self.path))
+
+    def test_from_telemetry(self):
+        self.write_days(7, 1000)
+        load = load_profile.load_forecast(utc(2023, 5, 8, 18), self.path)
+        np.testing.assert_allclose(load, np.full(48, 0.5))
+
+    def test_from_archive(self):
+        self.write_days(7, 1000)
+        archive = telemetry.get_archive(self.tmp.name)
+        archive.append(telemetry.read_half_hours(self.path))
+        now = utc(2023, 5, 8, 18)
+        np.testing.assert_allclose(load_profile.load_forecast(now, archive=archive), load_profile.load_forecast(now, self.path))
+        self.assertIsNone(load_profile.load_forecast(utc(2023, 5, 3), archive=archive))
+
+    def test_profile_is_only_built_once(self):
+        self.write_days(7, 1000)
+        now = utc(2023, 5, 8, 18)
+        built = []
+        read_profile = load_profile.read_profile
+
+        def counting(*args):
+            built.append(args)
+            return read_profile(*args)
+        load_profile.read_profile = counting
+        try:
+            first = load_profile.load_forecast(now, self.path)
+            np.testing.assert_array_equal(load_profile.load_forecast(now + datetime.timedelta(minutes=10), self.path), first)
+            self.assertEqual(len(built), 1)
+            # More telemetry, or the next half hour, and it's built again
+            self.write_days(1, 2000)
+            self.assertFalse(np.array_equal(load_profile.load_forecast(now, self.path), first))
+            load_profile.load_forecast(now + datetime.timedelta(minutes=30), self.path)
+            self.assertEqual(len(built), 3)
+        finally:
+            load_profile.read_profile = read_profile
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,8 @@ import json
 import os
 import copy
 
+import numpy as np
+
 from new_prices_thing import plan, calculation
 
 with open(os.path.join(os.path.dirname(__file__), "octopus_test_data.json")) as fp:
@@ -68,6 +70,10 @@ def get_two_free_period_octopus_data(start_time, end_time):
 
     return data
 
+def no_load_forecast(start_time):
+    # Use get_daily_load_fn rather than any telemetry on this machine
+    return None
+
 class TestBasic(unittest.TestCase):
     def test_basic(self):
         self.assertEqual(2, 2)
@@ -78,7 +84,8 @@ class TestPlan(unittest.TestCase):
         TOMORROW_SOLAR_FORECAST_KWH = 16
         plan_dict = plan(electricity_provider_fn=get_standard_octopus_data,
                          get_forecast_fn=lambda: TOMORROW_SOLAR_FORECAST_KWH,
-                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL)
+                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL,
+                         get_load_fn=no_load_forecast)
         self.assertEqual(len(plan_dict["free"]), 0)
         self.assertEqual(len(plan_dict["all"]), 48)
         self.assertEqual(len(plan_dict["less_than_gas"]), 0)
@@ -92,7 +99,8 @@ class TestPlan(unittest.TestCase):
         TOMORROW_SOLAR_FORECAST_KWH = 16
         plan_dict = plan(electricity_provider_fn=get_all_free_octopus_data,
                          get_forecast_fn=lambda: TOMORROW_SOLAR_FORECAST_KWH,
-                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL)
+                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL,
+                         get_load_fn=no_load_forecast)
         self.assertEqual(len(plan_dict["free"]), 48)
         self.assertEqual(len(plan_dict["all"]), 48)
         self.assertEqual(len(plan_dict["less_than_gas"]), 48)
@@ -106,7 +114,8 @@ class TestPlan(unittest.TestCase):
         TOMORROW_SOLAR_FORECAST_KWH = 16
         plan_dict = plan(electricity_provider_fn=get_all_cheap_octopus_data,
                          get_forecast_fn=lambda: TOMORROW_SOLAR_FORECAST_KWH,
-                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL)
+                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL,
+                         get_load_fn=no_load_forecast)
         self.assertEqual(len(plan_dict["free"]), 0)
         self.assertEqual(len(plan_dict["all"]), 48)
         self.assertEqual(len(plan_dict["less_than_gas"]), 48)
@@ -120,7 +129,8 @@ class TestPlan(unittest.TestCase):
         TOMORROW_SOLAR_FORECAST_KWH = 16
         plan_dict = plan(electricity_provider_fn=get_mixed_octopus_data,
                          get_forecast_fn=lambda: TOMORROW_SOLAR_FORECAST_KWH,
-                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL)
+                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL,
+                         get_load_fn=no_load_forecast)
         self.assertEqual(len(plan_dict["free"]), 16)
         self.assertEqual(len(plan_dict["all"]), 48)
         self.assertEqual(len(plan_dict["less_than_gas"]), 32)
@@ -135,7 +145,8 @@ class TestCalculations(unittest.TestCase):
         TOMORROW_SOLAR_FORECAST_KWH = 16
         plan_dict = plan(electricity_provider_fn=get_standard_octopus_data,
                          get_forecast_fn=lambda: TOMORROW_SOLAR_FORECAST_KWH,
-                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL)
+                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL,
+                         get_load_fn=no_load_forecast)
         calc_dict = calculation(plan_dict)
         self.assertEqual(len(calc_dict["battery_charge_slots"]), 4)
         self.assertEqual(len(calc_dict["hot_water_slots"]), 0)
@@ -143,12 +154,26 @@ class TestCalculations(unittest.TestCase):
         self.assertEqual(calc_dict["max_battery_charge_percent"], 36)
         self.assertEqual(len(plan_dict["all"]), 48)
 
+    def test_load_forecast_calculations(self):
+        CURRENT_BATTERY_PC_FULL = 1
+        TOMORROW_SOLAR_FORECAST_KWH = 16
+        # Still 20kWh a day, but 6kWh of it in two hours, which is what the powercut reserve has to cover
+        load_forecast = [1.5] * 4 + [14 / 44] * 44
+        plan_dict = plan(electricity_provider_fn=get_standard_octopus_data,
+                         get_forecast_fn=lambda: TOMORROW_SOLAR_FORECAST_KWH,
+                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL,
+                         get_load_fn=lambda start_time: np.array(load_forecast))
+        self.assertAlmostEqual(plan_dict["daily_load"], 20)
+        calc_dict = calculation(plan_dict)
+        self.assertEqual(calc_dict["max_battery_charge_percent"], 70)
+
     def test_all_free_calculations(self):
         CURRENT_BATTERY_PC_FULL = 1
         TOMORROW_SOLAR_FORECAST_KWH = 16
         plan_dict = plan(electricity_provider_fn=get_all_free_octopus_data,
                          get_forecast_fn=lambda: TOMORROW_SOLAR_FORECAST_KWH,
-                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL)
+                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL,
+                         get_load_fn=no_load_forecast)
         calc_dict = calculation(plan_dict)
         self.assertEqual(len(calc_dict["battery_charge_slots"]), 48)
         self.assertEqual(len(calc_dict["hot_water_slots"]), 48)
@@ -162,7 +187,8 @@ class TestCalculations(unittest.TestCase):
         TOMORROW_SOLAR_FORECAST_KWH = 16
         plan_dict = plan(electricity_provider_fn=get_two_free_period_octopus_data,
                          get_forecast_fn=lambda: TOMORROW_SOLAR_FORECAST_KWH,
-                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL)
+                         get_battery_charge_fn=lambda: CURRENT_BATTERY_PC_FULL,
+                         get_load_fn=no_load_forecast)
         calc_dict = calculation(plan_dict)
         self.assertEqual(len(calc_dict["battery_charge_slots"]), 9)
         self.assertEqual(len(calc_dict["hot_water_slots"]), 9)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import os
+import copy
+import datetime
+
+import octopus_api
+
+with open(os.path.join(os.path.dirname(__file__), "octopus_test_data.json")) as fp:
+    OCTOPUS_DATA = json.load(fp)
+
+
+class FakeResponse:
+    def __init__(self, page):
+        self.status_code = 200
+        self.page = page
+        self.text = json.dumps(page)
+        self.content = self.text.encode()
+
+    def json(self):
+        return self.page
+
+
+class FakePagedSession:
+    # Splits the test data in to pages of 20 with "next" links between them, like the real API does
+    def __init__(self, page_size=20):
+        results = copy.deepcopy(OCTOPUS_DATA)["results"]
+        self.pages = [results[i:i + page_size] for i in range(0, len(results), page_size)]
+        self.requested = []
+
+    def get(self, url, params=None):
+        self.requested.append((url, params))
+        index = int(url.split("page=")[1]) if "page=" in url else 0
+        next_url = f"https://example.invalid/?page={index + 1}" if index + 1 < len(self.pages) else None
+        return FakeResponse({"count": 48, "next": next_url, "previous": None, "results": self.pages[index]})
+
+
+class TestPagination(unittest.TestCase):
+    def test_follows_next_links(self):
+        session = FakePagedSession()
+        prices_dict = octopus_api.fetch_unit_rates("2023-03-28T00:00:00Z", "2023-03-29T00:00:00Z", session=session)
+        self.assertEqual(len(session.requested), 3)
+        self.assertEqual(len(prices_dict["results"]), 48)
+        self.assertEqual(prices_dict["results"], OCTOPUS_DATA["results"])
+        # Only the first request carries our parameters, the next links already have them
+        self.assertIsNotNone(session.requested[0][1])
+        self.assertIsNone(session.requested[1][1])
+
+    def test_raw_pages(self):
+        session = FakePagedSession()
+        pages = list(octopus_api.iter_unit_rate_pages("2023-03-28T00:00:00Z", session=session, raw=True))
+        self.assertEqual(len(pages), 3)
+        self.assertIsInstance(pages[0], bytes)
+        self.assertEqual(len(octopus_api.history_dataframe(pages)), 48)
+
+
+class TestHistory(unittest.TestCase):
+    def test_split_range(self):
+        start = datetime.datetime(2023, 1, 1)
+        chunks = octopus_api.split_range(start, datetime.datetime(2024, 1, 1), chunk_days=28)
+        self.assertEqual(len(chunks), 14)
+        self.assertEqual(chunks[0][0], start)
+        self.assertEqual(chunks[-1][1], datetime.datetime(2024, 1, 1))
+        for a, b in zip(chunks, chunks[1:]):
+            self.assertEqual(a[1], b[0])
+
+    def test_history_dataframe_from_pages(self):
+        results = OCTOPUS_DATA["results"]
+        # Overlapping, out of order pages like we get back from the thread pool
+        pages = [results[20:], results[:21]]
+        prices = octopus_api.history_dataframe(pages)
+        self.assertEqual(len(prices), 48)
+        self.assertTrue(prices.start_time.is_monotonic_increasing)
+        self.assertEqual(prices.iloc[0].start_time.isoformat(), "2023-03-28T00:00:00+00:00")
+
+
+class FakeRegionSession:
+    # Region B is a penny dearer than A and so on, one page each
+    def __init__(self):
+        self.requested = []
+
+    def get(self, url, params=None):
+        self.requested.append(url)
+        region = url.rstrip("/").split("/")[-2][-1]
+        results = copy.deepcopy(OCTOPUS_DATA)["results"]
+        for x in results:
+            x["value_inc_vat"] += octopus_api.REGIONS.index(region)
+        return FakeResponse({"count": 48, "next": None, "previous": None, "results": results})
+
+
+class TestRegions(unittest.TestCase):
+    def test_parse_tariff(self):
+        self.assertEqual(octopus_api.parse_tariff("A"), (octopus_api.PRODUCT_CODE, octopus_api.TARIFF_CODE))
+        self.assertEqual(octopus_api.parse_tariff("n"), ("AGILE-FLEX-22-11-25", "E-1R-AGILE-FLEX-22-11-25-N"))
+        self.assertEqual(octopus_api.parse_tariff("E-1R-AGILE-24-10-01-C"), ("AGILE-24-10-01", "E-1R-AGILE-24-10-01-C"))
+        for bad in ("I", "Z", "AGILE", "E-1R-A"):
+            with self.assertRaises(ValueError):
+                octopus_api.parse_tariff(bad)
+
+    def test_fetch_tariffs(self):
+        session = FakeRegionSession()
+        prices = octopus_api.fetch_tariffs(["C", "A", "E-1R-AGILE-FLEX-22-11-25-B"], "2023-03-28T00:00:00Z", use_cache=False, session=session)
+        self.assertEqual(list(prices), ["E-1R-AGILE-FLEX-22-11-25-C", "E-1R-AGILE-FLEX-22-11-25-A", "E-1R-AGILE-FLEX-22-11-25-B"])
+        self.assertEqual(len(session.requested), 3)
+        self.assertAlmostEqual(prices["E-1R-AGILE-FLEX-22-11-25-C"]["results"][0]["value_inc_vat"], OCTOPUS_DATA["results"][0]["value_inc_vat"] + 2)
+
+    def test_pooled_session(self):
+        with octopus_api.pooled_session(4) as session:
+            self.assertEqual(session.get_adapter("https://api.octopus.energy/v1")._pool_maxsize, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import itertools
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+import optimiser
+import agile_prices
+from backtest import octopus_results
+
+
+def count_runs(chosen, contiguous):
+    runs = 0
+    for n, i in enumerate(chosen):
+        if n == 0 or chosen[n - 1] != i - 1 or not contiguous[i]:
+            runs += 1
+    return runs
+
+
+def brute_force(values, slots_needed, max_runs, contiguous):
+    # Cheapest cost over every possible choice of slots
+    best = None
+    for chosen in itertools.combinations(range(len(values)), slots_needed):
+        if count_runs(chosen, contiguous) > max_runs:
+            continue
+        cost = sum(values[i] for i in chosen)
+        if best is None or cost < best:
+            best = cost
+    return best
+
+
+def half_hours(values, start="2023-03-28T00:00:00Z"):
+    start_time = pd.date_range(start, periods=len(values), freq="30min")
+    return pd.DataFrame({'start_time': start_time, 'end_time': start_time + pd.Timedelta('30m'),
+                         'value_inc_vat': values, 'duration': pd.Timedelta('30m')})
+
+
+class TestOptimiseRuns(unittest.TestCase):
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        for case in range(150):
+            n = int(rng.integers(1, 11))
+            values = np.round(rng.normal(20, 10, n), 0)
+            contiguous = rng.random(n) > 0.2
+            slots_needed = int(rng.integers(1, n + 1))
+            max_runs = int(rng.integers(1, 4))
+            chosen = optimiser.optimise_runs(values, slots_needed, max_runs, contiguous)
+            expected = brute_force(values, slots_needed, max_runs, contiguous)
+            if expected is None:
+                self.assertIsNone(chosen)
+                continue
+            self.assertEqual(len(chosen), slots_needed)
+            self.assertLessEqual(count_runs(list(chosen), contiguous), max_runs)
+            self.assertAlmostEqual(values[chosen].sum(), expected)
+
+    def test_cheapest_slots_when_they_fit(self):
+        values = [30, 5, 6, 30, 30, 4, 7, 30]
+        self.assertEqual(list(optimiser.optimise_runs(values, 4, 2)), [1, 2, 5, 6])
+
+    def test_fewer_runs_than_cheap_patches(self):
+        # The four cheapest are in four separate places, but we only have two slots on the inverter
+        values = [1, 50, 2, 60, 3, 4, 60, 5]
+        self.assertEqual(list(optimiser.optimise_runs(values, 4, 2)), [0, 1, 2, 4])
+
+    def test_impossible(self):
+        self.assertIsNone(optimiser.optimise_runs([1, 2], 3, 1))
+        self.assertIsNone(optimiser.optimise_runs([1, 2, 3], 2, 1, contiguous=[True, False, False]))
+        self.assertEqual(len(optimiser.optimise_runs([1, 2], 0, 1)), 0)
+
+
+class TestCheapestChargeSlots(unittest.TestCase):
+    def test_slots_for_energy(self):
+        self.assertEqual(optimiser.slots_for_energy(2.7, 2.7), 2)
+        self.assertEqual(optimiser.slots_for_energy(2.8, 2.7), 3)
+        self.assertEqual(optimiser.slots_for_energy(-1, 2.7), 0)
+
+    def test_fits_in_runs(self):
+        # Sorting by price would pick 0, 2 and 4, which is three runs
+        prices = half_hours([1, 9, 2, 50, 3, 50, 4])
+        slots = optimiser.cheapest_charge_slots(prices, 4, 2.7, 1)
+        self.assertEqual(list(slots.index), [0, 1, 2])
+
+    def test_window_and_gaps(self):
+        prices = half_hours([10, 1, 1, 10, 2, 2, 10, 10]).drop(index=[3])
+        start_time = prices.start_time.iloc[1]
+        deadline = prices.end_time.iloc[-2]
+        # Slots 2 and 4 look neighbouring once 3 is gone but there's an hour between them
+        slots = optimiser.cheapest_charge_slots(prices, 0, 2.7, 1, start_time, deadline, slots_needed=3)
+        self.assertEqual(list(slots.index), [4, 5, 6])
+
+    def test_prices_use_the_current_settings(self):
+        prices = half_hours([1, 9, 2, 50, 3, 50, 4, 60, 60, 60, 60, 60], start=pd.Timestamp("2023-03-28", tz="UTC"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            p = agile_prices.Prices(prices_dict=octopus_results(prices))
+        saved = agile_prices.max_charge_slots, agile_prices.max_ac_charge_rate
+        try:
+            agile_prices.max_charge_slots = 1
+            self.assertEqual(list(p.get_charge_slots(4).start_time), list(prices.start_time[:3]))
+            agile_prices.max_charge_slots, agile_prices.max_ac_charge_rate = 6, 4
+            self.assertEqual(list(p.get_charge_slots(4).start_time), list(prices.start_time[[0, 2]]))
+        finally:
+            agile_prices.max_charge_slots, agile_prices.max_ac_charge_rate = saved
+
+    def test_not_enough_slots(self):
+        prices = half_hours([3, 2, 1])
+        self.assertEqual(len(optimiser.cheapest_charge_slots(prices, 100, 2.7, 6)), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import io
+import datetime
+import tempfile
+import contextlib
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import plan_cache
+import agile_prices
+import backtest
+
+
+def prices_frame(start="2023-03-01 18:00", slots=48, seed=0):
+    rng = np.random.default_rng(seed)
+    start_time = pd.date_range(start, periods=slots, freq="30min", tz="UTC")
+    prices = pd.DataFrame({'start_time': start_time, 'end_time': start_time + pd.Timedelta('30m'),
+                           'value_inc_vat': np.round(rng.normal(25, 8, slots), 2)})
+    prices['duration'] = prices.end_time - prices.start_time
+    return prices
+
+
+def hashes(prices):
+    return plan_cache.series_hashes(prices.start_time.values.view('i8'), prices.value_inc_vat.to_numpy(dtype=float))
+
+
+class TestHashes(unittest.TestCase):
+    def test_tail_of_the_same_prices(self):
+        prices = prices_frame()
+        full = hashes(prices)
+        self.assertEqual(len(full), 48)
+        # Half an hour later the first slot has gone, but the rest hash the same
+        self.assertEqual(hashes(prices.iloc[1:]), full[1:])
+        changed = prices.copy()
+        changed.loc[40, 'value_inc_vat'] += 1
+        self.assertNotIn(hashes(changed.iloc[1:])[0], full)
+        # More prices published moves every hash
+        self.assertNotIn(hashes(prices_frame(slots=60))[0], full)
+
+    def test_bucket(self):
+        self.assertEqual(plan_cache.bucket(47, 5), 45)
+        self.assertEqual(plan_cache.bucket(48, 5), 50)
+        self.assertEqual(plan_cache.bucket(3.3, 0.5), 3.5)
+        self.assertIsNone(plan_cache.bucket(None, 5))
+
+
+class TestPlanCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = self.make_cache()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def make_cache(self, **kwargs):
+        return plan_cache.PlanCache(os.path.join(self.dir.name, "plans.json"), os.path.join(self.dir.name, "programmed.json"), **kwargs)
+
+    def test_get_and_put(self):
+        full = hashes(prices_frame())
+        key = plan_cache.inputs_key(soc=50, daily_kwh=12.5)
+        plan = {'max_soc': 60, 'slots': [["2023-03-02T01:00:00+00:00", "2023-03-02T03:00:00+00:00"]]}
+        self.assertIsNone(self.cache.get(full[0], key))
+        self.cache.put(full, key, plan)
+        self.assertEqual(self.cache.get(full[5], key), plan)
+        self.assertIsNone(self.cache.get(full[5], plan_cache.inputs_key(soc=55, daily_kwh=12.5)))
+        # It's on disk
+        self.assertEqual(self.make_cache().get(full[0], key), plan)
+
+    def test_oldest_go_first(self):
+        cache = self.make_cache(max_plans=2)
+        for seed in range(3):
+            cache.put(hashes(prices_frame(seed=seed)), "key", {'max_soc': seed, 'slots': []})
+        self.assertEqual([entry['plan']['max_soc'] for entry in cache.plans], [1, 2])
+
+    def test_programmed(self):
+        plan = {'max_soc': 60, 'slots': []}
+        self.assertFalse(self.cache.is_programmed(plan, "ew11-1"))
+        self.cache.mark_programmed(plan, "ew11-1")
+        self.assertTrue(self.cache.is_programmed(plan, "ew11-1"))
+        self.assertFalse(self.cache.is_programmed(plan, "ew11-2"))
+        self.assertFalse(self.cache.is_programmed({'max_soc': 70, 'slots': []}, "ew11-1"))
+        self.cache.forget_programmed()
+        self.assertFalse(self.cache.is_programmed(plan, "ew11-1"))
+
+
+class TestNewAutoCharge(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = plan_cache.PlanCache(os.path.join(self.dir.name, "plans.json"), os.path.join(self.dir.name, "programmed.json"))
+        self.saved = agile_prices.MODBUS, agile_prices.inverter, agile_prices.battery_size, plan_cache.PROGRAMMED_PATH
+        # Nothing here should touch the real record of what's programmed, but just in case
+        plan_cache.PROGRAMMED_PATH = os.path.join(self.dir.name, "default_programmed.json")
+        agile_prices.MODBUS = True
+        agile_prices.battery_size = None
+
+    def tearDown(self):
+        agile_prices.MODBUS, agile_prices.inverter, agile_prices.battery_size, plan_cache.PROGRAMMED_PATH = self.saved
+        self.dir.cleanup()
+
+    def run_planner(self, prices, now, soc):
+        fake = backtest.FakeInverter(now, soc, load_kwh=12)
+        agile_prices.inverter = fake
+        day_prices = agile_prices.Prices(prices_dict=backtest.octopus_results(prices))
+        agile_prices.new_auto_charge(day_prices, dummy=False, now=now, get_forecast_fn=lambda: 2, get_load_fn=backtest.no_load_forecast, cache=self.cache)
+        return fake
+
+    def test_second_run_leaves_the_inverter_alone(self):
+        prices = prices_frame()
+        now = datetime.datetime(2023, 3, 1, 18, tzinfo=datetime.timezone.utc)
+        with contextlib.redirect_stdout(io.StringIO()) as out, warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            first = self.run_planner(prices, now, soc=40)
+            self.assertGreater(first.writes, 0)
+            # Ten minutes later with the SOC in the same bucket
+            again = self.run_planner(prices, now + datetime.timedelta(minutes=10), soc=41)
+            self.assertEqual(again.writes, 0)
+            self.assertIn("using the plan from then", out.getvalue())
+            # Half an hour later, the same prices less one.  That's planned again, but comes out the same.
+            second = self.run_planner(prices.iloc[1:].reset_index(drop=True), now + datetime.timedelta(minutes=30), soc=41)
+            self.assertEqual(second.writes, 0)
+            self.assertIn("already on the inverter", out.getvalue())
+            # Programming anything else means the plan has to go on again
+            agile_prices.zero_charging_slots(dummy=False, cache=self.cache)
+            third = self.run_planner(prices.iloc[1:].reset_index(drop=True), now + datetime.timedelta(minutes=30), soc=41)
+            self.assertGreater(third.writes, 0)
+            # A different SOC is worked out again
+            self.run_planner(prices.iloc[1:].reset_index(drop=True), now + datetime.timedelta(minutes=30), soc=20)
+        self.assertEqual(len(self.cache.plans), 3)
+
+    def test_later_runs_dont_reuse_old_slots(self):
+        prices = prices_frame()
+        now = datetime.datetime(2023, 3, 1, 18, tzinfo=datetime.timezone.utc)
+        later = now + datetime.timedelta(hours=8)
+        with contextlib.redirect_stdout(io.StringIO()) as out, warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.run_planner(prices, now, soc=40)
+            first = self.cache.plans[-1]['plan']['slots']
+            # The prices from then on are the tail of the ones the first plan was made from
+            self.run_planner(prices.iloc[16:].reset_index(drop=True), later, soc=40)
+        self.assertTrue(any(pd.Timestamp(end) <= later for start, end in first))
+        self.assertNotIn("using the plan from then", out.getvalue())
+        self.assertEqual(len(self.cache.plans), 2)
+        self.assertTrue(all(pd.Timestamp(end) > later for start, end in self.cache.plans[-1]['plan']['slots'] or []))
+
+    def test_writes_without_the_cache_leave_it_alone(self):
+        # Like backtest.py, which programs a fake inverter
+        plan = {'max_soc': 60, 'slots': []}
+        self.cache.mark_programmed(plan, agile_prices.inverter_addr)
+        agile_prices.inverter = backtest.FakeInverter(datetime.datetime(2023, 3, 1, 18, tzinfo=datetime.timezone.utc), 40, load_kwh=12)
+        with contextlib.redirect_stdout(io.StringIO()):
+            agile_prices.zero_charging_slots(dummy=False)
+            agile_prices.program_plan({'max_soc': 70, 'slots': None}, dummy=False)
+        self.assertTrue(self.cache.is_programmed(plan, agile_prices.inverter_addr))
+        self.assertFalse(os.path.exists(plan_cache.PROGRAMMED_PATH))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import os
+import copy
+import tempfile
+
+import price_cache
+
+with open(os.path.join(os.path.dirname(__file__), "octopus_test_data.json")) as fp:
+    OCTOPUS_DATA = json.load(fp)
+
+START = "2023-03-28T00:00:00Z"
+END = "2023-03-29T00:00:00Z"
+
+
+class FakeOctopus:
+    # Hands out slots from the test data and remembers what it was asked for
+    def __init__(self):
+        self.calls = []
+
+    def fetch(self, period_from, period_to):
+        self.calls.append((period_from, period_to))
+        results = []
+        for item in copy.deepcopy(OCTOPUS_DATA)["results"]:
+            if item["valid_from"] < period_from:
+                continue
+            if period_to is not None and item["valid_from"] >= period_to:
+                continue
+            results.append(item)
+        return results
+
+
+class TestPriceCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = price_cache.PriceCache("E-1R-TEST-A", cache_dir=self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_empty_cache_fetches_whole_range(self):
+        octopus = FakeOctopus()
+        prices_dict = price_cache.get_unit_rates("E-1R-TEST-A", START, END, octopus.fetch, cache=self.cache)
+        self.assertEqual(octopus.calls, [(START, END)])
+        self.assertEqual(len(prices_dict["results"]), 48)
+        self.assertEqual(prices_dict["results"][0]["valid_from"], "2023-03-28T23:30:00Z")
+
+    def test_second_run_does_not_fetch(self):
+        price_cache.get_unit_rates("E-1R-TEST-A", START, END, FakeOctopus().fetch, cache=self.cache)
+        cache = price_cache.PriceCache("E-1R-TEST-A", cache_dir=self.tmp.name)
+        octopus = FakeOctopus()
+        prices_dict = price_cache.get_unit_rates("E-1R-TEST-A", START, END, octopus.fetch, cache=cache)
+        self.assertEqual(octopus.calls, [])
+        self.assertEqual(prices_dict["results"], OCTOPUS_DATA["results"])
+
+    def test_only_gaps_are_fetched(self):
+        results = [x for x in OCTOPUS_DATA["results"] if not "2023-03-28T10:00:00Z" <= x["valid_from"] < "2023-03-28T12:00:00Z"]
+        self.cache.add(results)
+        octopus = FakeOctopus()
+        prices_dict = price_cache.get_unit_rates("E-1R-TEST-A", START, END, octopus.fetch, cache=self.cache)
+        self.assertEqual(octopus.calls, [("2023-03-28T10:00:00Z", "2023-03-28T12:00:00Z")])
+        self.assertEqual(len(prices_dict["results"]), 48)
+
+    def test_open_ended_range_only_fetches_the_tail(self):
+        self.cache.add(OCTOPUS_DATA["results"])
+        octopus = FakeOctopus()
+        # 17:10 UK time, so tomorrow's prices should be out
+        price_cache.get_unit_rates("E-1R-TEST-A", "2023-03-28T20:10:00Z", None, octopus.fetch, cache=self.cache, now="2023-03-28T16:10:00Z")
+        self.assertEqual(octopus.calls, [("2023-03-29T00:00:00Z", None)])
+
+    def test_open_ended_range_is_covered_until_the_next_prices_are_due(self):
+        self.cache.add(OCTOPUS_DATA["results"])
+        octopus = FakeOctopus()
+        # The cache goes to 01:00 UK time on the 29th, past 23:00 on the 28th, and it's not 16:00 yet
+        prices_dict = price_cache.get_unit_rates("E-1R-TEST-A", "2023-03-28T10:00:00Z", None, octopus.fetch, cache=self.cache, now="2023-03-28T14:50:00Z")
+        self.assertEqual(octopus.calls, [])
+        self.assertEqual(len(prices_dict["results"]), 28)
+        self.assertEqual(self.cache.missing_ranges("2023-03-28T10:00:00Z", now="2023-03-28T15:00:00Z"), [(price_cache.parse_time("2023-03-29T00:00:00Z"), None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
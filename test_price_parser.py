@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import os
+import copy
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import price_parser
+
+with open(os.path.join(os.path.dirname(__file__), "octopus_test_data.json"), "rb") as fp:
+    OCTOPUS_BYTES = fp.read()
+OCTOPUS_DATA = json.loads(OCTOPUS_BYTES)
+
+
+def results(start, slots, skip=()):
+    start_time = pd.date_range(start, periods=slots, freq="30min", tz="UTC")
+    return [{'value_inc_vat': float(i), 'valid_from': t.strftime("%Y-%m-%dT%H:%M:%SZ"),
+             'valid_to': (t + pd.Timedelta('30m')).strftime("%Y-%m-%dT%H:%M:%SZ")}
+            for i, t in enumerate(start_time) if i not in skip][::-1]
+
+
+class TestTimestamps(unittest.TestCase):
+    def test_same_as_pandas(self):
+        stamps = ["2023-03-28T23:30:00Z", "1999-12-31T00:00:59Z", "2024-02-29T12:34:56Z"]
+        np.testing.assert_array_equal(price_parser.parse_timestamps(stamps), pd.to_datetime(stamps, utc=True).asi8)
+        np.testing.assert_array_equal(price_parser.parse_timestamps([s.encode() for s in stamps]), pd.to_datetime(stamps, utc=True).asi8)
+
+    def test_other_formats(self):
+        stamps = ["2023-03-28T23:30:00+01:00", "2023-03-28T23:30:00Z"]
+        np.testing.assert_array_equal(price_parser.parse_timestamps(stamps), pd.to_datetime(stamps, utc=True).asi8)
+
+
+class TestParse(unittest.TestCase):
+    def test_results(self):
+        rates = price_parser.parse_results(OCTOPUS_DATA["results"])
+        self.assertEqual(len(rates.start), 48)
+        self.assertTrue((np.diff(rates.start) == price_parser.SLOT_NS).all())
+        self.assertEqual(len(rates.gaps), 0)
+        self.assertEqual(rates.dst_days, [])
+        # Newest first from Octopus, oldest first here
+        self.assertEqual(rates.value[-1], OCTOPUS_DATA["results"][0]["value_inc_vat"])
+
+    def test_content_is_the_same(self):
+        from_results = price_parser.parse_results(OCTOPUS_DATA["results"])
+        from_bytes, next_url = price_parser.parse_content(OCTOPUS_BYTES)
+        self.assertIsNone(next_url)
+        for a, b in zip(from_results[:3], from_bytes[:3]):
+            np.testing.assert_array_equal(a, b)
+
+    def test_next_url(self):
+        content = json.dumps({"next": "https://api.octopus.energy/v1/?page=2&page_size=1500", "results": []}).encode()
+        self.assertEqual(price_parser.next_url(content), "https://api.octopus.energy/v1/?page=2&page_size=1500")
+
+    def test_gaps_and_duplicates(self):
+        rates = price_parser.parse_results(results("2023-03-01", 10, skip=(4, 5)) + results("2023-03-01", 2))
+        self.assertEqual(len(rates.start), 8)
+        np.testing.assert_array_equal(rates.gaps, [4])
+
+    def test_clocks_change(self):
+        rates = price_parser.parse_results(results("2023-03-25", 48 * 3))
+        self.assertEqual(rates.dst_days, [datetime.date(2023, 3, 26)])
+        rates = price_parser.parse_results(results("2023-10-28T23:00", 48 * 2))
+        self.assertEqual(rates.dst_days, [datetime.date(2023, 10, 29)])
+
+    def test_not_half_hours(self):
+        bad = copy.deepcopy(OCTOPUS_DATA["results"])
+        bad[3]["valid_to"] = bad[2]["valid_to"]
+        with self.assertRaises(ValueError):
+            price_parser.parse_results(bad)
+
+
+class TestFrame(unittest.TestCase):
+    def test_frame(self):
+        rates = price_parser.parse_results(OCTOPUS_DATA["results"])
+        prices = price_parser.to_frame(rates)
+        self.assertEqual(list(prices.columns), ['start_time', 'end_time', 'value_inc_vat', 'duration'])
+        self.assertEqual(str(prices.start_time.dtype), "datetime64[ns, UTC]")
+        self.assertEqual(prices.start_time.iloc[0].isoformat(), "2023-03-28T00:00:00+00:00")
+        self.assertTrue((prices.duration == pd.Timedelta('30m')).all())
+        # No copies of the arrays
+        self.assertTrue(np.shares_memory(prices.start_time.array._ndarray, rates.start))
+        self.assertEqual(price_parser.to_frame(rates, value_column='cost', scale=10000).cost.iloc[0], rates.value[0] * 10000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import os
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import price_parser
+from price_series import PriceSeries, SCALE, SLOT_SECONDS
+
+with open(os.path.join(os.path.dirname(__file__), "octopus_test_data.json")) as fp:
+    OCTOPUS_DATA = json.load(fp)
+
+
+def series(prices, first_slot=0):
+    return PriceSeries(first_slot + np.arange(len(prices)), np.round(np.array(prices, dtype=float) * SCALE))
+
+
+class TestPriceSeries(unittest.TestCase):
+    def test_from_rates(self):
+        s = PriceSeries.from_rates(price_parser.parse_results(OCTOPUS_DATA["results"]))
+        self.assertEqual(len(s), 48)
+        self.assertEqual(s.slot[0] * SLOT_SECONDS, datetime.datetime(2023, 3, 28, tzinfo=datetime.timezone.utc).timestamp())
+        self.assertTrue((np.diff(s.slot) == 1).all())
+        self.assertEqual(s.price.dtype, np.int64)
+        self.assertEqual(s.price[-1], round(OCTOPUS_DATA["results"][0]["value_inc_vat"] * SCALE))
+
+    def test_cheapest(self):
+        s = series([5, 1, 3, 1, 4, 2])
+        # Ties stay in time order
+        np.testing.assert_array_equal(s.cheapest(3), [1, 3, 5])
+        np.testing.assert_array_equal(s.by_price, [1, 3, 5, 2, 4, 0])
+        np.testing.assert_array_equal(s.cheapest(3), [1, 3, 5])
+        np.testing.assert_array_equal(s.cheapest(10), [1, 3, 5, 2, 4, 0])
+        np.testing.assert_array_equal(s.cheapest(2, mask=s.at_most(4) & (s.slot > 1)), [3, 5])
+
+    def test_partition_same_as_sort(self):
+        rng = np.random.default_rng(0)
+        prices = np.round(rng.normal(20, 5, 500), 1)
+        mask = rng.random(500) < 0.5
+        for n in (0, 1, 7, 100, 500):
+            self.assertEqual(list(series(prices).cheapest(n)), list(np.argsort(prices, kind='stable')[:n]))
+            masked = np.flatnonzero(mask)[np.argsort(prices[mask], kind='stable')][:n]
+            self.assertEqual(list(series(prices).cheapest(n, mask)), list(masked))
+
+    def test_masks(self):
+        s = series([5, -1, 10.31, 10.32, 0], first_slot=int(datetime.datetime(2023, 3, 1, tzinfo=datetime.timezone.utc).timestamp()) // SLOT_SECONDS)
+        np.testing.assert_array_equal(s.at_most(0), [False, True, False, False, True])
+        np.testing.assert_array_equal(s.at_most(10.31), [True, True, True, False, True])
+        np.testing.assert_array_equal(s.sorted_by_price(s.at_most(10.31)), [1, 4, 0, 2])
+        # Limits that don't come out exact in floating point
+        np.testing.assert_array_equal(series([0.57, 1.13, -9.96, -9.88]).at_most(0.57), [True, False, True, True])
+        np.testing.assert_array_equal(series([0.57, 1.13, -9.96, -9.88]).at_most(-9.96), [False, False, True, False])
+        # Naive times are UTC
+        np.testing.assert_array_equal(s.between(datetime.datetime(2023, 3, 1, 0, 30), datetime.datetime(2023, 3, 1, 1, 30)), [False, True, True, True, False])
+
+    def test_frame(self):
+        s = series([5, 1, 3])
+        frame = s.frame([2, 1])
+        self.assertEqual(list(frame.index), [2, 1])
+        self.assertEqual(list(frame.value_inc_vat), [3, 1])
+        self.assertEqual(frame.start_time.iloc[0], pd.Timestamp("1970-01-01T01:00", tz="UTC"))
+        self.assertTrue((frame.end_time - frame.start_time == pd.Timedelta('30m')).all())
+        self.assertEqual(list(s.frame(value_column='cost', fixed_point=True).cost), [50000, 10000, 30000])
+
+
+if __name__ == "__main__":
+    unittest.main()
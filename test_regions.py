@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import os
+import copy
+
+import numpy as np
+
+import regions
+
+with open(os.path.join(os.path.dirname(__file__), "octopus_test_data.json")) as fp:
+    OCTOPUS_DATA = json.load(fp)
+
+NAN = np.nan
+
+
+def prices_dict(values, first_slot=0):
+    # Octopus style results, newest first, for consecutive half hours from first_slot after 2023-03-28 00:00Z
+    results = []
+    for i, value in enumerate(values):
+        minutes = (first_slot + i) * 30
+        results.append({'valid_from': f"2023-03-28T{minutes // 60:02d}:{minutes % 60:02d}:00Z", 'value_inc_vat': value})
+    return {'results': results[::-1]}
+
+
+class TestStack(unittest.TestCase):
+    def test_aligns_regions(self):
+        grid = regions.stack({'A': prices_dict([10, 20, 30]), 'B': prices_dict([5, 6], first_slot=2)})
+        self.assertEqual(grid.tariffs, ['A', 'B'])
+        self.assertEqual(len(grid.starts), 4)
+        self.assertEqual(grid.starts[1] - grid.starts[0], regions.SLOT_NS)
+        np.testing.assert_array_equal(grid.values, [[10, 20, 30, NAN], [NAN, NAN, 5, 6]])
+
+    def test_real_data(self):
+        data = copy.deepcopy(OCTOPUS_DATA)
+        grid = regions.stack({'A': data, 'B': data})
+        self.assertEqual(grid.values.shape, (2, 48))
+        self.assertEqual(grid.values[0, -1], data['results'][0]['value_inc_vat'])
+
+    def test_empty(self):
+        grid = regions.stack({'A': {'results': []}})
+        self.assertEqual(grid.values.shape, (1, 0))
+
+
+class TestWindows(unittest.TestCase):
+    def test_cheapest_windows(self):
+        values = np.array([[10, 1, 1, 10, 2, 2],
+                           [1, NAN, 1, 5, 5, 9],
+                           [NAN, 3, NAN, 3, NAN, 3]])
+        found = regions.cheapest_windows(values, 2)
+        np.testing.assert_array_equal(found.start, [1, 2, -1])
+        np.testing.assert_allclose(found.mean, [1, 3, NAN])
+
+    def test_same_as_one_region_at_a_time(self):
+        rng = np.random.default_rng(1)
+        values = rng.random((12, 96)) * 30
+        found = regions.cheapest_windows(values, 8)
+        for i, row in enumerate(values):
+            means = np.convolve(row, np.ones(8) / 8, mode='valid')
+            self.assertEqual(found.start[i], np.argmin(means))
+            self.assertAlmostEqual(found.mean[i], means.min())
+
+    def test_too_long(self):
+        found = regions.cheapest_windows(np.ones((2, 3)), 4)
+        np.testing.assert_array_equal(found.start, [-1, -1])
+
+
+class TestChargePlans(unittest.TestCase):
+    def test_charge_plans(self):
+        values = np.array([[30, 5, 20, 1, 9],
+                           [2, NAN, 1, 7, 8]])
+        # 2.7kW is 1.35kWh a half hour, so 3kWh needs 3 half hours and 1kWh needs one
+        plans = regions.charge_plans(values, [3, 1])
+        np.testing.assert_array_equal(plans.slots, [3, 1])
+        np.testing.assert_array_equal(plans.chosen, [[False, True, False, True, True], [False, False, True, False, False]])
+        np.testing.assert_allclose(plans.mean, [5, 1])
+
+    def test_not_enough_prices(self):
+        plans = regions.charge_plans(np.array([[1, NAN, 2]]), 100)
+        self.assertEqual(plans.slots[0], 2)
+        np.testing.assert_array_equal(plans.chosen, [[True, False, True]])
+
+
+if __name__ == "__main__":
+    unittest.main()
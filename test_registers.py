@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+
+import registers
+from registers import HOLDING, INPUT
+
+
+class FakeInverter:
+    # Counts requests.  Anything not set in values reads as zero
+    def __init__(self, values=None):
+        self.values = values or {}
+        self.requests = []
+
+    def read(self, table, address, count):
+        self.requests.append((table, address, count))
+        return [self.values.get((table, address + i), 0) for i in range(count)]
+
+    def read_holding_registers(self, address, count):
+        return self.read(HOLDING, address, count)
+
+    def read_input_registers(self, address, count):
+        return self.read(INPUT, address, count)
+
+
+class TestPlanReads(unittest.TestCase):
+    def test_adjacent_reads_are_merged(self):
+        plan = registers.plan_reads([(HOLDING, 1091, 1), (HOLDING, 1092, 1), (HOLDING, 1100, 9)])
+        self.assertEqual(plan, [(HOLDING, 1091, 18)])
+
+    def test_tables_are_not_mixed(self):
+        plan = registers.plan_reads([(HOLDING, 1014, 1), (INPUT, 1014, 1)])
+        self.assertEqual(plan, [(HOLDING, 1014, 1), (INPUT, 1014, 1)])
+
+    def test_block_limit(self):
+        plan = registers.plan_reads([(INPUT, 0, 100), (INPUT, 100, 20), (INPUT, 120, 10)])
+        self.assertEqual(plan, [(INPUT, 0, 120), (INPUT, 120, 10)])
+        for table, start, count in plan:
+            self.assertLessEqual(count, registers.MAX_BLOCK)
+        with self.assertRaises(ValueError):
+            registers.plan_reads([(INPUT, 0, 126)])
+
+    def test_max_gap(self):
+        plan = registers.plan_reads([(HOLDING, 1018, 9), (HOLDING, 1070, 2)], max_gap=16)
+        self.assertEqual(plan, [(HOLDING, 1018, 9), (HOLDING, 1070, 2)])
+
+    def test_overlapping_and_duplicate_reads(self):
+        plan = registers.plan_reads([(HOLDING, 1018, 9), (HOLDING, 1018, 9), (HOLDING, 1020, 2)])
+        self.assertEqual(plan, [(HOLDING, 1018, 9)])
+
+    def test_charging_schedule_is_two_reads(self):
+        names = ['charge_slots_1_3', 'charge_slots_4_6', 'discharge_slot', 'charge_stop_soc',
+                 'discharge_stop_soc', 'discharge_power', 'ac_charge_enabled', 'inverter_time']
+        inverter = FakeInverter({(HOLDING, 45): 23, (HOLDING, 46): 3, (HOLDING, 47): 28})
+        registers.read_registers(inverter, names)
+        self.assertEqual(inverter.requests, [(HOLDING, 45, 7), (HOLDING, 1018, 91)])
+
+
+class TestDecode(unittest.TestCase):
+    def test_read_registers_decodes(self):
+        values = {(HOLDING, 1100): 23 << 8 | 30, (HOLDING, 1101): 2 << 8, (HOLDING, 1102): 1,
+                  (HOLDING, 45): 23, (HOLDING, 46): 3, (HOLDING, 47): 28, (HOLDING, 48): 22, (HOLDING, 49): 5, (HOLDING, 50): 9,
+                  (INPUT, 1062): 1, (INPUT, 1063): 5}
+        current = registers.read_registers(FakeInverter(values), ['charge_slots_1_3', 'inverter_time', 'load_total'])
+        self.assertEqual(current['charge_slots_1_3'][0], [datetime.time(23, 30), datetime.time(2, 0), 1])
+        self.assertEqual(current['inverter_time'], datetime.datetime(2023, 3, 28, 22, 5, 9))
+        self.assertEqual(current['load_total'], 65541)
+
+
+def half_hour(*args):
+    return int(datetime.datetime(*args, tzinfo=datetime.timezone.utc).timestamp()) // 1800
+
+
+class TestCompileSlots(unittest.TestCase):
+    def test_table(self):
+        self.assertEqual(len(registers.HALF_HOUR_WORDS), 48)
+        for i, word in enumerate(registers.HALF_HOUR_WORDS):
+            self.assertEqual(registers.decode_time(word), datetime.time(i // 2, i % 2 * 30))
+
+    def test_round_trip(self):
+        starts = [half_hour(2023, 3, 2, 4), half_hour(2023, 3, 1, 23, 30), half_hour(2023, 3, 1, 13)]
+        ends = [half_hour(2023, 3, 2, 5, 30), half_hour(2023, 3, 2, 1), half_hour(2023, 3, 1, 13, 30)]
+        compiled = registers.compile_slots(starts, ends)
+        blocks = registers.charge_slot_blocks(compiled)
+        self.assertEqual(list(blocks), [1100, 1018])
+        self.assertEqual(blocks[1100], [13 << 8, 13 << 8 | 30, 1, 23 << 8 | 30, 1 << 8, 1, 4 << 8, 5 << 8 | 30, 1])
+        self.assertEqual(blocks[1018], [0] * 9)
+        decoded = registers.decode_slots(blocks[1100] + blocks[1018])
+        self.assertEqual(decoded[:3], [[datetime.time(13), datetime.time(13, 30), 1], [datetime.time(23, 30), datetime.time(1), 1],
+                                       [datetime.time(4), datetime.time(5, 30), 1]])
+        self.assertEqual(decoded[3:], [[datetime.time(0), datetime.time(0), 0]] * 3)
+        self.assertEqual([registers.charge_slot_address(i) for i in range(6)], [1100, 1103, 1106, 1018, 1021, 1024])
+
+    def test_midnight(self):
+        compiled = registers.compile_slots([half_hour(2023, 3, 1, 22)], [half_hour(2023, 3, 2, 0)])
+        self.assertEqual(compiled, [[22 << 8, 0, 1]])
+        with self.assertRaises(ValueError):
+            registers.compile_slots([half_hour(2023, 3, 1, 22)], [half_hour(2023, 3, 2, 22)])
+
+    def test_invalid(self):
+        start = half_hour(2023, 3, 1, 2)
+        with self.assertRaises(ValueError):
+            registers.compile_slots([start], [start])
+        with self.assertRaises(ValueError):
+            registers.compile_slots([start, start + 1], [start + 2, start + 3])
+        # A day apart is the same time on the inverter's clock
+        with self.assertRaisesRegex(ValueError, "02:00-02:30 and 02:00-03:00 overlap"):
+            registers.compile_slots([start, start + 48], [start + 1, start + 50])
+        with self.assertRaises(ValueError):
+            registers.compile_slots([start + 2 * i for i in range(4)], [start + 2 * i + 1 for i in range(4)], slots_available=3)
+        self.assertEqual(len(registers.compile_slots([start + 2 * i for i in range(6)], [start + 2 * i + 1 for i in range(6)])), 6)
+
+    def test_usable_slots(self):
+        start = half_hour(2023, 3, 1, 2)
+        # Tomorrow's 02:30-03:00 clashes with today's 02:00-03:00, and a whole day can't be programmed at all
+        usable, unusable = registers.usable_slots([start + 48, start, start + 50, start + 96], [start + 50, start + 2, start + 52, start + 144])
+        self.assertEqual(usable, [(start, start + 2), (start + 50, start + 52)])
+        self.assertEqual(unusable, [(start + 48, start + 50), (start + 96, start + 144)])
+        self.assertEqual(len(registers.compile_slots(*zip(*usable))), 2)
+
+
+class TestDiffWrites(unittest.TestCase):
+    def test_nothing_changed(self):
+        current = {1100 + i: i for i in range(9)}
+        self.assertEqual(registers.diff_writes(current, dict(current)), [])
+
+    def test_only_changes_are_written(self):
+        current = {1100 + i: 0 for i in range(9)}
+        current[1091] = 80
+        desired = dict(current)
+        desired[1100] = 23 << 8
+        desired[1101] = 2 << 8
+        desired[1102] = 1
+        desired[1106] = 5
+        self.assertEqual(registers.diff_writes(current, desired), [(1100, [23 << 8, 2 << 8, 1]), (1106, [5])])
+
+    def test_unknown_current_values_are_written(self):
+        self.assertEqual(registers.diff_writes({}, {1091: 80, 1092: 1}), [(1091, [80, 1])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import unittest
+import asyncio
+import datetime
+
+import pandas as pd
+import pytz
+
+import scheduler_daemon
+from scheduler_daemon import SchedulerDaemon
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=pytz.utc)
+
+
+class FakePrices:
+    def __init__(self, start, end):
+        start_time = pd.date_range(start, end, freq="30min", inclusive="left", tz="UTC")
+        self.prices = pd.DataFrame({'start_time': start_time, 'end_time': start_time + pd.Timedelta('30m')})
+
+
+class FakeOctopus:
+    # Has prices until 22:00 UTC today (23:00 BST) until published_at, then until 22:00 tomorrow
+    def __init__(self, published_at):
+        self.published_at = published_at
+        self.now = None
+        self.fetches = 0
+
+    def prices(self, start_time):
+        self.fetches += 1
+        end = utc(2023, 5, 1, 22) if self.now < self.published_at else utc(2023, 5, 2, 22)
+        return FakePrices(start_time, end)
+
+
+class Harness:
+    def __init__(self, now, plan, published_at=utc(2023, 5, 1, 15, 20)):
+        self.now = now
+        self.plan = plan
+        self.programmed = []
+        self.octopus = FakeOctopus(published_at)
+        self.daemon = SchedulerDaemon(plan_fn=lambda prices, now: self.plan.copy(), program_fn=lambda slots, dummy: self.programmed.append(slots),
+                                      prices_fn=self.octopus.prices, now_fn=lambda: self.now)
+
+    def step(self, now):
+        self.now = now
+        self.octopus.now = now
+        asyncio.run(self.daemon.step())
+
+
+def slots(*pairs):
+    return pd.DataFrame({'start_time': [pd.Timestamp(s) for s, e in pairs], 'end_time': [pd.Timestamp(e) for s, e in pairs]})
+
+
+class TestSchedulerDaemon(unittest.TestCase):
+    def test_prices_expected_until(self):
+        # 2023-05-01 is BST, so 23:00 UK is 22:00 UTC
+        self.assertEqual(scheduler_daemon.prices_expected_until(utc(2023, 5, 1, 10)), utc(2023, 5, 1, 22))
+        self.assertEqual(scheduler_daemon.prices_expected_until(utc(2023, 5, 1, 15, 30)), utc(2023, 5, 2, 22))
+        self.assertEqual(scheduler_daemon.prices_expected_until(utc(2023, 12, 1, 16, 30)), utc(2023, 12, 2, 23))
+
+    def test_only_programs_when_the_plan_changes(self):
+        plan = slots((utc(2023, 5, 1, 1), utc(2023, 5, 1, 3)))
+        h = Harness(utc(2023, 5, 1, 0, 0), plan)
+        h.step(utc(2023, 5, 1, 0, 0))
+        self.assertEqual(len(h.programmed), 1)
+        h.step(utc(2023, 5, 1, 0, 30))
+        # Halfway through the slot the plan only has what's left of it, which is the same thing
+        h.plan = slots((utc(2023, 5, 1, 2), utc(2023, 5, 1, 3)))
+        h.step(utc(2023, 5, 1, 2, 0))
+        self.assertEqual(len(h.programmed), 1)
+        h.plan = slots((utc(2023, 5, 1, 4), utc(2023, 5, 1, 5)))
+        h.step(utc(2023, 5, 1, 2, 30))
+        self.assertEqual(len(h.programmed), 2)
+
+    def test_polls_until_prices_are_published(self):
+        h = Harness(utc(2023, 5, 1, 10), slots())
+        h.step(utc(2023, 5, 1, 10))
+        h.step(utc(2023, 5, 1, 10, 30))
+        # We have today's prices, so no need to ask again until the afternoon
+        self.assertEqual(h.octopus.fetches, 1)
+        self.assertEqual(h.daemon.next_wake(utc(2023, 5, 1, 10, 40)), utc(2023, 5, 1, 11))
+        h.step(utc(2023, 5, 1, 15, 0))
+        self.assertEqual(h.octopus.fetches, 2)
+        self.assertEqual(h.daemon.next_wake(utc(2023, 5, 1, 15, 0)), utc(2023, 5, 1, 15, 5))
+        h.step(utc(2023, 5, 1, 15, 5))
+        h.step(utc(2023, 5, 1, 15, 30))
+        self.assertEqual(h.octopus.fetches, 4)
+        self.assertEqual(h.daemon.next_wake(utc(2023, 5, 1, 15, 30)), utc(2023, 5, 1, 16))
+        h.step(utc(2023, 5, 1, 16))
+        self.assertEqual(h.octopus.fetches, 4)
+
+    def test_errors_dont_stop_it(self):
+        h = Harness(utc(2023, 5, 1, 10), slots())
+        def broken(slots, dummy):
+            raise OSError("No route to host")
+        h.daemon.program_fn = broken
+        h.plan = slots((utc(2023, 5, 1, 12), utc(2023, 5, 1, 13)))
+        h.step(utc(2023, 5, 1, 10))
+        self.assertIsNone(h.daemon.programmed)
+        h.daemon.program_fn = lambda slots, dummy: h.programmed.append(slots)
+        h.step(utc(2023, 5, 1, 10, 30))
+        self.assertEqual(len(h.programmed), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import unittest
+import time
+
+import numpy as np
+
+import soc_simulator
+
+
+class TestSimulate(unittest.TestCase):
+    def test_runs_down_to_the_floor(self):
+        # 13kWh battery at 50%, 1kWh per half hour.  5.2kWh above the floor lasts 5.2 half hours.
+        sim = soc_simulator.simulate([False] * 8, [1.0] * 8, [0.0] * 8, 13, 50, prices=[10] * 8)
+        np.testing.assert_allclose(sim.soc[:6], [50, 50 - 100 / 13, 50 - 200 / 13, 50 - 300 / 13, 50 - 400 / 13, 50 - 500 / 13])
+        np.testing.assert_allclose(sim.soc[6:], 10)
+        np.testing.assert_allclose(sim.grid_import, [0, 0, 0, 0, 0, 0.8, 1, 1])
+        self.assertAlmostEqual(sim.cost, 28)
+
+    def test_charging(self):
+        # Charging at 2.7kW adds 1.35kWh a half hour on top of running the house from the grid, until the ceiling
+        sim = soc_simulator.simulate([True] * 3, [0.5] * 3, [0.0] * 3, 10, 50, ceiling=70)
+        np.testing.assert_allclose(sim.soc, [50, 63.5, 70, 70])
+        np.testing.assert_allclose(sim.grid_import, [1.85, 1.15, 0.5])
+
+    def test_solar(self):
+        # Spare sun fills the battery (at up to the charge rate), the rest is exported
+        sim = soc_simulator.simulate([False] * 2, [0.5] * 2, [2.5] * 2, 10, 90, export_prices=[15] * 2)
+        np.testing.assert_allclose(sim.soc, [90, 100, 100])
+        np.testing.assert_allclose(sim.grid_export, [1, 2])
+        self.assertAlmostEqual(sim.cost, -45)
+
+    def test_many_schedules_at_once(self):
+        prices = np.array([30, 5, 5, 30], dtype=float)
+        schedules = [[False, False, False, False], [False, True, True, False], [True, False, False, True]]
+        sim = soc_simulator.simulate(schedules, [1.0] * 4, [0.0] * 4, 13, 10, prices)
+        self.assertEqual(sim.soc.shape, (3, 5))
+        self.assertEqual(list(np.argsort(sim.cost)), [1, 0, 2])
+        # Each row is the same as simulating it on its own
+        for i, schedule in enumerate(schedules):
+            np.testing.assert_allclose(soc_simulator.simulate(schedule, [1.0] * 4, [0.0] * 4, 13, 10, prices).soc, sim.soc[i])
+
+    def test_thousands_per_second(self):
+        rng = np.random.default_rng(0)
+        schedules = rng.random((5000, 48)) < 0.2
+        started = time.perf_counter()
+        soc_simulator.simulate(schedules, rng.random(48), rng.random(48), 13, 30, rng.random(48) * 30)
+        self.assertLess(time.perf_counter() - started, 1)
+
+    def test_wrong_length(self):
+        with self.assertRaises(ValueError):
+            soc_simulator.simulate([False] * 4, [1.0] * 3, [0.0] * 3, 13, 50)
+
+
+class TestRuntime(unittest.TestCase):
+    def test_runtime_hours(self):
+        load = [1.0, 1.0, 0.5, 0.5]
+        # 10% of a 15kWh battery is 1.5kWh
+        self.assertAlmostEqual(soc_simulator.runtime_hours(load, [0] * 4, 15, 20), 0.75)
+        self.assertAlmostEqual(soc_simulator.runtime_hours(load, [0] * 4, 100, 12.75), 1.75)
+        self.assertEqual(soc_simulator.runtime_hours(load, [0] * 4, 100, 100), 2)
+        self.assertEqual(soc_simulator.runtime_hours(load, [0] * 4, 15, 10), 0)
+
+    def test_the_sun_comes_up(self):
+        self.assertEqual(soc_simulator.runtime_hours([1.0] * 4, [0, 0, 1.0, 1.0], 10, 30), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import datetime
+import tempfile
+
+import numpy as np
+import pytz
+
+import solar_forecast
+from solar_forecast import SolarForecast, SolarForecastError
+
+NOW = datetime.datetime(2023, 5, 1, 17, tzinfo=pytz.utc).timestamp() # 18:00 BST
+
+
+class FakeClock:
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeForecastSolar:
+    # Sunrise at 06:00 and 1kWh an hour until 10:00 (BST) today and tomorrow
+    def __init__(self):
+        self.fetches = 0
+        self.down = False
+
+    def __call__(self):
+        self.fetches += 1
+        if self.down:
+            raise SolarForecastError("forecast.solar said 429: Rate limit for API calls reached.")
+        result = {}
+        for day in ("2023-05-01", "2023-05-02"):
+            result[f"{day} 06:00:00"] = 0
+            for hour in (7, 8, 9, 10):
+                result[f"{day} {hour:02}:00:00"] = 1000
+        return result
+
+
+class TestSolarForecast(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "solar_forecast.json")
+        self.api = FakeForecastSolar()
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def forecast(self):
+        return SolarForecast(self.path, fetch_fn=self.api, clock=self.clock)
+
+    def test_parse_periods(self):
+        days = solar_forecast.parse_periods({"2023-05-01 07:00:00": 1000, "2023-05-01 06:00:00": 0})
+        six_am = datetime.datetime(2023, 5, 1, 5, tzinfo=pytz.utc).timestamp()
+        self.assertEqual(days, {"2023-05-01": [[six_am - 3600, six_am, 0], [six_am, six_am + 3600, 1000]]})
+
+    def test_cached_in_memory_and_on_disk(self):
+        self.assertEqual(self.forecast().daily_kwh(datetime.date(2023, 5, 2)), 4)
+        forecast = self.forecast()
+        self.assertEqual(forecast.daily_kwh(datetime.date(2023, 5, 2)), 4)
+        self.assertEqual(forecast.daily_kwh(datetime.date(2023, 5, 1)), 4)
+        self.assertEqual(self.api.fetches, 1)
+        self.clock.now += solar_forecast.TTL_SECONDS
+        forecast.daily_kwh(datetime.date(2023, 5, 2))
+        self.assertEqual(self.api.fetches, 2)
+
+    def test_falls_back_to_the_last_forecast(self):
+        self.forecast().daily_kwh(datetime.date(2023, 5, 2))
+        self.api.down = True
+        self.clock.now += 6 * 3600
+        forecast = self.forecast()
+        self.assertEqual(forecast.daily_kwh(datetime.date(2023, 5, 2)), 4)
+        # Not asking again straight away
+        forecast.daily_kwh(datetime.date(2023, 5, 2))
+        self.assertEqual(self.api.fetches, 2)
+
+    def test_no_forecast_at_all(self):
+        self.api.down = True
+        with self.assertRaises(SolarForecastError):
+            self.forecast().daily_kwh(datetime.date(2023, 5, 2))
+
+    def test_half_hourly(self):
+        forecast = self.forecast()
+        kwh = forecast.half_hourly_kwh(datetime.datetime(2023, 5, 1, 17, 10, tzinfo=pytz.utc))
+        self.assertEqual(len(kwh), 48)
+        # Tomorrow 06:00-10:00 BST is 05:00-09:00 UTC, half hours 24 to 31 from 17:00
+        expected = np.zeros(48)
+        expected[24:32] = 0.5
+        np.testing.assert_allclose(kwh, expected)
+        # The day after tomorrow isn't in the forecast, which doesn't mean we need to ask again
+        forecast.half_hourly_kwh(datetime.datetime(2023, 5, 2, 12, tzinfo=pytz.utc))
+        self.assertEqual(self.api.fetches, 1)
+
+
+class FakeResponse:
+    def __init__(self, status_code, json, text=""):
+        self.status_code = status_code
+        self._json = json
+        self.text = text
+
+    def json(self):
+        return self._json
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, headers=None, timeout=None):
+        return self.response
+
+
+class TestFetchPeriods(unittest.TestCase):
+    def test_throttled(self):
+        throttled = FakeResponse(429, {'result': None, 'message': {'type': 'error'}}, "Rate limit for API calls reached.")
+        with self.assertRaises(SolarForecastError):
+            solar_forecast.fetch_periods(session=FakeSession(throttled))
+
+    def test_ok(self):
+        ok = FakeResponse(200, {'result': {"2023-05-01 06:00:00": 0}})
+        self.assertEqual(solar_forecast.fetch_periods(session=FakeSession(ok)), {"2023-05-01 06:00:00": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
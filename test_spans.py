@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import unittest
+import io
+import json
+import contextlib
+
+import spans
+import agile_prices
+from inverter import Inverter
+from backtest import octopus_results
+from test_backtest import history
+from test_inverter import FakeModbusClient
+
+
+class TestSpans(unittest.TestCase):
+    def setUp(self):
+        spans.enable()
+
+    def tearDown(self):
+        spans.disable()
+        spans.phases.clear()
+
+    def test_disabled(self):
+        spans.disable()
+        spans.phases.clear()
+        with spans.span("nothing"):
+            pass
+        self.assertIs(spans.span("nothing"), spans.NO_SPAN)
+        self.assertEqual(spans.timed()(lambda x: x + 1)(1), 2)
+        self.assertEqual(spans.summary(), [])
+
+    def test_span_and_timed(self):
+        @spans.timed()
+        def inner(x):
+            return x * 2
+
+        @spans.timed("outer phase")
+        def outer():
+            with spans.span("loop"):
+                return [inner(x) for x in range(3)]
+
+        self.assertEqual(outer(), [0, 2, 4])
+        self.assertEqual(inner.__name__, "inner")
+        summary = {phase['phase']: phase for phase in spans.summary()}
+        self.assertEqual(list(summary), ["inner", "loop", "outer phase"])
+        self.assertEqual(summary["inner"]['count'], 3)
+        self.assertEqual(summary["outer phase"]['count'], 1)
+        self.assertGreaterEqual(summary["outer phase"]['seconds'], summary["loop"]['seconds'])
+
+    def test_failures_are_timed_too(self):
+        @spans.timed()
+        def broken():
+            raise ValueError("no")
+        with self.assertRaises(ValueError):
+            broken()
+        self.assertEqual(spans.summary()[0]['count'], 1)
+
+    def test_output(self):
+        spans.record("octopus", 0.25)
+        spans.record("octopus", 0.5)
+        out = io.StringIO()
+        spans.write_json_lines(out, when=1680000000)
+        self.assertEqual([json.loads(line) for line in out.getvalue().splitlines()],
+                         [{'time': 1680000000, 'phase': 'octopus', 'count': 2, 'seconds': 0.75, 'max_seconds': 0.5}])
+        key, point = spans.influx_lines(when=1680000000, tags={'host': 'pi'})[0]
+        self.assertEqual(point, "agile_prices_profile,host=pi,phase=octopus count=2i,seconds=0.75,max_seconds=0.5 1680000000000000000")
+
+    def test_modbus_and_prices(self):
+        inverter = Inverter("ew11-1", client=FakeModbusClient())
+        inverter.write_registers(1091, [80])
+        inverter.read_holding_registers(1091, 1)
+        inverter.read_holding_registers(1100, 9)
+        with contextlib.redirect_stdout(io.StringIO()):
+            prices = agile_prices.Prices(prices_dict=octopus_results(history(2)))
+            prices.get_economy_slots()
+        counts = {phase['phase']: phase['count'] for phase in spans.summary()}
+        self.assertEqual(counts["modbus write_registers"], 1)
+        self.assertEqual(counts["modbus read_holding_registers"], 2)
+        for phase in ("Prices", "build_dataframe", "get_two_hour_windows", "get_windows", "get_economy_slots"):
+            self.assertIn(phase, counts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import tempfile
+
+import numpy as np
+
+import telemetry
+from telemetry import RingBuffer, TelemetryPoller
+from registers import INPUT
+
+T0 = 1682899200 # 2023-05-01 00:00 UTC
+
+
+class FakeInverter:
+    # Anything not set in values reads as zero
+    def __init__(self, values=None):
+        self.values = values or {}
+        self.requests = []
+
+    def read_input_registers(self, address, count):
+        self.requests.append((INPUT, address, count))
+        return [self.values.get((INPUT, address + i), 0) for i in range(count)]
+
+
+class FakeClock:
+    def __init__(self, now=T0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_keeps_the_latest_in_order(self):
+        buffer = RingBuffer(capacity=4, width=1)
+        for i in range(6):
+            buffer.append(i, [i * 10])
+        times, values = buffer.window()
+        self.assertEqual(len(buffer), 4)
+        self.assertEqual(list(times), [2, 3, 4, 5])
+        self.assertEqual(list(values[:, 0]), [20, 30, 40, 50])
+
+
+class TestTelemetry(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "telemetry", "telemetry.bin")
+        # 55% SOC, 1500.0W load, 70000 * 0.1W = 7000W of PV (u32 split over two registers)
+        self.inverter = FakeInverter({(INPUT, 1014): 55, (INPUT, 1038): 15000, (INPUT, 1): 1, (INPUT, 2): 4464})
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_sample(self):
+        poller = TelemetryPoller(self.inverter, self.path, clock=self.clock)
+        row = poller.sample()
+        self.assertEqual(dict(zip(telemetry.FIELD_NAMES, row))['load_w'], 1500)
+        self.assertEqual(dict(zip(telemetry.FIELD_NAMES, row))['pv_w'], 7000)
+        # Everything comes back in a couple of block reads
+        self.assertEqual(len(self.inverter.requests), 2)
+
+    def test_only_finished_half_hours_are_flushed(self):
+        poller = TelemetryPoller(self.inverter, self.path, clock=self.clock)
+        for t in range(T0, T0 + 2400, 60):
+            self.clock.now = t
+            if t == T0 + 1800:
+                self.inverter.values[(INPUT, 1014)] = 65
+            poller.sample()
+        self.assertEqual(poller.flush(), 1)
+        self.assertEqual(poller.flush(), 0)
+        records = telemetry.read_half_hours(self.path)
+        self.assertEqual(list(records['start']), [T0])
+        self.assertEqual(list(records['samples']), [30])
+        self.assertEqual(records['soc'][0], 55)
+        # Stopping writes the half hour we're part way through
+        self.assertEqual(poller.flush(everything=True), 1)
+        records = telemetry.read_half_hours(self.path)
+        self.assertEqual(list(records['start']), [T0, T0 + 1800])
+        self.assertEqual(records['soc'][1], 65)
+
+    def test_finished_half_hours_are_archived(self):
+        archive = telemetry.get_archive(self.tmp.name)
+        poller = TelemetryPoller(self.inverter, self.path, clock=self.clock, archive=archive)
+        for t in range(T0, T0 + 2400, 60):
+            self.clock.now = t
+            poller.sample()
+        poller.flush()
+        poller.flush(everything=True)
+        # The half hour we stopped part way through is only in the poller's file
+        archived = telemetry.get_archive(self.tmp.name).range()
+        self.assertEqual(list(archived['start']), [T0])
+        self.assertEqual(list(archived['samples']), [30])
+        self.assertEqual(list(archived['load_w']), [1500])
+
+    def test_records_for_the_same_half_hour_are_merged(self):
+        first = TelemetryPoller(self.inverter, self.path, clock=self.clock)
+        for t in range(T0, T0 + 300, 60):
+            self.clock.now = t
+            first.sample()
+        first.flush(everything=True)
+        # Restarted with a different load part way through the half hour
+        self.inverter.values[(INPUT, 1038)] = 30000
+        second = TelemetryPoller(self.inverter, self.path, clock=self.clock)
+        for t in range(T0 + 600, T0 + 1800, 60):
+            self.clock.now = t
+            second.sample()
+        self.clock.now = T0 + 1800
+        second.flush()
+        self.assertEqual(len(np.fromfile(self.path, dtype=telemetry.RECORD)), 2)
+        records = telemetry.read_half_hours(self.path)
+        self.assertEqual(list(records['samples']), [25])
+        self.assertAlmostEqual(float(records['load_w'][0]), (5 * 1500 + 20 * 3000) / 25, places=2)
+        self.assertEqual(len(telemetry.read_half_hours(self.path, since=T0 + 1800)), 0)
+
+    def test_missing_file(self):
+        self.assertEqual(len(telemetry.read_half_hours(self.path)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
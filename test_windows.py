@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import unittest
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from windows import non_overlapping_windows, window_means
+
+with open(os.path.join(os.path.dirname(__file__), "octopus_test_data.json")) as fp:
+    OCTOPUS_DATA = json.load(fp)
+
+
+def old_remove_overlap_and_bounds(window, window_length):
+    # The original O(n^2) remove_overlap + add_window_bounds from agile_prices.py, kept here to check against
+    temp_frame = window.copy()
+    for i1 in window.itertuples():
+        window_interval = pd.Interval(i1.start_time - window_length, i1.start_time + pd.Timedelta('30m'))
+        for i2 in window.itertuples():
+            if i1.Index == i2.Index:
+                continue
+            wi2 = pd.Interval(i2.start_time - window_length, i2.start_time + pd.Timedelta('30m'))
+            if window_interval.overlaps(wi2):
+                if i2.value_inc_vat > i1.value_inc_vat:
+                    temp_frame.drop(i2.Index, inplace=True, errors='ignore')
+    start_time_list, end_time_list, values_list = [], [], []
+    for each in temp_frame.itertuples():
+        start_time_list.append(each.start_time - window_length)
+        end_time_list.append(each.start_time + pd.Timedelta('30m'))
+        values_list.append(each.value_inc_vat)
+    return pd.DataFrame({'start_time': start_time_list, 'end_time': end_time_list, 'value_inc_vat': values_list})
+
+
+def rolling_windows(prices, length, min_periods):
+    # The same steps as Prices.get_two_hour_windows up to the overlap removal
+    windows = prices.rolling(length, min_periods=min_periods, on='start_time').mean(numeric_only=True)
+    windows.dropna(inplace=True)
+    windows.sort_values(by='value_inc_vat', inplace=True)
+    windows.drop(windows[windows.value_inc_vat > prices.value_inc_vat.mean()].index, inplace=True)
+    return windows
+
+
+def fixture_prices():
+    results = OCTOPUS_DATA["results"]
+    prices = pd.DataFrame({'start_time': pd.DatetimeIndex(x['valid_from'] for x in results),
+                           'value_inc_vat': [x['value_inc_vat'] for x in results]})
+    return prices.sort_values(by="start_time").reset_index(drop=True)
+
+
+def random_prices(days, seed):
+    rng = np.random.default_rng(seed)
+    start_time = pd.date_range("2023-01-01", periods=days * 48, freq="30min", tz="UTC")
+    # Rounded so that there are plenty of ties, which is where the overlap rules get interesting
+    value_inc_vat = np.round(rng.normal(25, 8, len(start_time)), 0)
+    return pd.DataFrame({'start_time': start_time, 'value_inc_vat': value_inc_vat})
+
+
+class TestNonOverlappingWindows(unittest.TestCase):
+    def check_same_as_old(self, prices, length, window_length, min_periods):
+        windows = rolling_windows(prices, length, min_periods)
+        expected = old_remove_overlap_and_bounds(windows, pd.Timedelta(window_length))
+        actual = non_overlapping_windows(windows, pd.Timedelta(window_length))
+        pd.testing.assert_frame_equal(actual, expected)
+
+    def test_two_hour_windows_match_old(self):
+        self.check_same_as_old(fixture_prices(), '2h', '1h30m', 4)
+
+    def test_four_hour_windows_match_old(self):
+        self.check_same_as_old(fixture_prices(), '4h', '3h30m', 8)
+
+    def test_random_days_match_old(self):
+        for seed in range(2):
+            self.check_same_as_old(random_prices(4, seed), '2h', '1h30m', 4)
+            self.check_same_as_old(random_prices(4, seed), '4h', '3h30m', 8)
+
+    def test_cheapest_two_hour_window(self):
+        windows = non_overlapping_windows(rolling_windows(fixture_prices(), '2h', 4), pd.Timedelta('1h30m'))
+        self.assertEqual(windows.iloc[0].start_time.isoformat(), "2023-03-28T01:30:00+00:00")
+        self.assertEqual(windows.iloc[0].end_time.isoformat(), "2023-03-28T03:30:00+00:00")
+
+    def test_empty(self):
+        windows = rolling_windows(fixture_prices(), '2h', 4).head(0)
+        self.assertTrue(non_overlapping_windows(windows, pd.Timedelta('1h30m')).empty)
+
+    def test_not_a_dataframe(self):
+        with self.assertRaises(TypeError):
+            non_overlapping_windows([1, 2, 3], pd.Timedelta('1h30m'))
+
+
+class TestWindowMeans(unittest.TestCase):
+    def check_same_as_rolling(self, prices, slots_per_window):
+        length = pd.Timedelta(minutes=30 * slots_per_window)
+        rolling = prices.rolling(length, min_periods=slots_per_window, on='start_time').mean(numeric_only=True).dropna()
+        last_slot, means = window_means(prices.start_time.values.view('i8'), prices.value_inc_vat.to_numpy(), slots_per_window)
+        self.assertEqual(list(prices.start_time.iloc[last_slot]), list(rolling.start_time))
+        np.testing.assert_allclose(means, rolling.value_inc_vat.to_numpy(), rtol=0, atol=1e-9)
+
+    def test_matches_rolling(self):
+        for slots_per_window in (1, 3, 4, 8, 13):
+            self.check_same_as_rolling(fixture_prices(), slots_per_window)
+
+    def test_gaps_are_skipped(self):
+        prices = random_prices(2, 0).drop(index=[10, 50, 51]).reset_index(drop=True)
+        self.check_same_as_rolling(prices, 4)
+        last_slot, means = window_means(prices.start_time.values.view('i8'), prices.value_inc_vat.to_numpy(), 4)
+        self.assertEqual(len(last_slot), 96 - 3 - 4 - 5)
+
+    def test_too_long(self):
+        last_slot, means = window_means(fixture_prices().start_time.values.view('i8'), fixture_prices().value_inc_vat.to_numpy(), 49)
+        self.assertEqual(len(last_slot), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
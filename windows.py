@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# Picking out the cheapest charging windows from a frame of rolling average prices.
+
+import numpy as np
+import pandas as pd
+
+SLOT_LENGTH = pd.Timedelta('30m')
+
+
+def range_min(values, lo, hi):
+    # Minimum of values[lo[i]:hi[i]] for every i, using a sparse table so it's O(n log n) in total rather than
+    # a Python loop per window.  Every range must have at least one element in it.
+    n = len(values)
+    levels = max(1, int(np.log2(n)) + 1)
+    table = np.full((levels, n), np.inf)
+    table[0] = values
+    for k in range(1, levels):
+        half = 1 << (k - 1)
+        table[k, :n - half] = np.minimum(table[k - 1, :n - half], table[k - 1, half:])
+    level = np.log2(hi - lo).astype(int)
+    return np.minimum(table[level, lo], table[level, hi - (1 << level)])
+
+
+def non_overlapping_windows(window, window_length):
+    # Window is a DataFrame of rolling averages, sorted by price, where start_time is the start of the *last* 30m
+    # slot in the window (that's how rolling() labels them).  window_length needs to be a pandas Timedelta.
+    # A window is kept unless a strictly cheaper window overlaps it.  Two windows overlap when their start times
+    # are less than window_length + 30m apart, so sorting by time and looking either side of each window is enough.
+    # Returns a new frame with the real start and end of each kept window, still in price order.
+    if type(window) != pd.core.frame.DataFrame:
+        print("ERROR: Window is not a DataFrame")
+        raise TypeError
+    if window.empty:
+        return pd.DataFrame({'start_time': window.start_time, 'end_time': window.start_time, 'value_inc_vat': window.value_inc_vat}).reset_index(drop=True)
+    starts = window.start_time.values.view('i8')
+    values = window.value_inc_vat.to_numpy(dtype=float)
+    reach = (window_length + SLOT_LENGTH).value
+    order = np.argsort(starts, kind='stable')
+    sorted_starts = starts[order]
+    lo = np.searchsorted(sorted_starts, sorted_starts - reach, side='right')
+    hi = np.searchsorted(sorted_starts, sorted_starts + reach, side='left')
+    cheapest_nearby = range_min(values[order], lo, hi)
+    keep = np.empty(len(values), dtype=bool)
+    keep[order] = values[order] <= cheapest_nearby
+    kept = window[keep]
+    return pd.DataFrame({'start_time': kept.start_time - window_length,
+                         'end_time': kept.start_time + SLOT_LENGTH,
+                         'value_inc_vat': kept.value_inc_vat}).reset_index(drop=True)
+
+
+def window_means(starts, values, slots_per_window):
+    # Mean price of every run of slots_per_window contiguous half hours, from prefix sums so that any
+    # duration costs the same O(n).  starts is int64 nanoseconds, sorted, values the matching prices.
+    # Returns (index of the last slot in each window, mean price) for windows with no gaps in them,
+    # labelled the same way rolling() labels them so the rest of the code doesn't need to change.
+    n = len(values)
+    if slots_per_window < 1 or n < slots_per_window:
+        return np.array([], dtype=int), np.array([], dtype=float)
+    prefix = np.concatenate(([0.0], np.cumsum(values, dtype=float)))
+    means = (prefix[slots_per_window:] - prefix[:-slots_per_window]) / slots_per_window
+    # Prices only have four decimal places.  Rounding off the cumulative sum noise means windows that really
+    # are the same price compare as equal, which matters when deciding which overlapping window to keep.
+    means = np.round(means, 9)
+    span = starts[slots_per_window - 1:] - starts[:n - slots_per_window + 1]
+    contiguous = span == (slots_per_window - 1) * SLOT_LENGTH.value
+    last_slot = np.arange(slots_per_window - 1, n)[contiguous]
+    return last_slot, means[contiguous]